@@ -0,0 +1,108 @@
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_processor import DATE_COLUMNS, prepare_rows
+
+def log(message):
+    print(f"[LOG] {message}", file=sys.stderr)
+
+# Target column types of Thera_Ledger_Transactions, as get_column_types returns them
+LEDGER_COLUMN_TYPES = {
+    'id': 'text', 'description': 'text', 'status': 'text', 'ledger_id': 'text',
+    'effective_date': 'datetime', 'posted_at': 'datetime', 'metadata': 'text',
+    'amount_usd': 'money', 'currency_usd': 'text', 'amount_eur': 'money', 'currency_eur': 'text',
+    'metadata_lateststripechargeid': 'text', 'metadata_paymentid': 'text',
+    'metadata_stripebalancetrxid': 'text', 'metadata_stripeexchangerate': 'numeric',
+    'metadata_type': 'text', 'effective_at': 'datetime'
+}
+
+def synthetic_ledger_export(rows, seed=42):
+    """Ledger export with cleaned column names, shaped like a real CSV read"""
+    rng = np.random.default_rng(seed)
+    ids = np.arange(rows).astype(str)
+    dates = (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s'))
+    date_text = pd.Series(dates.strftime('%Y-%m-%d %H:%M:%S')) + ' UTC'
+
+    def sometimes(values, probability):
+        series = pd.Series(values, dtype=object)
+        return series.where(rng.random(rows) < probability)
+
+    df = pd.DataFrame({
+        'id': 'lt_' + pd.Series(ids),
+        'description': sometimes(rng.choice(['Pay-in', 'Refund', 'Fee'], rows), 0.9),
+        'status': rng.choice(['SUCCEEDED', 'PENDING', 'FAILED'], rows),
+        'ledger_id': rng.choice(['ledger_a', 'ledger_b'], rows),
+        'effective_date': date_text,
+        'posted_at': sometimes(date_text, 0.7),
+        'metadata': '{}',
+        'amount_usd': np.where(rng.random(rows) < 0.8, rng.integers(100, 1_000_000, rows) / 100, np.nan),
+        'currency_usd': sometimes(np.full(rows, 'USD'), 0.8),
+        'amount_eur': np.where(rng.random(rows) < 0.1, rng.integers(100, 1_000_000, rows) / 100, np.nan),
+        'currency_eur': sometimes(np.full(rows, 'EUR'), 0.1),
+        'metadata_latestStripeChargeId': sometimes('ch_' + pd.Series(ids), 0.7),
+        'metadata_paymentId': sometimes('pi_' + pd.Series(ids), 0.7),
+        'metadata_stripeBalanceTrxId': sometimes('txn_' + pd.Series(ids), 0.7),
+        'metadata_stripeExchangeRate': np.where(rng.random(rows) < 0.5, rng.random(rows) + 0.5, np.nan),
+        'metadata_type': rng.choice(['PAY_IN_STARTED', 'PAY_IN_SUCCEEDED'], rows),
+        'effective_at': date_text
+    })
+    return df
+
+def prepare_rows_per_cell(df):
+    """Reference: the apply/lambda coercion the upload path used before"""
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(object).where(df[col].notna(), None)
+            df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else None)
+        elif col in DATE_COLUMNS:
+            df[col] = df[col].apply(lambda x: x.replace(' UTC', '') if isinstance(x, str) else x)
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+            df[col] = df[col].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notnull(x) else None)
+        else:
+            df[col] = df[col].replace({'nan': None, 'None': None, '': None})
+
+    data = df.astype(object).where(df.notna(), None).values.tolist()
+    return [tuple(None if pd.isna(x) else x for x in row) for row in data]
+
+def time_call(func, df, repeat):
+    best = None
+    for _ in range(repeat):
+        frame = df.copy()
+        start = time.perf_counter()
+        func(frame)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark upload type coercion on a synthetic ledger export')
+    parser.add_argument('--rows', type=int, default=500000, help='Rows in the synthetic export')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per implementation (best is reported)')
+    args = parser.parse_args()
+
+    log(f"Generating synthetic export with {args.rows} rows...")
+    df = synthetic_ledger_export(args.rows)
+
+    log("Timing per-cell coercion...")
+    per_cell = time_call(prepare_rows_per_cell, df, args.repeat)
+    log("Timing vectorized coercion...")
+    vectorized = time_call(lambda frame: prepare_rows(frame, LEDGER_COLUMN_TYPES), df, args.repeat)
+
+    print(json.dumps({
+        'rows': args.rows,
+        'per_cell_seconds': round(per_cell, 3),
+        'vectorized_seconds': round(vectorized, 3),
+        'per_cell_rows_per_second': int(args.rows / per_cell),
+        'vectorized_rows_per_second': int(args.rows / vectorized),
+        'speedup': round(per_cell / vectorized, 2)
+    }))
+
+if __name__ == "__main__":
+    main()
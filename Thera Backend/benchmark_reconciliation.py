@@ -0,0 +1,345 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+def log(message):
+    print(f"[LOG] {message}", file=sys.stderr)
+
+# Stripe charge currencies and how often each occurs; each has an
+# amount.<CODE> column in the ledger export
+CURRENCY_WEIGHTS = {'usd': 0.8, 'eur': 0.15, 'gbp': 0.05}
+
+# Ledger account names perform_balance_reconciliation reads
+ACCOUNT_NAMES = ['Stripe Revenue', 'Stripe*', 'Stripe Fees', 'Stripe Payroll Balance']
+
+# Source tables in upload order, with the file each is written to
+SOURCE_FILES = {
+    'Thera_Stripe_Incoming_Transactions': 'stripe_incoming.csv',
+    'Thera_Stripe_Balance_Changes': 'stripe_balance_changes.csv',
+    'Thera_Ledger_Transactions': 'ledger_transactions.csv',
+    'Thera_Ledger_Accounts': 'ledger_accounts.csv'
+}
+
+STAGES = ['upload', 'reconcile', 'balance', 'get_matches']
+
+def synthetic_dataset(rows, match_ratio=0.8, ledgers=4, paid_ratio=0.95, mismatch_ratio=0.1, seed=42):
+    """Export-shaped DataFrames for the four source tables, keyed by table.
+
+    `rows` Stripe charges each get a balance transaction. With probability
+    match_ratio a charge has a PAY_IN_STARTED ledger row (pointing at the
+    charge and its balance transaction) and, independently, a
+    PAY_IN_SUCCEEDED row (pointing at its PaymentIntent); another
+    rows * (1 - match_ratio) ledger rows match nothing. Each ledger has one
+    account per currency, whose posted balance equals the Stripe net of its
+    started rows except for a mismatch_ratio share of accounts.
+    """
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(np.arange(rows).astype(str))
+    created = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24 * 3600, rows), unit='s')
+    created_text = pd.Series(created.strftime('%Y-%m-%d %H:%M:%S'))
+    available_text = pd.Series((created + pd.Timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S'))
+    currency = rng.choice(list(CURRENCY_WEIGHTS), rows, p=list(CURRENCY_WEIGHTS.values()))
+    amount_minor = rng.integers(100, 500_000, rows)
+    fee_minor = amount_minor * 29 // 1000 + 30
+    net_minor = amount_minor - fee_minor
+    ledger_of = rng.integers(0, ledgers, rows)
+
+    stripe = pd.DataFrame({
+        'id': 'ch_' + ids,
+        'Created date (UTC)': created_text,
+        'Amount': amount_minor / 100,
+        'Amount Refunded': 0.0,
+        'Currency': currency,
+        'Captured': 'true',
+        'Converted Amount': amount_minor / 100,
+        'Converted Currency': currency,
+        'Fee': fee_minor / 100,
+        'PaymentIntent ID': 'pi_' + ids,
+        'Status': np.where(rng.random(rows) < paid_ratio, 'Paid', 'Failed'),
+        'Customer ID': 'cus_' + pd.Series(rng.integers(0, max(rows // 5, 1), rows).astype(str)),
+        'Card Brand': rng.choice(['Visa', 'MasterCard', 'American Express'], rows),
+        'Mode': 'Live'
+    })
+
+    balance = pd.DataFrame({
+        'balance_transaction_id': 'txn_' + ids,
+        'created': created_text,
+        'available_on': available_text,
+        'gross': amount_minor / 100,
+        'fee': fee_minor / 100,
+        'net': net_minor / 100,
+        'currency': currency,
+        'description': 'Payment for ' + ids,
+        'reporting_category': 'charge'
+    })
+
+    def ledger_rows(prefix, selected, metadata_type, status, references):
+        frame = pd.DataFrame({
+            'id': prefix + ids[selected],
+            'description': 'Pay-in',
+            'status': status,
+            'ledger_id': 'ledger_' + pd.Series(ledger_of[selected].astype(str), index=ids[selected].index),
+            'effective_date': created_text[selected] + ' UTC',
+            'posted_at': created_text[selected] + ' UTC',
+            'metadata': '{}',
+            'metadata:type': metadata_type,
+            'effective_at': created_text[selected] + ' UTC'
+        })
+        for code in CURRENCY_WEIGHTS:
+            in_code = currency[selected] == code
+            frame[f'amount.{code.upper()}'] = np.where(in_code, amount_minor[selected] / 100, np.nan)
+            frame[f'currency.{code.upper()}'] = np.where(in_code, code.upper(), None)
+        for column, values in references.items():
+            frame[column] = values[selected]
+        return frame
+
+    started = rng.random(rows) < match_ratio
+    succeeded = rng.random(rows) < match_ratio
+    orphans = np.arange(int(rows * (1 - match_ratio))) % max(rows, 1)
+    orphan_ids = 'missing_' + pd.Series(np.arange(len(orphans)).astype(str))
+    ledger = pd.concat([
+        ledger_rows('lt_started_', started, 'PAY_IN_STARTED', 'PENDING', {
+            'metadata:latestStripeChargeId': 'ch_' + ids,
+            'metadata:stripeBalanceTrxId': 'txn_' + ids
+        }),
+        ledger_rows('lt_succeeded_', succeeded, 'PAY_IN_SUCCEEDED', 'SUCCEEDED', {
+            'metadata:paymentId': 'pi_' + ids
+        }),
+        pd.DataFrame({
+            'id': 'lt_' + orphan_ids,
+            'description': 'Pay-in',
+            'status': 'PENDING',
+            'ledger_id': 'ledger_' + pd.Series(ledger_of[orphans].astype(str)),
+            'effective_date': created_text.iloc[orphans].reset_index(drop=True) + ' UTC',
+            'metadata': '{}',
+            'metadata:type': 'PAY_IN_STARTED',
+            'metadata:latestStripeChargeId': 'ch_' + orphan_ids,
+            'amount.USD': amount_minor[orphans] / 100,
+            'currency.USD': 'USD'
+        })
+    ], ignore_index=True)
+
+    started_net = pd.DataFrame({
+        'ledger_id': 'ledger_' + pd.Series(ledger_of[started].astype(str)),
+        'currency': currency[started],
+        'net_minor': net_minor[started]
+    }).groupby(['ledger_id', 'currency'])['net_minor'].sum()
+    accounts = pd.MultiIndex.from_product(
+        [[f'ledger_{k}' for k in range(ledgers)], list(CURRENCY_WEIGHTS)], names=['ledger_id', 'currency']
+    ).to_frame(index=False)
+    posted_minor = started_net.reindex(pd.MultiIndex.from_frame(accounts), fill_value=0).to_numpy()
+    posted_minor = posted_minor + np.where(rng.random(len(accounts)) < mismatch_ratio, 100, 0)
+    accounts = pd.DataFrame({
+        'id': 'la_' + accounts['ledger_id'] + '_' + accounts['currency'],
+        'name': [ACCOUNT_NAMES[i % len(ACCOUNT_NAMES)] for i in range(len(accounts))],
+        'normal_balance': 'debit',
+        'currency': accounts['currency'],
+        'posted_balance': posted_minor / 100,
+        'ledger_id': accounts['ledger_id'],
+        'metadata_type': 'STRIPE'
+    })
+
+    return {
+        'Thera_Stripe_Incoming_Transactions': stripe,
+        'Thera_Stripe_Balance_Changes': balance,
+        'Thera_Ledger_Transactions': ledger,
+        'Thera_Ledger_Accounts': accounts
+    }
+
+def write_dataset(dataset, directory):
+    """Write the generated tables as CSV exports; returns {table: (path, rows)}"""
+    files = {}
+    for table_name, frame in dataset.items():
+        path = os.path.join(directory, SOURCE_FILES[table_name])
+        frame.to_csv(path, index=False)
+        files[table_name] = (path, len(frame))
+    return files
+
+def reset_source_tables():
+    """Drop the source tables and the upload history before the upload stage.
+
+    The data is seeded, so a database kept from an earlier run would
+    otherwise skip every file as already uploaded.
+    """
+    from database import get_db_connection
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for table_name in [*SOURCE_FILES, 'source_uploads']:
+            cursor.execute(f"DROP TABLE IF EXISTS `{table_name}`")
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+def upload_stage(files, chunksize=None, bulk_load=False):
+    from data_processor import process_and_upload_file
+    for table_name, (path, _) in files.items():
+        success, message = process_and_upload_file(path, table_name, chunksize=chunksize, bulk_load=bulk_load)
+        if not success:
+            raise RuntimeError(f"Upload of {table_name} failed: {message}")
+    return sum(rows for _, rows in files.values())
+
+def reconcile_stage(files, mode='hash', partitions=None, workers=None, from_staging=False):
+    from reconciliation_service import perform_reconciliation
+    success, result = perform_reconciliation(mode=mode, partitions=partitions, workers=workers,
+                                             from_staging=from_staging)
+    if not success:
+        raise RuntimeError(f"Reconciliation failed: {result}")
+    return files['Thera_Stripe_Incoming_Transactions'][1] + files['Thera_Ledger_Transactions'][1]
+
+def balance_stage(files):
+    from reconciliation_service import perform_balance_reconciliation
+    success, result = perform_balance_reconciliation()
+    if not success:
+        raise RuntimeError(f"Balance reconciliation failed: {result}")
+    return files['Thera_Stripe_Balance_Changes'][1] + files['Thera_Ledger_Transactions'][1]
+
+def get_matches_stage(files, page_size=None):
+    """Page through both match tables; returns the number of rows read"""
+    from reconciliation_service import get_matches, MATCHES_PAGE_SIZE
+    total = 0
+    for match_type in ('started', 'succeeded'):
+        after = None
+        while True:
+            success, result = get_matches(match_type, None, page_size or MATCHES_PAGE_SIZE, after)
+            if not success:
+                raise RuntimeError(f"get_matches failed: {result}")
+            total += result['count']
+            after = result['next_cursor']
+            if after is None:
+                break
+    return total
+
+STAGE_FUNCTIONS = {
+    'upload': upload_stage,
+    'reconcile': reconcile_stage,
+    'balance': balance_stage,
+    'get_matches': get_matches_stage
+}
+
+def run_stage(stage, files, **options):
+    """Run one stage in this (fresh) process; returns (rows, seconds, peak RSS in MB)"""
+    if stage == 'upload':
+        reset_source_tables()
+    start = time.perf_counter()
+    rows = STAGE_FUNCTIONS[stage](files, **options)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+    return rows, elapsed, peak_mb
+
+def time_stage(stage, files, **options):
+    """Run a stage in its own process so its peak RSS is not mixed with the others'"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(run_stage, stage, files, **options).result()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark upload, reconciliation and match listing on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='Stripe charges per run (one run per value)')
+    parser.add_argument('--match-ratio', type=float, default=0.8, help='Share of charges with ledger rows')
+    parser.add_argument('--ledgers', type=int, default=4, help='Number of ledgers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--backend', choices=['mysql', 'sqlite'], default='mysql',
+                        help='Storage backend; sqlite runs without a server')
+    parser.add_argument('--database', help='Scratch MySQL database to load into; the upload stage drops its source tables first')
+    parser.add_argument('--sqlite-path', help='SQLite file for --backend sqlite (default: benchmark.sqlite3 in the run directory)')
+    parser.add_argument('--mode', default='hash', help='Matcher for perform_reconciliation')
+    parser.add_argument('--partitions', type=int, help='Partitions for perform_reconciliation')
+    parser.add_argument('--from-staging', action='store_true', help='Reconcile from the Parquet staging snapshots')
+    parser.add_argument('--workers', type=int, help='Worker processes for partitioned matching')
+    parser.add_argument('--chunksize', type=int, help='Upload chunk size')
+    parser.add_argument('--bulk-load', action='store_true', help='Upload with LOAD DATA LOCAL INFILE')
+    parser.add_argument('--page-size', type=int, help='get_matches page size')
+    parser.add_argument('--data-dir', help='Keep the generated CSV files here')
+    parser.add_argument('--generate-only', action='store_true', help='Only write the CSV files')
+    parser.add_argument('--output', help='Append the JSON report to this file (one line per run)')
+    args = parser.parse_args()
+
+    # Read by database.py in the stage processes
+    os.environ['DB_BACKEND'] = args.backend
+    if not args.generate_only and args.backend == 'mysql':
+        if not args.database:
+            parser.error('--database is required to run the stages (the upload stage drops its source tables)')
+        os.environ['DB_NAME'] = args.database
+
+    stage_options = {
+        'upload': {'chunksize': args.chunksize, 'bulk_load': args.bulk_load},
+        'reconcile': {'mode': args.mode, 'partitions': args.partitions, 'workers': args.workers,
+                      'from_staging': args.from_staging},
+        'balance': {},
+        'get_matches': {'page_size': args.page_size}
+    }
+
+    results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as scratch:
+            directory = args.data_dir or scratch
+            if args.data_dir:
+                directory = os.path.join(args.data_dir, str(rows))
+                os.makedirs(directory, exist_ok=True)
+
+            log(f"Generating {rows} charges...")
+            start = time.perf_counter()
+            files = write_dataset(
+                synthetic_dataset(rows, args.match_ratio, args.ledgers, seed=args.seed), directory
+            )
+            log(f"Generated {', '.join(f'{n} {t}' for t, (_, n) in files.items())} "
+                f"in {time.perf_counter() - start:.1f}s")
+            if args.generate_only:
+                continue
+            if args.backend == 'sqlite':
+                os.environ['DB_SQLITE_PATH'] = args.sqlite_path or os.path.join(directory, 'benchmark.sqlite3')
+            # Parquet snapshots start empty for every run, like the tables; a
+            # kept --data-dir may still hold the previous run's
+            staging_dir = os.path.join(directory, 'staging_cache')
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.environ['STAGING_CACHE_DIR'] = staging_dir
+
+            for stage in args.stages:
+                log(f"Timing {stage} at {rows} charges...")
+                processed, elapsed, peak_mb = time_stage(stage, files, **stage_options[stage])
+                results.append({
+                    'rows': rows,
+                    'stage': stage,
+                    'rows_processed': processed,
+                    'seconds': round(elapsed, 3),
+                    'rows_per_second': int(processed / elapsed) if elapsed else None,
+                    'peak_rss_mb': round(peak_mb, 1)
+                })
+                log(f"{stage}: {processed} rows in {elapsed:.2f}s, peak RSS {peak_mb:.0f} MB")
+
+    if args.generate_only:
+        return
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'backend': args.backend,
+        'seed': args.seed,
+        'match_ratio': args.match_ratio,
+        'mode': args.mode,
+        'partitions': args.partitions,
+        'from_staging': args.from_staging,
+        'results': results
+    }
+    print(json.dumps(report))
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(report) + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,16 @@
-import pandas as pd
 import pymysql
 from datetime import datetime
 import argparse
 import sys
 import os
 import json
+import re
+import tempfile
 from reconciliation_service import perform_reconciliation as service_reconciliation
-import time
-from dotenv import load_dotenv
-import numpy as np
-
-load_dotenv()
-
-# MySQL Connection Parameters
-db_params = {
-    "host": os.getenv('DB_HOST', '127.0.0.1'),
-    "user": os.getenv('DB_USER', 'root'),
-    "password": os.getenv('DB_PASSWORD', 'Atenas9democraci.'),
-    "database": os.getenv('DB_NAME', 'thera_final_database'),
-    "port": int(os.getenv('DB_PORT', 3306)),
-    "connect_timeout": 180,
-    "read_timeout": 180,
-    "write_timeout": 180
-}
+from reconciliation_service import ensure_indexes, MATCH_TABLE_INDEXES
+from database import get_db_connection, get_backend
+from money import MONEY_SCALE, series_to_minor, format_minor_series
+import staging_cache
 
 # Add logging
 def log(message):
@@ -64,6 +52,34 @@ EXPECTED_COLUMNS = {
     ]
 }
 
+# Secondary indexes for the reconciliation join keys and dashboard filters,
+# keyed by table and then index name
+TABLE_INDEXES = {
+    "Thera_Stripe_Incoming_Transactions": {
+        "idx_stripe_status": ["status"],
+        "idx_stripe_paymentintent_id": ["paymentintent_id"],
+        "idx_stripe_created_date": ["created_date_utc"],
+        "idx_stripe_loaded_at": ["loaded_at"]
+    },
+    "Thera_Stripe_Balance_Changes": {
+        "idx_balance_currency": ["currency"]
+    },
+    "Thera_Ledger_Transactions": {
+        "idx_ledger_charge_id": ["metadata_latestStripeChargeId"],
+        "idx_ledger_payment_id": ["metadata_paymentId"],
+        "idx_ledger_balance_trx_id": ["metadata_stripeBalanceTrxId"],
+        "idx_ledger_type_status": ["metadata_type", "status"],
+        "idx_ledger_status": ["status"],
+        "idx_ledger_effective_date": ["effective_date"],
+        "idx_ledger_loaded_at": ["loaded_at"]
+    },
+    "Thera_Ledger_Accounts": {
+        "idx_accounts_ledger_currency": ["ledger_id", "currency"],
+        "idx_accounts_name": ["name"]
+    },
+    **MATCH_TABLE_INDEXES
+}
+
 def clean_column_names(columns):
     """Clean column names to match database schema"""
     # Special mapping for metadata fields to preserve casing
@@ -148,14 +164,38 @@ def validate_columns(df, source_type):
     
     return True
 
+def add_missing_column(cursor, table_name, column, definition):
+    """Add a column to an existing table that was created without it"""
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}` LIKE %s", (column,))
+    if not cursor.fetchone():
+        log(f"Adding {column} column to {table_name}...")
+        cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `{column}` {definition}")
+
+# Column definitions in a CREATE TABLE statement, one per line
+COLUMN_DEFINITION = re.compile(r'^\s*`?(\w+)`?\s+[A-Z]', re.M)
+CONSTRAINT_WORDS = {'PRIMARY', 'UNIQUE', 'INDEX', 'KEY', 'FOREIGN', 'CONSTRAINT'}
+
+def declared_columns(create_statement):
+    """Names of the columns a CREATE TABLE statement declares"""
+    body = create_statement.split('(', 1)[1]
+    return {name for name in COLUMN_DEFINITION.findall(body) if name.upper() not in CONSTRAINT_WORDS}
+
+def recreate_if_columns_differ(cursor, table_name, create_statement, expected_columns):
+    """Drop and recreate a table whose columns are not the expected ones"""
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
+    existing_columns = {col[0] for col in cursor.fetchall()}
+    if existing_columns != expected_columns:
+        log(f"Table schema mismatch - recreating {table_name}...")
+        cursor.execute(f"DROP TABLE `{table_name}`")
+        cursor.execute(create_statement)
+
 def create_table_if_not_exists(cursor, table_name, df=None):
     """Create table if it doesn't exist with appropriate columns"""
     
     if table_name == "Thera_Stripe_Balance_Changes":
-        # Primero eliminar la tabla si existe
-        cursor.execute("DROP TABLE IF EXISTS Thera_Stripe_Balance_Changes")
-        
-        cursor.execute("""
+        # Kept across uploads so unchanged rows are not rewritten; only a
+        # table with other columns is rebuilt
+        create_statement = """
             CREATE TABLE IF NOT EXISTS Thera_Stripe_Balance_Changes (
                 account_id VARCHAR(255),
                 account_name VARCHAR(255),
@@ -224,17 +264,19 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 connected_account_id VARCHAR(255),
                 connected_account_name VARCHAR(255),
                 connected_account_country VARCHAR(50),
-                connected_account_direct_charge_id VARCHAR(255)
+                connected_account_direct_charge_id VARCHAR(255),
+                row_hash BIGINT
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        """)
+        """
+        cursor.execute(create_statement)
+        add_missing_column(cursor, table_name, 'row_hash', 'BIGINT')
+        recreate_if_columns_differ(cursor, table_name, create_statement, declared_columns(create_statement))
+        ensure_indexes(cursor, table_name, TABLE_INDEXES[table_name])
         return
 
     if table_name == "Thera_Stripe_Incoming_Transactions":
-        # Primero eliminar la tabla si existe
-        cursor.execute("DROP TABLE IF EXISTS Thera_Stripe_Incoming_Transactions")
-        
-        # Crear la tabla con todas las columnas del CSV
-        cursor.execute("""
+        # Crear la tabla con todas las columnas del CSV; kept across uploads
+        create_statement = """
             CREATE TABLE IF NOT EXISTS Thera_Stripe_Incoming_Transactions (
                 id VARCHAR(255) PRIMARY KEY,
                 created_date_utc DATETIME,
@@ -319,9 +361,15 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 destination VARCHAR(255),
                 transfer VARCHAR(255),
                 transfer_group VARCHAR(255),
-                type_metadata VARCHAR(100)
+                type_metadata VARCHAR(100),
+                row_hash BIGINT,
+                loaded_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
-        """)
+        """
+        cursor.execute(create_statement)
+        add_missing_column(cursor, table_name, 'row_hash', 'BIGINT')
+        recreate_if_columns_differ(cursor, table_name, create_statement, declared_columns(create_statement))
+        ensure_indexes(cursor, table_name, TABLE_INDEXES[table_name])
         return
 
     if table_name == "Thera_Ledger_Transactions":
@@ -367,15 +415,20 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 metadata_stripeBalanceTrxId VARCHAR(255),
                 metadata_stripeExchangeRate DECIMAL(20,10),
                 metadata_type VARCHAR(50),
-                effective_at DATETIME
+                effective_at DATETIME,
+                row_hash BIGINT,
+                loaded_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
         """
         
         cursor.execute(create_statement)
         
+        # Tables created before load tracking get the columns added in place
+        add_missing_column(cursor, table_name, 'row_hash', 'BIGINT')
+        add_missing_column(cursor, table_name, 'loaded_at',
+                           'TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)')
+        
         # Drop and recreate if columns don't match
-        cursor.execute("SHOW COLUMNS FROM Thera_Ledger_Transactions")
-        existing_columns = {col[0] for col in cursor.fetchall()}
         expected_columns = {
             'id', 'description', 'status', 'ledger_id', 'effective_date', 'posted_at', 'metadata',
             'amount_BRL', 'currency_BRL', 'amount_CAD', 'currency_CAD', 'amount_CHF', 'currency_CHF',
@@ -384,13 +437,11 @@ def create_table_if_not_exists(cursor, table_name, df=None):
             'amount_NGN', 'currency_NGN', 'amount_PHP', 'currency_PHP', 'amount_UAH', 'currency_UAH',
             'amount_USD', 'currency_USD', 'metadata_latestStripeChargeId', 'metadata_payInType',
             'metadata_paymentId', 'metadata_paymentMethodId', 'metadata_stripeBalanceTrxId',
-            'metadata_stripeExchangeRate', 'metadata_type', 'effective_at'
+            'metadata_stripeExchangeRate', 'metadata_type', 'effective_at', 'row_hash', 'loaded_at'
         }
         
-        if existing_columns != expected_columns:
-            log("Table schema mismatch - recreating table...")
-            cursor.execute("DROP TABLE Thera_Ledger_Transactions")
-            cursor.execute(create_statement)
+        recreate_if_columns_differ(cursor, table_name, create_statement, expected_columns)
+        ensure_indexes(cursor, table_name, TABLE_INDEXES[table_name])
         return
 
     if table_name == "Reconciliation_Results":
@@ -447,137 +498,501 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 metadata_companyId VARCHAR(255),
                 metadata_type VARCHAR(50),
                 metadata_userId VARCHAR(255),
-                effective_at DATETIME
+                effective_at DATETIME,
+                row_hash BIGINT
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+        """)
+        add_missing_column(cursor, table_name, 'row_hash', 'BIGINT')
+        ensure_indexes(cursor, table_name, TABLE_INDEXES[table_name])
+        return
+
+    if table_name == "source_uploads":
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS source_uploads (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                source_table VARCHAR(64) NOT NULL,
+                file_sha256 CHAR(64) NOT NULL,
+                records INT,
+                table_rows BIGINT,
+                table_loaded_at VARCHAR(32),
+                uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_source_uploads_table (source_table, id)
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
         """)
         return
 
-def get_db_connection():
+def ensure_all_indexes():
+    """Check every known table on startup and add any missing secondary indexes"""
+    conn = None
+    cursor = None
     try:
-        return pymysql.connect(**db_params)
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        added = {}
+        for table_name, indexes in TABLE_INDEXES.items():
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            if not cursor.fetchone():
+                continue
+            missing = ensure_indexes(cursor, table_name, indexes)
+            if missing:
+                added[table_name] = missing
+        conn.commit()
+        return True, added
     except Exception as e:
-        log(f"Database connection error: {str(e)}")
-        raise
-
-def connect_with_retry(max_retries=3, delay=5):
-    """Attempt to connect to database with retries"""
-    for attempt in range(max_retries):
-        try:
-            log(f"Database connection attempt {attempt + 1} of {max_retries}")
-            conn = get_db_connection()
-            return conn
-        except pymysql.Error as e:
-            if attempt == max_retries - 1:  # Last attempt
-                raise  # Re-raise the last error
-            log(f"Connection failed, retrying in {delay} seconds... Error: {str(e)}")
-            time.sleep(delay)
-
-def process_and_upload_file(file_path, source_type):
+        log(f"Error ensuring indexes: {str(e)}")
+        return False, str(e)
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# Columns that arrive as text timestamps (with a ' UTC' suffix) in the exports
+DATE_COLUMNS = ['posted_at', 'effective_at', 'effective_date', 'created_date_utc', 'refunded_date_utc']
+
+# Primary key of each source table
+KEY_COLUMNS = {
+    'Thera_Stripe_Balance_Changes': 'balance_transaction_id',
+    'Thera_Stripe_Incoming_Transactions': 'id',
+    'Thera_Ledger_Transactions': 'id',
+    'Thera_Ledger_Accounts': 'id'
+}
+
+def read_clean_header(file_path):
+    """Read only the CSV header and return the cleaned column names"""
+    import pandas as pd
+    header = pd.read_csv(file_path, nrows=0)
+    log(f"Columns found: {list(header.columns)}")
+    columns = clean_column_names(header.columns)
+    log(f"Clean columns: {columns}")
+    return columns
+
+def read_csv_chunks(file_path, columns, chunksize=None):
+    """Yield the CSV as DataFrames named with the already-cleaned columns.
+
+    Without a chunksize the whole file is a single chunk.
+    """
+    import pandas as pd
+    if not chunksize:
+        df = pd.read_csv(file_path)
+        df.columns = columns
+        yield df
+        return
+    for df in pd.read_csv(file_path, chunksize=chunksize):
+        df.columns = columns
+        yield df
+
+# Explicit timestamp formats tried, in order, before falling back to the raw text
+DATETIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d'
+]
+
+# Text values the exports use for missing data
+NULL_STRINGS = ['nan', 'None', '']
+
+def get_column_types(cursor, table_name):
+    """Map each column of a table (lower-cased, as MySQL matches them) to 'datetime', 'money', 'numeric' or 'text'.
+
+    'money' is a DECIMAL amount column with MONEY_SCALE decimals.
+    """
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
+    column_types = {}
+    for row in cursor.fetchall():
+        column, sql_type = row[0].lower(), row[1].lower()
+        if sql_type.startswith(('datetime', 'timestamp', 'date')):
+            column_types[column] = 'datetime'
+        elif sql_type.startswith('decimal') and sql_type.rstrip(')').endswith(f',{MONEY_SCALE}'):
+            column_types[column] = 'money'
+        elif sql_type.startswith(('decimal', 'int', 'bigint', 'smallint', 'tinyint', 'float', 'double')):
+            column_types[column] = 'numeric'
+        else:
+            column_types[column] = 'text'
+    return column_types
+
+def coerce_datetime_column(series, keep_unparsed):
+    """Parse timestamps with the explicit formats and render them for MySQL"""
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d %H:%M:%S')
+    text = series.astype('string').str.removesuffix(' UTC')
+    parsed = pd.to_datetime(text, format=DATETIME_FORMATS[0], errors='coerce')
+    for fmt in DATETIME_FORMATS[1:]:
+        missing = parsed.isna() & text.notna()
+        if not missing.any():
+            break
+        parsed = parsed.fillna(pd.to_datetime(text.where(missing), format=fmt, errors='coerce'))
+    result = parsed.dt.strftime('%Y-%m-%d %H:%M:%S')
+    if keep_unparsed:
+        # Let MySQL judge values none of the formats understood
+        result = result.fillna(text)
+    return result
+
+def coerce_text_column(series):
+    """Render a column as text, treating the export's null spellings as missing"""
+    import pandas as pd
+    if pd.api.types.is_float_dtype(series):
+        non_null = series.dropna()
+        if ((non_null == non_null.round()) & (non_null.abs() < 2 ** 53)).all():
+            # Integer codes read as float because of blanks (e.g. card_exp_month)
+            series = series.astype('Int64')
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('string')
+    return series.astype('string').mask(lambda s: s.isin(NULL_STRINGS))
+
+def unparsed_values(original, coerced):
+    """Values present in `original` that coercion turned into NA"""
+    import pandas as pd
+    present = original.notna()
+    if not pd.api.types.is_numeric_dtype(original):
+        present &= ~original.astype('string').str.strip().isin(NULL_STRINGS)
+    return original[present & coerced.isna().to_numpy()]
+
+def coerce_columns(df, column_types=None):
+    """Coerce each column of a cleaned chunk to its target type.
+
+    Each column is coerced according to the target table's type (see
+    get_column_types); unknown columns are treated as text. Returns a
+    DataFrame in which missing values are NA. Raises ValueError if a money
+    or numeric column holds values that are not numbers, rather than
+    loading them as NULL (MySQL's strict mode rejected them too).
+    """
+    import pandas as pd
+    column_types = column_types or {}
+    coerced = {}
+    unparsed = {}
+    for col in df.columns:
+        series = df[col]
+        kind = column_types.get(col.lower(), 'datetime' if col in DATE_COLUMNS else 'text')
+        if kind == 'datetime':
+            series = coerce_datetime_column(series, keep_unparsed=col not in DATE_COLUMNS)
+        elif kind == 'money':
+            # Exact text from integer minor units, so no float repr reaches MySQL
+            series = format_minor_series(series_to_minor(series, MONEY_SCALE), MONEY_SCALE)
+        elif kind == 'numeric':
+            series = pd.to_numeric(series, errors='coerce')
+        else:
+            series = coerce_text_column(series)
+        if kind in ('money', 'numeric'):
+            lost = unparsed_values(df[col], series)
+            if len(lost):
+                unparsed[col] = lost
+        coerced[col] = series
+    if unparsed:
+        details = '; '.join(
+            f"{col}: {len(lost)} values, e.g. {', '.join(repr(str(v)) for v in lost.unique()[:3])}"
+            for col, lost in unparsed.items()
+        )
+        raise ValueError(f"Values that are not numbers in {details}")
+    return pd.DataFrame(coerced, index=df.index)
+
+def coerced_rows(coerced):
+    """DB-ready tuples from a chunk coerce_columns has already converted.
+
+    Missing values are mapped to None with one mask per column.
+    """
+    arrays = [coerced[col].to_numpy(dtype=object, na_value=None) for col in coerced.columns]
+    return list(zip(*arrays))
+
+def prepare_rows(df, column_types=None):
+    """Convert a cleaned chunk into DB-ready tuples, column by column"""
+    return coerced_rows(coerce_columns(df, column_types))
+
+def write_load_file(coerced, path):
+    """Write a coerced chunk as a tab-separated file LOAD DATA can read.
+
+    Text is escaped the way MySQL's default ESCAPED BY '\\' expects and
+    missing values are written as \\N.
+    """
+    fields = []
+    for col in coerced.columns:
+        text = coerced[col].astype('string')
+        text = (text.str.replace('\\', '\\\\', regex=False)
+                    .str.replace('\t', '\\t', regex=False)
+                    .str.replace('\n', '\\n', regex=False)
+                    .str.replace('\r', '\\r', regex=False))
+        fields.append(text.fillna('\\N'))
+    if not fields:
+        return 0
+    lines = fields[0].str.cat(fields[1:], sep='\t') if len(fields) > 1 else fields[0]
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('\n'.join(lines.tolist()))
+        f.write('\n')
+    return len(lines)
+
+def load_data_infile(cursor, table_name, columns, path):
+    """Bulk-load a file written by write_load_file, replacing rows with the same key"""
+    column_list = ', '.join(f'`{col}`' for col in columns)
+    cursor.execute(f"""
+        LOAD DATA LOCAL INFILE %s
+        REPLACE INTO TABLE `{table_name}`
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\'
+        LINES TERMINATED BY '\\n'
+        ({column_list})
+    """, (path,))
+
+def bulk_load_chunk(cursor, table_name, coerced):
+    """Load one coerced chunk through a temporary TSV file; returns the number of rows"""
+    fd, path = tempfile.mkstemp(suffix='.tsv')
+    os.close(fd)
+    try:
+        rows = write_load_file(coerced, path)
+        if rows:
+            load_data_infile(cursor, table_name, list(coerced.columns), path)
+        return rows
+    finally:
+        os.remove(path)
+
+# Column of each source table holding its row's content hash (see row_hashes)
+ROW_HASH_COLUMN = 'row_hash'
+
+def row_hashes(coerced):
+    """64-bit content hash of each row of a coerced chunk, as signed integers.
+
+    Values are hashed as text along with the column names, so a row hashes
+    the same whether it was parsed from the CSV or read from a staged
+    snapshot, and a file with other columns never looks unchanged.
+    """
+    import pandas as pd
+    text = {'': pd.Series(','.join(coerced.columns), index=coerced.index, dtype='string')}
+    for col in coerced.columns:
+        series = coerced[col]
+        if pd.api.types.is_numeric_dtype(series):
+            # 1 and 1.0 are the same DECIMAL
+            series = series.astype('Float64')
+        text[col] = series.astype('string')
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(text, index=coerced.index), index=False)
+    # BIGINT is signed in both backends
+    return hashes.to_numpy().view('int64')
+
+def changed_rows(keys, hashes, known_hashes):
+    """Mask of the rows whose key is new or whose content hash differs.
+
+    known_hashes maps each key to the hash of its stored row and is updated
+    as rows go by, so a key repeated in the upload is compared with the
+    version just written rather than the stored one.
+    """
+    changed = []
+    for key, row_hash in zip(keys, hashes.tolist()):
+        changed.append(known_hashes.get(key) != row_hash)
+        known_hashes[key] = row_hash
+    return changed
+
+def previous_upload(conn, source_type, digest):
+    """Record count of the last upload into a source table if it was this
+    same file and the table has not changed since, otherwise None"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW TABLES LIKE %s", (source_type,))
+        if not cursor.fetchone():
+            return None
+        cursor.execute("""
+            SELECT file_sha256, records, table_rows, table_loaded_at
+            FROM source_uploads
+            WHERE source_table = %s
+            ORDER BY id DESC
+            LIMIT 1
+        """, (source_type,))
+        last = cursor.fetchone()
+    finally:
+        cursor.close()
+    if not last or last[0] != digest:
+        return None
+    if staging_cache.table_state(conn, source_type) != (last[2], last[3]):
+        return None
+    return last[1]
+
+def record_upload(conn, source_type, digest, records):
+    """Remember a finished upload and the state it left the table in"""
+    rows, loaded_at = staging_cache.table_state(conn, source_type)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO source_uploads (source_table, file_sha256, records, table_rows, table_loaded_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (source_type, digest, records, rows, loaded_at))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def process_and_upload_file(file_path, source_type, chunksize=None, bulk_load=False):
+    """Load a CSV export into its source table with REPLACE.
+
+    With a chunksize the file is streamed: each chunk is cleaned and upserted
+    on its own, so memory stays bounded by the chunk rather than the file.
+    With bulk_load each chunk goes through LOAD DATA LOCAL INFILE ... REPLACE;
+    if the server refuses it the upload continues with executemany.
+
+    Uploads are deduplicated by content. A file whose sha256 matches the
+    last upload into the table is skipped outright, as long as the table
+    has not changed since (source_uploads records both). Otherwise each row
+    is written with a hash of its content (row_hash), and only rows whose
+    key is new or whose hash differs from the stored row are replaced.
+
+    With the staging cache on (see staging_cache.py) the coerced rows are
+    also written to a typed Parquet snapshot keyed by the file's sha256,
+    and the table snapshot the reconcilers can read is brought up to date.
+    Uploading the same content again reads the snapshot instead of parsing
+    the CSV.
+    """
+    import pandas as pd
     conn = None
     cursor = None
+    snapshot = None
     try:
         log(f"Processing file: {file_path}")
         log(f"Source type: {source_type}")
         
-        log("Reading CSV file...")
-        df = pd.read_csv(file_path)
-        log(f"CSV loaded successfully. Shape: {df.shape}")
+        # Clean column names once, from the header
+        log("Reading CSV header...")
+        columns = read_clean_header(file_path)
         
-        # Log original columns
-        log(f"Columns found: {list(df.columns)}")
+        # Validate against the header before touching the database
+        validate_columns(pd.DataFrame(columns=columns), source_type)
+        digest = staging_cache.file_digest(file_path)
         
-        # Clean column names
-        log("Cleaning column names...")
-        df.columns = clean_column_names(df.columns)
-        
-        # Log cleaned columns
-        log(f"Clean columns: {list(df.columns)}")
-        
-        # Add this logging to check data before any filtering
-        log(f"Initial row count: {len(df)}")
-        
-        # Check for any implicit filtering in the validation step
-        validate_columns(df, source_type)
-        
-        # Add logging after validation
-        log(f"Row count after validation: {len(df)}")
-        
-        # Check for nulls in key columns for Ledger Transactions
-        if source_type == 'Thera_Ledger_Transactions':
-            key_columns = ['effective_date', 'metadata_type', 'metadata_latestStripeChargeId', 'metadata_paymentId']
-            for col in key_columns:
-                null_count = df[col].isnull().sum()
-                log(f"Null values in {col}: {null_count}")
-        
-        # Add logging before upload
-        log(f"Final row count before upload: {len(df)}")
+        if bulk_load and not get_backend().supports_load_data:
+            log("LOAD DATA is not available on this database backend, using executemany")
+            bulk_load = False
         
         # Connect to database
         log("Connecting to database...")
-        conn = get_db_connection()
+        conn = get_db_connection(local_infile=True) if bulk_load else get_db_connection()
         cursor = conn.cursor()
         log("Database connection successful")
         
+        create_table_if_not_exists(cursor, 'source_uploads')
+        records = previous_upload(conn, source_type, digest)
+        if records is not None:
+            log(f"File {digest[:12]} is already loaded into {source_type}, skipping it")
+            return True, f"File already uploaded; skipped {records} unchanged records"
+        
         # Create table if it doesn't exist
         log(f"Creating/checking table: {source_type}")
         create_table_if_not_exists(cursor, source_type)
+        column_types = get_column_types(cursor, source_type)
         
         # Determinar la columna clave según el tipo de tabla
-        key_column = {
-            'Thera_Stripe_Balance_Changes': 'balance_transaction_id',
-            'Thera_Stripe_Incoming_Transactions': 'id',
-            'Thera_Ledger_Transactions': 'id',
-            'Thera_Ledger_Accounts': 'id'
-        }.get(source_type, 'id')
+        key_column = KEY_COLUMNS.get(source_type, 'id')
+        key_field = next((col for col in columns if col.lower() == key_column.lower()), None)
         
         log(f"Checking for duplicates using key column: {key_column}")
         
         # Verificar duplicados
-        cursor.execute(f"SELECT `{key_column}` FROM `{source_type}`")
-        existing_keys = {row[0] for row in cursor.fetchall()}
-        
-        # Preparar datos para inserción
-        log("Preparing data for insertion...")
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-            elif pd.api.types.is_numeric_dtype(df[col]):
-                df[col] = df[col].replace({pd.NA: None, np.nan: None})
-                df[col] = df[col].apply(lambda x: str(x) if pd.notnull(x) else None)
-            elif pd.api.types.is_object_dtype(df[col]):
-                if col in ['posted_at', 'effective_at', 'effective_date', 'created_date_utc', 'refunded_date_utc']:
-                    df[col] = df[col].apply(lambda x: x.replace(' UTC', '') if isinstance(x, str) else x)
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-                    df[col] = df[col].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if pd.notnull(x) else None)
-                else:
-                    df[col] = df[col].replace({pd.NA: None, np.nan: None, 'nan': None, 'None': None, '': None})
-        
-        # Insertar datos
-        if len(df) > 0:
-            columns = ', '.join(f'`{col}`' for col in df.columns)
-            placeholders = ', '.join(['%s'] * len(df.columns))
+        cursor.execute(f"SELECT `{key_column}`, `{ROW_HASH_COLUMN}` FROM `{source_type}`")
+        known_hashes = dict(cursor.fetchall())
+        
+        staged = staging_cache.staging_enabled()
+        if staged and staging_cache.has_upload(source_type, digest):
+            log(f"Reading staged snapshot {digest[:12]} instead of parsing the CSV...")
+            chunks = staging_cache.read_upload_chunks(source_type, digest, chunksize)
+        else:
+            chunks = read_csv_chunks(file_path, columns, chunksize)
+            if staged:
+                snapshot = staging_cache.UploadSnapshot(
+                    source_type, digest, staging_cache.snapshot_schema(cursor, source_type, columns)
+                )
+        previous_state = (len(known_hashes), None)
+        if staged and known_hashes:
+            previous_state = staging_cache.table_state(conn, source_type)
+        
+        # Usar REPLACE en lugar de INSERT
+        column_list = ', '.join(f'`{col}`' for col in columns + [ROW_HASH_COLUMN])
+        placeholders = ', '.join(['%s'] * (len(columns) + 1))
+        replace_query = f"REPLACE INTO `{source_type}` ({column_list}) VALUES ({placeholders})"
+        
+        # Check for nulls in key columns for Ledger Transactions
+        null_counts = {}
+        if source_type == 'Thera_Ledger_Transactions':
+            null_counts = {col: 0 for col in ['effective_date', 'metadata_type', 'metadata_latestStripeChargeId', 'metadata_paymentId']}
+        
+        log(f"Reading CSV file{f' in chunks of {chunksize} rows' if chunksize else ''}...")
+        batch_size = 1000
+        total_rows = 0
+        written_rows = 0
+        for chunk_number, df in enumerate(chunks, 1):
+            log(f"Chunk {chunk_number} loaded. Shape: {df.shape}")
+            for col in null_counts:
+                null_counts[col] += int(df[col].isnull().sum())
+            coerced = coerce_columns(df, column_types)
+            del df
+            if snapshot:
+                try:
+                    snapshot.write(coerced)
+                except Exception as e:
+                    # The cache must never fail an upload; drop it for this table
+                    log(f"Staging snapshot skipped: {str(e)}")
+                    snapshot.abort()
+                    snapshot = None
+                    staged = False
+                    staging_cache.invalidate_table(source_type)
+            
+            # Only rows that are new or differ from the stored row are written
+            chunk_total = len(coerced)
+            hashes = row_hashes(coerced)
+            coerced[ROW_HASH_COLUMN] = hashes
+            if key_field:
+                keys = coerced[key_field].to_numpy(dtype=object, na_value=None)
+                coerced = coerced[changed_rows(keys, hashes, known_hashes)]
+            total_rows += chunk_total
+            log(f"Chunk {chunk_number}: {len(coerced)} of {chunk_total} rows new or changed")
+            if coerced.empty:
+                continue
             
-            # Usar REPLACE en lugar de INSERT
-            replace_query = f"REPLACE INTO `{source_type}` ({columns}) VALUES ({placeholders})"
+            if bulk_load:
+                try:
+                    chunk_rows = bulk_load_chunk(cursor, source_type, coerced)
+                    conn.commit()
+                    written_rows += chunk_rows
+                    log(f"Loaded {written_rows} rows (chunk {chunk_number}: {chunk_rows} rows)")
+                    continue
+                except pymysql.Error as e:
+                    conn.rollback()
+                    log(f"Bulk load failed, falling back to executemany: {str(e)}")
+                    bulk_load = False
             
-            data = df.replace({pd.NA: None, np.nan: None}).values.tolist()
-            data = [tuple(None if pd.isna(x) else x for x in row) for row in data]
+            # Preparar datos para inserción
+            data = coerced_rows(coerced)
+            del coerced
             
             # Insert in batches
-            batch_size = 1000
-            total_rows = len(data)
-            for i in range(0, total_rows, batch_size):
+            chunk_rows = len(data)
+            for i in range(0, chunk_rows, batch_size):
                 batch = data[i:i + batch_size]
                 cursor.executemany(replace_query, batch)
                 conn.commit()
-                log(f"Replaced {min(i + batch_size, total_rows)} of {total_rows} rows")
-            
+                log(f"Replaced {written_rows + min(i + batch_size, chunk_rows)} rows "
+                    f"(chunk {chunk_number}: {min(i + batch_size, chunk_rows)} of {chunk_rows})")
+            written_rows += chunk_rows
+        
+        for col, null_count in null_counts.items():
+            log(f"Null values in {col}: {null_count}")
+        
+        if snapshot:
+            snapshot.close()
+            snapshot = None
+        if staged:
+            try:
+                staging_cache.compact_table(conn, source_type, digest, key_column, previous_state)
+            except Exception as e:
+                # The upload itself succeeded; only the cache is behind
+                staging_cache.invalidate_table(source_type)
+                log(f"Could not update the staging snapshot of {source_type}: {str(e)}")
+        
+        record_upload(conn, source_type, digest, total_rows)
+        
+        if total_rows > 0:
             # Obtener conteo de inserciones y actualizaciones
             cursor.execute(f"SELECT COUNT(*) FROM `{source_type}`")
             final_count = cursor.fetchone()[0]
             
             log("Data replacement completed successfully")
-            return True, f"Successfully processed {len(df)} records. Final table count: {final_count}"
+            return True, (f"Successfully processed {total_rows} records "
+                          f"({written_rows} new or changed, {total_rows - written_rows} unchanged). "
+                          f"Final table count: {final_count}")
         else:
             return True, "No records to process"
             
@@ -588,6 +1003,8 @@ def process_and_upload_file(file_path, source_type):
         return False, str(e)
         
     finally:
+        if snapshot:
+            snapshot.abort()
         if cursor:
             cursor.close()
         if conn:
@@ -633,7 +1050,7 @@ def get_source_data(source_id):
         # Convert any non-serializable types to strings
         serializable_source = {}
         for key, value in source.items():
-            if isinstance(value, (datetime, pd.Timestamp)):
+            if isinstance(value, datetime):
                 serializable_source[key] = value.isoformat()
             else:
                 serializable_source[key] = value
@@ -697,10 +1114,21 @@ def main():
     parser.add_argument('--reconcile', action='store_true', help='Perform reconciliation')
     parser.add_argument('--get-source', action='store_true', help='Get source data')
     parser.add_argument('--source-id', help='Source ID to fetch')
+    parser.add_argument('--ensure-indexes', action='store_true', help='Add any missing secondary indexes')
+    parser.add_argument('--chunksize', type=int, help='Stream the file in chunks of this many rows')
+    parser.add_argument('--bulk-load', action='store_true', help='Load chunks with LOAD DATA LOCAL INFILE')
     
     args = parser.parse_args()
     log(f"Arguments received: {args}")
     
+    if args.ensure_indexes:
+        success, result = ensure_all_indexes()
+        if not success:
+            print(f"Error ensuring indexes: {result}", file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(result))
+        sys.exit(0)
+    
     if args.get_source and args.source_id:
         success, message = get_source_data(args.source_id)
         if not success:
@@ -718,7 +1146,9 @@ def main():
         sys.exit(0)
     
     if args.file and args.source:
-        success, message = process_and_upload_file(args.file, args.source)
+        success, message = process_and_upload_file(
+            args.file, args.source, chunksize=args.chunksize, bulk_load=args.bulk_load
+        )
         if not success:
             print(f"Error processing file: {message}", file=sys.stderr)
             sys.exit(1)
@@ -0,0 +1,217 @@
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pymysql
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# MySQL Connection Parameters
+db_params = {
+    "host": os.getenv('DB_HOST', '127.0.0.1'),  # Connect to local proxy
+    "user": os.getenv('DB_USER', 'root'),
+    "password": os.getenv('DB_PASSWORD', 'Atenas9democraci.'),
+    "database": os.getenv('DB_NAME', 'thera_final_database'),
+    "port": int(os.getenv('DB_PORT', 3306)),
+    "charset": "utf8mb4",
+    "connect_timeout": 180,
+    "read_timeout": 180,
+    "write_timeout": 180
+}
+
+# Applied to every new connection before it is handed out
+SESSION_SETTINGS = {
+    "innodb_lock_wait_timeout": int(os.getenv('DB_LOCK_WAIT_TIMEOUT', 120))
+}
+
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 60))
+# Idle connections older than this are pinged before reuse
+HEALTH_CHECK_INTERVAL = int(os.getenv('DB_HEALTH_CHECK_INTERVAL', 30))
+
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
+
+def session_init_command(settings):
+    return "SET " + ", ".join(f"SESSION {name} = {value!r}" for name, value in settings.items())
+
+def connect_with_retry(max_retries=3, delay=1, backoff=2, **overrides):
+    """Open a new connection, retrying with exponential backoff"""
+    params = {**db_params, **overrides}
+    if SESSION_SETTINGS:
+        params.setdefault('init_command', session_init_command(SESSION_SETTINGS))
+    for attempt in range(max_retries):
+        try:
+            return pymysql.connect(**params)
+        except pymysql.err.OperationalError as e:
+            if attempt == max_retries - 1:  # Last attempt
+                log(f"Database connection error: {str(e)}")
+                raise
+            wait = delay * backoff ** attempt
+            log(f"Connection attempt {attempt + 1} of {max_retries} failed, retrying in {wait} seconds... Error: {str(e)}")
+            time.sleep(wait)
+
+class PooledConnection:
+    """Wraps a pymysql connection; close() hands it back to its pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise pymysql.err.InterfaceError("Connection already returned to the pool")
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class ConnectionPool:
+    """Bounded pool of MySQL connections sharing one set of connect parameters.
+
+    acquire() reuses an idle connection when one is available (pinging it if
+    it has been idle longer than HEALTH_CHECK_INTERVAL), opens a new one while
+    fewer than max_size are out, and otherwise waits up to timeout seconds.
+    """
+
+    def __init__(self, max_size=POOL_SIZE, timeout=POOL_TIMEOUT, **overrides):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.overrides = overrides
+        self._idle = deque()
+        self._open = 0
+        self._lock = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            while not self._idle and self._open >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise pymysql.err.OperationalError(f"Timed out waiting for a database connection after {self.timeout}s")
+                self._lock.wait(remaining)
+            if self._idle:
+                conn, idle_since = self._idle.pop()
+            else:
+                conn, idle_since = None, None
+            self._open += 1
+
+        try:
+            if conn is not None and time.monotonic() - idle_since > HEALTH_CHECK_INTERVAL:
+                try:
+                    conn.ping(reconnect=False)
+                except pymysql.Error:
+                    log("Discarding stale pooled connection")
+                    self._discard(conn)
+                    conn = None
+            if conn is None:
+                conn = connect_with_retry(**self.overrides)
+        except Exception:
+            with self._lock:
+                self._open -= 1
+                self._lock.notify()
+            raise
+        return PooledConnection(self, conn)
+
+    def available(self):
+        """Connections acquire() can hand out right now without waiting"""
+        with self._lock:
+            return self.max_size - self._open
+
+    def release(self, conn):
+        try:
+            # Never hand an open transaction to the next borrower
+            conn.rollback()
+        except pymysql.Error:
+            self._discard(conn)
+            conn = None
+        with self._lock:
+            self._open -= 1
+            if conn is not None:
+                self._idle.append((conn, time.monotonic()))
+            self._lock.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except pymysql.Error:
+            pass
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(**overrides):
+    """Return the shared pool for this set of connect parameter overrides"""
+    key = tuple(sorted(overrides.items()))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(**overrides)
+        return _pools[key]
+
+class MySQLBackend:
+    """The MySQL server in db_params, reached through the shared pools"""
+    name = 'mysql'
+    supports_load_data = True
+
+    def connect(self, **overrides):
+        return get_pool(**overrides).acquire()
+
+    def available_connections(self, **overrides):
+        return get_pool(**overrides).available()
+
+    def close_all(self):
+        with _pools_lock:
+            for pool in _pools.values():
+                pool.close_all()
+
+_backends = {}
+
+def get_backend():
+    """The storage backend selected by DB_BACKEND (cached per configuration).
+
+    'mysql' (the default) is the server in db_params; 'sqlite' is an
+    embedded database file at DB_SQLITE_PATH, for running the pipeline
+    without a server. Both hand out pymysql-style connections, and the
+    services issue the same MySQL-dialect SQL to either.
+    """
+    name = os.getenv('DB_BACKEND', 'mysql').lower()
+    if name == 'mysql':
+        key = (name,)
+    elif name == 'sqlite':
+        key = (name, os.getenv('DB_SQLITE_PATH', 'thera.sqlite3'))
+    else:
+        raise ValueError(f"Unknown DB_BACKEND: {name}")
+    with _pools_lock:
+        if key not in _backends:
+            if name == 'sqlite':
+                from sqlite_backend import SQLiteBackend
+                _backends[key] = SQLiteBackend(key[1])
+            else:
+                _backends[key] = MySQLBackend()
+        return _backends[key]
+
+def available_connections(**overrides):
+    """How many more connections get_db_connection can open without waiting"""
+    return get_backend().available_connections(**overrides)
+
+def get_db_connection(**overrides):
+    """Borrow a connection from the configured backend; close() returns it"""
+    return get_backend().connect(**overrides)
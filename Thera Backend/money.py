@@ -0,0 +1,146 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Amounts are handled as int counts of the currency's minor unit, i.e.
+# 10 ** -exponent of the major unit (cents for USD, yen for JPY). Currencies
+# not listed here have two decimals.
+DEFAULT_EXPONENT = 2
+CURRENCY_EXPONENTS = {
+    # Zero-decimal currencies
+    'BIF': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0,
+    'KRW': 0, 'MGA': 0, 'PYG': 0, 'RWF': 0, 'UGX': 0, 'VND': 0, 'VUV': 0,
+    'XAF': 0, 'XOF': 0, 'XPF': 0,
+    # Three-decimal currencies
+    'BHD': 3, 'JOD': 3, 'KWD': 3, 'OMR': 3, 'TND': 3
+}
+
+# Scale of the DECIMAL(20,2) amount columns in the source and match tables
+MONEY_SCALE = 2
+
+def currency_exponent(currency):
+    """Number of decimals of `currency` (an ISO code in any case, or None)"""
+    if not currency:
+        return DEFAULT_EXPONENT
+    return CURRENCY_EXPONENTS.get(str(currency).upper(), DEFAULT_EXPONENT)
+
+def to_minor(value, exponent=DEFAULT_EXPONENT):
+    """Exact int minor units for a Decimal, int, str or float amount (None stays None).
+
+    Digits beyond the exponent are rounded half away from zero, as MySQL
+    does when storing into a DECIMAL column.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, (Decimal, int)):
+        value = Decimal(str(value))
+    return int(Decimal(value).scaleb(exponent).to_integral_value(ROUND_HALF_UP))
+
+def from_minor(minor, exponent=DEFAULT_EXPONENT):
+    """Exact Decimal for an int amount in minor units (None stays None)"""
+    if minor is None:
+        return None
+    return Decimal(int(minor)).scaleb(-exponent)
+
+def format_minor(minor, exponent=DEFAULT_EXPONENT):
+    """Minor units as exact decimal text with `exponent` decimals, e.g. 1050 -> '10.50'"""
+    if minor is None:
+        return None
+    return f"{from_minor(minor, exponent):f}"
+
+def format_amount(value, currency=None):
+    """A fetched DECIMAL amount as exact text with the currency's decimals"""
+    exponent = currency_exponent(currency)
+    return format_minor(to_minor(value, exponent), exponent)
+
+def amount_number(value, currency=None):
+    """A fetched amount as a JSON number with the currency's decimals (None stays None).
+
+    JSON encoders print a float as the shortest text that reads back as the
+    same float, so amounts below 10 ** 15 minor units come out exactly as
+    their decimal text.
+    """
+    if value is None:
+        return None
+    exponent = currency_exponent(currency)
+    return float(from_minor(to_minor(value, exponent), exponent))
+
+def exponent_series(currencies):
+    """currency_exponent() for a whole column of currency codes"""
+    import pandas as pd
+    codes = pd.Series(currencies).astype('string').str.upper()
+    return codes.map(CURRENCY_EXPONENTS).fillna(DEFAULT_EXPONENT).astype('int64').to_numpy()
+
+def text_to_minor(value, exponent):
+    """to_minor() for one text amount; NA if it is not a number or does not fit in int64"""
+    import pandas as pd
+    try:
+        minor = to_minor(Decimal(str(value).strip()), exponent)
+    except (ArithmeticError, ValueError):
+        return pd.NA
+    return minor if -2 ** 63 <= minor < 2 ** 63 else pd.NA
+
+# Longest text scaled in float64: at most 15 digits stays below 2 ** 53
+MAX_FLOAT_TEXT = 15
+
+def series_to_minor(series, exponent=DEFAULT_EXPONENT):
+    """Numeric or numeric-text column as nullable Int64 minor units.
+
+    Text converts exactly as to_minor() and MySQL would, extra decimals
+    rounded half away from zero. Short text with at most `exponent` decimals
+    is a whole number of minor units, so it is scaled in float64 without any
+    rounding; the rest (more decimals, exponents, long values) goes through
+    Decimal once per distinct value. Columns that are already numeric are
+    scaled in float64, which is exact while |amount| * 10 ** exponent stays
+    below 2 ** 53. Unparseable values become NA.
+    """
+    import pandas as pd
+    import numpy as np
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        scaled = series.astype('float64').to_numpy() * np.power(10.0, exponent)
+        rounded = np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)
+        return pd.Series(rounded, index=series.index).astype('Int64')
+
+    text = series.astype('string').str.strip()
+    exact = ~text.str.contains(rf'\.\d{{{exponent + 1},}}|[eE]', na=True) & (text.str.len() <= MAX_FLOAT_TEXT)
+    numeric = pd.to_numeric(text.where(exact), errors='coerce').astype('float64').to_numpy()
+    scaled = np.rint(numeric * np.power(10.0, exponent))
+    minor = pd.Series(np.where(np.isfinite(scaled), scaled, np.nan), index=series.index).astype('Int64')
+
+    other = text.notna() & ~exact
+    if other.any():
+        converted = {value: text_to_minor(value, exponent) for value in text[other].unique()}
+        minor[other] = text[other].map(converted).astype('Int64')
+    return minor
+
+def format_minor_series(minor, exponents=DEFAULT_EXPONENT):
+    """Int64 minor units as exact decimal text (NA stays NA), without per-value Decimals.
+
+    `exponents` is one exponent for the whole column or one per row.
+    """
+    import pandas as pd
+    import numpy as np
+    minor = pd.Series(minor).astype('Int64')
+    exponents = np.broadcast_to(np.asarray(exponents, dtype='int64'), len(minor))
+    values = minor.to_numpy(dtype='int64', na_value=0)
+    scale = np.power(10, exponents).astype('int64')
+    whole, fraction = np.divmod(np.abs(values), scale)
+
+    sign = pd.Series(np.where(values < 0, '-', ''), index=minor.index)
+    text = sign + pd.Series(whole, index=minor.index).astype(str)
+    if (exponents > 0).any():
+        digits = pd.Series((fraction + scale).astype(str), index=minor.index).str[1:]
+        text = text.where(exponents == 0, text + '.' + digits)
+    return text.astype('string').mask(minor.isna())
+
+def minor_units_sql(column, currency_column=None, exponent=DEFAULT_EXPONENT):
+    """SQL expression turning a DECIMAL amount into integer minor units.
+
+    With a currency_column the exponent is looked up per row from
+    CURRENCY_EXPONENTS; otherwise `exponent` is used.
+    """
+    if currency_column is None:
+        return f"CAST(ROUND({column} * {10 ** exponent}) AS SIGNED)"
+    cases = ' '.join(
+        f"WHEN '{code}' THEN {10 ** places}" for code, places in sorted(CURRENCY_EXPONENTS.items())
+    )
+    factor = f"CASE UPPER({currency_column}) {cases} ELSE {10 ** DEFAULT_EXPONENT} END"
+    return f"CAST(ROUND({column} * {factor}) AS SIGNED)"
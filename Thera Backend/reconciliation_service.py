@@ -1,42 +1,75 @@
-import pandas as pd
 import pymysql
-from datetime import datetime
-from dotenv import load_dotenv
-import os
+from datetime import datetime, timedelta
 import sys
 import decimal
 import argparse
 import json
+import base64
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import os
+from functools import partial
+from database import get_db_connection, available_connections
+from transaction_records import fetch_records, records_frame
+import staging_cache
+from money import (
+    currency_exponent, exponent_series, to_minor, format_minor, amount_number,
+    format_minor_series, minor_units_sql
+)
 
-load_dotenv()
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
 
-# MySQL Connection Parameters
-db_params = {
-    "host": os.getenv('DB_HOST', '127.0.0.1'),  # Connect to local proxy
-    "user": os.getenv('DB_USER', 'root'),
-    "password": os.getenv('DB_PASSWORD', 'Atenas9democraci.'),
-    "database": os.getenv('DB_NAME', 'thera_final_database'),
-    "port": int(os.getenv('DB_PORT', 3306)),
-    "connect_timeout": 180
+# Secondary indexes on the match tables, keyed by index name. get_matches
+# filters on the date, merge_source, status, type and amount columns;
+# ledger/stripe ids back the anti-joins and lookups.
+MATCH_TABLE_INDEXES = {
+    'started_matches': {
+        'ledger_id': ['ledger_id'],
+        'stripe_id': ['stripe_id'],
+        'idx_started_effective_date': ['ledger_effective_date'],
+        'idx_started_source_date': ['merge_source', 'ledger_effective_date'],
+        'idx_started_status_date': ['ledger_status', 'ledger_effective_date'],
+        'idx_started_type_date': ['ledger_metadata_type', 'ledger_effective_date'],
+        'idx_started_amount': ['ledger_amount_USD']
+    },
+    'succeeded_matches': {
+        'id_ledger': ['id_ledger'],
+        'id_stripe': ['id_stripe'],
+        'idx_succeeded_effective_date': ['effective_date'],
+        'idx_succeeded_source_date': ['merge_source', 'effective_date'],
+        'idx_succeeded_status_date': ['status_ledger', 'effective_date'],
+        'idx_succeeded_type_date': ['metadata_type', 'effective_date'],
+        'idx_succeeded_amount': ['amount_USD']
+    }
 }
 
-def log(message):
-    print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
+def ensure_indexes(cursor, table_name, indexes):
+    """Add any index in `indexes` ({name: [columns]}) that the table is missing"""
+    cursor.execute(f"SHOW INDEX FROM `{table_name}`")
+    existing = {row['Key_name'] if isinstance(row, dict) else row[2] for row in cursor.fetchall()}
+    missing = [name for name in indexes if name not in existing]
+    if not missing:
+        return []
 
-def get_db_connection():
-    try:
-        return pymysql.connect(**db_params)
-    except Exception as e:
-        log(f"Database connection error: {str(e)}")
-        raise
+    log(f"Adding indexes to {table_name}: {', '.join(missing)}")
+    additions = ', '.join(
+        f"ADD INDEX `{name}` ({', '.join(f'`{col}`' for col in indexes[name])})"
+        for name in missing
+    )
+    cursor.execute(f"ALTER TABLE `{table_name}` {additions}")
+    return missing
+
+def create_table_if_not_exists(cursor, table_name, df=None, name=None):
+    """Create table if it doesn't exist with appropriate columns
 
-def create_table_if_not_exists(cursor, table_name, df=None):
-    """Create table if it doesn't exist with appropriate columns"""
+    For the match tables, `name` creates the same table under another name
+    (the shadow copy a full reconciliation builds into).
+    """
     
     if table_name == 'started_matches':
-        cursor.execute("DROP TABLE IF EXISTS started_matches")
-        cursor.execute("""
-            CREATE TABLE started_matches (
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{name or table_name}` (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 ledger_id VARCHAR(255),
                 ledger_description TEXT,
@@ -93,11 +126,12 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 INDEX(stripe_id)
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
         """)
+        ensure_indexes(cursor, name or table_name, MATCH_TABLE_INDEXES[table_name])
         return
 
     if table_name == 'succeeded_matches':
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS succeeded_matches (
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS `{name or table_name}` (
                 id INT AUTO_INCREMENT PRIMARY KEY,
                 id_ledger VARCHAR(255),
                 description_ledger TEXT,
@@ -121,6 +155,31 @@ def create_table_if_not_exists(cursor, table_name, df=None):
                 INDEX(id_stripe)
             ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
         """)
+        ensure_indexes(cursor, name or table_name, MATCH_TABLE_INDEXES[table_name])
+        return
+
+    if table_name == 'reconciliation_state':
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reconciliation_state (
+                source_table VARCHAR(255) PRIMARY KEY,
+                high_water_mark TIMESTAMP(6) NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+        """)
+        return
+
+    if table_name == 'reconciliation_summary':
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS reconciliation_summary (
+                source_table VARCHAR(64) NOT NULL,
+                bucket VARCHAR(50) NOT NULL,
+                currency VARCHAR(10) NOT NULL,
+                transaction_count BIGINT NOT NULL,
+                amount DECIMAL(20,2),
+                refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (source_table, bucket, currency)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+        """)
         return
 
     if table_name == 'balance_reconciliation_summary':
@@ -155,8 +214,9 @@ def create_table_if_not_exists(cursor, table_name, df=None):
 
 def upload_to_mysql(df, table_name):
     """Upload DataFrame to MySQL table"""
+    import pandas as pd
     try:
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor()
 
         # Drop existing data if table exists
@@ -243,8 +303,7 @@ def perform_transaction_reconciliation(cursor):
         create_table_if_not_exists(cursor, 'succeeded_matches')
         
         # 3. Make sure we commit these changes
-        conn = pymysql.connect(**db_params)
-        conn.commit()
+        cursor.connection.commit()
         
         return True
             
@@ -252,122 +311,127 @@ def perform_transaction_reconciliation(cursor):
         log(f"Error in transaction reconciliation: {str(e)}")
         return False
 
-def perform_balance_reconciliation():
-    """Perform reconciliation between Stripe balance and Ledger balances"""
+# Largest |stripe - posted| difference, in minor units of the account's
+# currency, still counted as a match
+BALANCE_TOLERANCE_MINOR = int(os.getenv('BALANCE_TOLERANCE_MINOR', 0))
+
+def perform_balance_reconciliation(ledger_subsets=None, tolerance_minor=None):
+    """Perform reconciliation between Stripe balance and Ledger balances
+
+    ledger_subsets is a scan_ledger() result shared by the reconcile job;
+    without one the ledger is scanned here. Amounts are read as int64 minor
+    units of their currency (see money.py) and summed and compared as
+    integers; a difference of at most tolerance_minor (default
+    BALANCE_TOLERANCE_MINOR) is a match.
+    """
+    import pandas as pd
+    import numpy as np
+    if tolerance_minor is None:
+        tolerance_minor = BALANCE_TOLERANCE_MINOR
     try:
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         log("Starting balance reconciliation...")
+        create_table_if_not_exists(cursor, 'balance_reconciliation_summary')
+        create_table_if_not_exists(cursor, 'reconciliation_summary')
         
         try:
-            # Get Stripe balance data
-            cursor.execute("""
-                SELECT sb.net, sb.currency, sb.balance_transaction_id
-                FROM Thera_Stripe_Balance_Changes sb
-                WHERE sb.net IS NOT NULL
-            """)
-            stripe_data = cursor.fetchall()
-            stripe_balance = pd.DataFrame(stripe_data, 
-                                        columns=['net', 'currency', 'balance_transaction_id'])
+            # The reads are independent; run them side by side
+            log("Fetching Stripe balance, ledger transactions and ledger accounts...")
+            jobs = {
+                'stripe_balance': partial(fetch_rows, f"""
+                    SELECT {minor_units_sql('sb.net', 'sb.currency')} AS net_minor, sb.currency, sb.balance_transaction_id
+                    FROM Thera_Stripe_Balance_Changes sb
+                    WHERE sb.net IS NOT NULL
+                """),
+                # Ledger account balances
+                'ledger_accounts': partial(fetch_rows, f"""
+                    SELECT 
+                        ledger_id, 
+                        name AS account_name, 
+                        currency, 
+                        {minor_units_sql('posted_balance', 'currency')} AS posted_minor
+                    FROM Thera_Ledger_Accounts
+                    WHERE posted_balance IS NOT NULL
+                      AND name IN ('Stripe Revenue', 'Stripe*', 'Stripe Fees', 'Stripe Payroll Balance')
+                """)
+            }
+            if ledger_subsets is None:
+                # Started and Succeeded Ledger transactions
+                jobs['ledger'] = scan_ledger
+            fetched = run_concurrently(jobs, conn=conn)
+            ledger_subsets = ledger_subsets or fetched['ledger']
             
-            # Get Started Ledger transactions
-            cursor.execute("""
-                SELECT *
-                FROM Thera_Ledger_Transactions
-                WHERE metadata_type = 'PAY_IN_STARTED'  # Keep this filter
-                OR metadata_latestStripeChargeId IS NOT NULL  # But make it OR instead of AND
-                OR metadata_paymentId IS NOT NULL  # Include any with payment IDs
-            """)
-            ledger_started = cursor.fetchall()
-            
-            # Get Succeeded Ledger transactions
-            cursor.execute("""
-                SELECT *
-                FROM Thera_Ledger_Transactions
-                WHERE metadata_type = 'PAY_IN_SUCCEEDED'  # Keep this filter
-                OR status = 'SUCCEEDED'  # Include any succeeded transactions
-            """)
-            ledger_succeeded = cursor.fetchall()
-            
-            # Get ledger account balances
-            cursor.execute("""
-                SELECT 
-                    ledger_id, 
-                    name AS account_name, 
-                    currency, 
-                    CAST(posted_balance AS FLOAT) as posted_balance
-                FROM Thera_Ledger_Accounts
-                WHERE posted_balance IS NOT NULL
-                  AND name IN ('Stripe Revenue', 'Stripe*', 'Stripe Fees', 'Stripe Payroll Balance')
-            """)
-            ledger_accounts = pd.DataFrame(cursor.fetchall(), 
+            stripe_balance = pd.DataFrame(fetched['stripe_balance'], 
+                                        columns=['net_minor', 'currency', 'balance_transaction_id'])
+            ledger_started = records_frame(ledger_subsets['started_matches'], BALANCE_LEDGER_COLUMNS)
+            ledger_succeeded_count = len(ledger_subsets['succeeded_matches'])
+            ledger_accounts = pd.DataFrame(fetched['ledger_accounts'], 
                                          columns=['ledger_id', 'account_name', 
-                                                'currency', 'posted_balance'])
+                                                'currency', 'posted_minor'])
             
             log(f"Found {len(stripe_balance)} Stripe records")
             log(f"Found {len(ledger_started)} Started Ledger transactions")
-            log(f"Found {len(ledger_succeeded)} Succeeded Ledger transactions")
+            log(f"Found {ledger_succeeded_count} Succeeded Ledger transactions")
             log(f"Found {len(ledger_accounts)} Ledger accounts")
             
             # Join Stripe balance changes with ledger transactions
             merged = pd.merge(
                 stripe_balance,
-                ledger_started,
+                ledger_started[['ledger_id', 'metadata_stripeBalanceTrxId']],
                 left_on="balance_transaction_id",
                 right_on="metadata_stripeBalanceTrxId",
                 how="inner"
             )
             
             # Clean and prepare data
-            merged['net'] = pd.to_numeric(merged['net'], errors='coerce')
             merged['currency'] = merged['currency'].str.lower()
-            merged = merged.dropna(subset=['net', 'ledger_id', 'currency'])
-            
+            merged = merged.dropna(subset=['net_minor', 'ledger_id', 'currency'])
+            merged['net_minor'] = merged['net_minor'].astype('int64')
             log(f"Merged data shape: {merged.shape}")
-            log(f"Sample merged data:\n{merged.head().to_string()}")
             
             # Sum net balance by ledger_id and currency
-            stripe_grouped = merged.groupby(['ledger_id', 'currency']).agg(
-                stripe_net_balance=pd.NamedAgg(column='net', aggfunc='sum')
-            ).reset_index()
-            
+            stripe_grouped = (
+                merged.groupby(['ledger_id', 'currency'])['net_minor'].sum()
+                .astype('Int64').rename('stripe_net_minor').reset_index()
+            )
             log(f"Grouped data shape: {stripe_grouped.shape}")
-            log(f"Sample grouped data:\n{stripe_grouped.head().to_string()}")
             
-            # Merge with ledger account balances
+            # Merge with ledger account balances; accounts without Stripe
+            # activity have a Stripe balance of 0
             reconciliation = pd.merge(
                 ledger_accounts,
                 stripe_grouped,
                 on=['ledger_id', 'currency'],
                 how='left'
             )
-            
-            # Fill NaN values with 0
-            reconciliation['stripe_net_balance'] = reconciliation['stripe_net_balance'].fillna(0.0)
-            
-            # Calculate difference and status
-            reconciliation['difference'] = reconciliation['stripe_net_balance'] - reconciliation['posted_balance']
-            reconciliation['status'] = reconciliation['difference'].apply(
-                lambda x: 'match' if abs(x) < 0.01 else 'mismatch')
-            reconciliation['created_at'] = pd.Timestamp.now()
-            
-            log(f"Final reconciliation shape: {reconciliation.shape}")
-            log(f"Sample results:\n{reconciliation.head().to_string()}")
+            stripe_net = reconciliation['stripe_net_minor'].fillna(0).to_numpy(dtype='int64')
+            posted = reconciliation['posted_minor'].to_numpy(dtype='int64')
+            difference = stripe_net - posted
+            status = np.where(np.abs(difference) <= tolerance_minor, 'match', 'mismatch')
+            log(f"Final reconciliation shape: {reconciliation.shape}, "
+                f"{int((status == 'mismatch').sum())} mismatches")
             
             # Upload to database
             cursor.execute("TRUNCATE TABLE balance_reconciliation_summary")
             
             if not reconciliation.empty:
-                columns = ', '.join(f'`{col}`' for col in reconciliation.columns)
-                placeholders = ', '.join(['%s'] * len(reconciliation.columns))
-                insert_query = f"""
+                exponents = exponent_series(reconciliation['currency'])
+                amounts = [format_minor_series(minor, exponents).tolist()
+                           for minor in (stripe_net, posted, difference)]
+                values = list(zip(
+                    reconciliation['ledger_id'], reconciliation['account_name'], reconciliation['currency'],
+                    *amounts, status.tolist()
+                ))
+                cursor.executemany("""
                     INSERT INTO balance_reconciliation_summary 
-                    ({columns}) VALUES ({placeholders})
-                """
-                values = [tuple(x) for x in reconciliation.values]
-                cursor.executemany(insert_query, values)
-                conn.commit()
+                    (ledger_id, account_name, currency, stripe_net_balance, posted_balance, difference, status)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, values)
+            
+            refresh_summary(cursor, ['balance_reconciliation_summary'])
+            conn.commit()
             
             return True, "Balance reconciliation completed successfully"
             
@@ -425,8 +489,9 @@ def create_tables_if_not_exist(cursor):
 
 def perform_transaction_matching():
     """Perform transaction matching between Stripe and Ledger"""
+    import pandas as pd
     try:
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
         # Create tables if they don't exist
@@ -524,323 +589,1058 @@ def perform_transaction_matching():
         if 'conn' in locals():
             conn.close()
 
-def perform_reconciliation():
-    """Perform reconciliation between Stripe and Ledger data"""
+# Row schema shared by the hash and vectorized matchers. Each entry is
+# (output column, side, source column, conversion): side is 'ledger' or
+# 'stripe' (None for merge_source) and conversion is one of
+#   'amount' -> float, with NULL/zero stored as NULL
+#   'float'  -> float, NULL kept as NULL
+#   'flag'   -> 1/0 truthiness
+#   None     -> value passed through unchanged
+STARTED_MATCH_SCHEMA = [
+    ('ledger_id', 'ledger', 'id', None),
+    ('ledger_description', 'ledger', 'description', None),
+    ('ledger_status', 'ledger', 'status', None),
+    ('ledger_ledger_id', 'ledger', 'ledger_id', None),
+    ('ledger_effective_date', 'ledger', 'effective_date', None),
+    ('ledger_posted_at', 'ledger', 'posted_at', None),
+    ('ledger_metadata', 'ledger', 'metadata', None),
+    ('ledger_amount_USD', 'ledger', 'amount_USD', 'amount'),
+    ('ledger_currency_USD', 'ledger', 'currency_USD', None),
+    ('ledger_amount_EUR', 'ledger', 'amount_EUR', 'amount'),
+    ('ledger_currency_EUR', 'ledger', 'currency_EUR', None),
+    ('ledger_amount_GBP', 'ledger', 'amount_GBP', 'amount'),
+    ('ledger_currency_GBP', 'ledger', 'currency_GBP', None),
+    ('ledger_metadata_latestStripeChargeId', 'ledger', 'metadata_latestStripeChargeId', None),
+    ('ledger_metadata_payInType', 'ledger', 'metadata_payInType', None),
+    ('ledger_metadata_paymentId', 'ledger', 'metadata_paymentId', None),
+    ('ledger_metadata_paymentMethodId', 'ledger', 'metadata_paymentMethodId', None),
+    ('ledger_metadata_stripeBalanceTrxId', 'ledger', 'metadata_stripeBalanceTrxId', None),
+    ('ledger_metadata_stripeExchangeRate', 'ledger', 'metadata_stripeExchangeRate', 'amount'),
+    ('ledger_metadata_type', 'ledger', 'metadata_type', None),
+    ('ledger_effective_at', 'ledger', 'effective_at', None),
+    ('stripe_id', 'stripe', 'id', None),
+    ('stripe_amount', 'stripe', 'amount', 'float'),
+    ('stripe_amount_refunded', 'stripe', 'amount_refunded', 'amount'),
+    ('stripe_currency', 'stripe', 'currency', None),
+    ('stripe_captured', 'stripe', 'captured', 'flag'),
+    ('stripe_converted_amount', 'stripe', 'converted_amount', 'float'),
+    ('stripe_converted_amount_refunded', 'stripe', 'converted_amount_refunded', 'float'),
+    ('stripe_converted_currency', 'stripe', 'converted_currency', None),
+    ('stripe_decline_reason', 'stripe', 'decline_reason', None),
+    ('stripe_description', 'stripe', 'description', None),
+    ('stripe_fee', 'stripe', 'fee', 'amount'),
+    ('stripe_is_link', 'stripe', 'is_link', 'flag'),
+    ('stripe_link_funding', 'stripe', 'link_funding', None),
+    ('stripe_mode', 'stripe', 'mode', None),
+    ('stripe_paymentintent_id', 'stripe', 'PaymentIntent_ID', None),
+    ('stripe_payment_source_type', 'stripe', 'payment_source_type', None),
+    ('stripe_created_date_utc', 'stripe', 'created_date_utc', None),
+    ('stripe_refunded_date_utc', 'stripe', 'refunded_date_utc', None),
+    ('stripe_statement_descriptor', 'stripe', 'statement_descriptor', None),
+    ('stripe_status', 'stripe', 'status', None),
+    ('stripe_seller_message', 'stripe', 'seller_message', None),
+    ('stripe_taxes_on_fee', 'stripe', 'taxes_on_fee', 'amount'),
+    ('stripe_card_id', 'stripe', 'card_id', None),
+    ('stripe_card_name', 'stripe', 'card_name', None),
+    ('stripe_card_brand', 'stripe', 'card_brand', None),
+    ('stripe_card_last4', 'stripe', 'card_last4', None),
+    ('stripe_customer_id', 'stripe', 'Customer_ID', None),
+    ('stripe_customer_email', 'stripe', 'Customer_Email', None),
+    ('merge_source', None, None, None)
+]
+
+SUCCEEDED_MATCH_SCHEMA = [
+    ('id_ledger', 'ledger', 'id', None),
+    ('description_ledger', 'ledger', 'description', None),
+    ('status_ledger', 'ledger', 'status', None),
+    ('ledger_id', 'ledger', 'ledger_id', None),
+    ('effective_date', 'ledger', 'effective_date', None),
+    ('posted_at', 'ledger', 'posted_at', None),
+    ('metadata', 'ledger', 'metadata', None),
+    ('amount_USD', 'ledger', 'amount_USD', 'amount'),
+    ('currency_USD', 'ledger', 'currency_USD', None),
+    ('metadata_paymentId', 'ledger', 'metadata_paymentId', None),
+    ('metadata_type', 'ledger', 'metadata_type', None),
+    ('id_stripe', 'stripe', 'id', None),
+    ('created_date_utc', 'stripe', 'created_date_utc', None),
+    ('amount', 'stripe', 'amount', 'float'),
+    ('currency', 'stripe', 'currency', None),
+    ('paymentintent_id', 'stripe', 'PaymentIntent_ID', None),
+    ('status_stripe', 'stripe', 'status', None),
+    ('merge_source', None, None, None)
+]
+
+# Ledger subsets each pass matches against
+LEDGER_STARTED_FILTER = """
+    metadata_type = 'PAY_IN_STARTED'
+    OR metadata_latestStripeChargeId IS NOT NULL
+    OR metadata_paymentId IS NOT NULL
+"""
+
+LEDGER_SUCCEEDED_FILTER = """
+    metadata_type = 'PAY_IN_SUCCEEDED'
+    OR status = 'SUCCEEDED'
+"""
+
+# The same subsets as filters on the Parquet staging snapshots (see
+# staging_cache.filter_expression), keyed by match table
+STAGING_LEDGER_FILTERS = {
+    'started_matches': [
+        [('metadata_type', '==', 'PAY_IN_STARTED')],
+        [('metadata_latestStripeChargeId', 'not null', None)],
+        [('metadata_paymentId', 'not null', None)]
+    ],
+    'succeeded_matches': [
+        [('metadata_type', '==', 'PAY_IN_SUCCEEDED')],
+        [('status', '==', 'SUCCEEDED')]
+    ]
+}
+
+STAGING_STRIPE_PAID_FILTER = [[('status', '==', 'Paid')]]
+
+# Paid Stripe charges, with the aliases the matchers expect
+STRIPE_PAID_QUERY = """
+    SELECT 
+        id,
+        amount,
+        amount_refunded,
+        currency,
+        captured,
+        converted_amount,
+        converted_amount_refunded,
+        converted_currency,
+        decline_reason,
+        description,
+        fee,
+        is_link,
+        link_funding,
+        mode,
+        paymentintent_id as PaymentIntent_ID,
+        payment_source_type,
+        created_date_utc,
+        refunded_date_utc,
+        statement_descriptor,
+        status,
+        seller_message,
+        taxes_on_fee,
+        card_id,
+        card_name,
+        card_brand,
+        card_last4,
+        customer_id as Customer_ID,
+        customer_email as Customer_Email
+    FROM Thera_Stripe_Incoming_Transactions
+    WHERE status = 'Paid'
+"""
+
+# Stripe columns the fetch query aliases, keyed by alias
+STRIPE_COLUMN_ALIASES = {
+    'PaymentIntent_ID': 'paymentintent_id',
+    'Customer_ID': 'customer_id',
+    'Customer_Email': 'customer_email'
+}
+
+# Amount columns the matchers carry as int minor units, mapped to the
+# column holding their currency (Stripe fees are in the converted currency)
+MONEY_COLUMNS = {
+    'stripe': {
+        'amount': 'currency',
+        'amount_refunded': 'currency',
+        'converted_amount': 'converted_currency',
+        'converted_amount_refunded': 'converted_currency',
+        'fee': 'converted_currency',
+        'taxes_on_fee': 'converted_currency'
+    },
+    'ledger': {
+        'amount_USD': 'currency_USD',
+        'amount_EUR': 'currency_EUR',
+        'amount_GBP': 'currency_GBP'
+    }
+}
+
+def money_columns(schema, side):
+    """{amount column: currency column} for the money columns of `side` in the schema"""
+    return {k: MONEY_COLUMNS[side][k] for _, s, k, _ in schema if s == side and k in MONEY_COLUMNS[side]}
+
+def side_columns(schema, side, key):
+    """Columns of `side` a matcher reads for this schema: its fields, the join key, id
+    and the currency of each amount"""
+    columns = [k for _, s, k, _ in schema if s == side]
+    currencies = list(money_columns(schema, side).values())
+    return list(dict.fromkeys(['id', key] + columns + currencies))
+
+def numeric_columns(schema, side):
+    """Non-money columns of `side` the schema converts to float (safe to fetch as floats)"""
+    return {k for _, s, k, conversion in schema
+            if s == side and conversion in ('amount', 'float') and k not in MONEY_COLUMNS[side]}
+
+def stripe_paid_query(columns):
+    """STRIPE_PAID_QUERY restricted to `columns` (aliases included)"""
+    select_list = ', '.join(
+        f"{STRIPE_COLUMN_ALIASES[column]} AS {column}" if column in STRIPE_COLUMN_ALIASES else f"`{column}`"
+        for column in columns
+    )
+    return f"""
+    SELECT {select_list}
+    FROM Thera_Stripe_Incoming_Transactions
+    WHERE status = 'Paid'
+"""
+
+def ledger_query(columns, ledger_filter):
+    return f"""
+        SELECT {', '.join(f'`{column}`' for column in columns)}
+        FROM Thera_Ledger_Transactions
+        WHERE ({ledger_filter})
+    """
+
+# Ledger columns balance reconciliation reads from the started subset
+BALANCE_LEDGER_COLUMNS = ['id', 'ledger_id', 'metadata_stripeBalanceTrxId']
+
+def scan_staged_ledger(conn, columns, float_columns, minor_columns):
+    """scan_ledger's records read from the ledger's Parquet snapshot, or None
+    if there is no current one"""
+    any_subset = [alternative for table_name, *_ in RECONCILIATION_PASSES
+                  for alternative in STAGING_LEDGER_FILTERS[table_name]]
+    table = staging_cache.read_table(conn, 'Thera_Ledger_Transactions', columns, any_subset)
+    if table is None:
+        return None
+    for table_name, *_ in RECONCILIATION_PASSES:
+        table = table.append_column(
+            f'_in_{table_name}', staging_cache.filter_mask(table, STAGING_LEDGER_FILTERS[table_name])
+        )
+    return staging_cache.table_records(table, float_columns, minor_columns)
+
+def scan_ledger(conn=None, from_staging=False):
+    """Read the ledger rows every reconciler needs in a single scan.
+
+    Each pass's filter is evaluated in the same SELECT as a membership flag,
+    so a row in both subsets is transferred once and the two subset lists
+    share its record. Returns {match table: [records]} in id order, for one
+    reconcile job to hand to every pass and to balance reconciliation.
+
+    With from_staging the rows come from the ledger's Parquet snapshot when
+    it is current (scan_staged_ledger), and from MySQL otherwise.
+    """
+    columns, floats, minors = list(BALANCE_LEDGER_COLUMNS), set(), {}
+    for _, schema, _, _, ledger_key in RECONCILIATION_PASSES:
+        columns += side_columns(schema, 'ledger', ledger_key)
+        floats |= numeric_columns(schema, 'ledger')
+        minors.update(money_columns(schema, 'ledger'))
+    columns = list(dict.fromkeys(columns))
+
+    flags = ', '.join(
+        f"(({ledger_filter})) IS TRUE AS `_in_{table_name}`"
+        for table_name, _, ledger_filter, _, _ in RECONCILIATION_PASSES
+    )
+    any_subset = ' OR '.join(f"({ledger_filter})" for _, _, ledger_filter, _, _ in RECONCILIATION_PASSES)
+    query = f"""
+        SELECT {', '.join(f'`{column}`' for column in columns)}, {flags}
+        FROM Thera_Ledger_Transactions
+        WHERE {any_subset}
+        ORDER BY id
+    """
+
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        records = scan_staged_ledger(conn, columns, floats, minors) if from_staging else None
+        if records is None:
+            records = fetch_records(conn, query, float_columns=floats, minor_columns=minors)
+    finally:
+        if own_conn:
+            conn.close()
+
+    subsets = {
+        table_name: [record for record in records if record[f'_in_{table_name}']]
+        for table_name, *_ in RECONCILIATION_PASSES
+    }
+    log(f"Scanned {len(records)} ledger rows: " +
+        ', '.join(f"{len(rows)} for {table_name}" for table_name, rows in subsets.items()))
+    return subsets
+
+def match_sql_expression(side, key, conversion):
+    """SQL equivalent of convert_match_value for one schema entry"""
+    if side == 'stripe':
+        column = f"s.`{STRIPE_COLUMN_ALIASES.get(key, key)}`"
+    else:
+        column = f"l.`{key}`"
+    if conversion == 'amount':
+        return f"NULLIF({column}, 0)"
+    if conversion == 'flag':
+        return f"CASE WHEN {column} IS NULL OR {column} = '' THEN 0 ELSE 1 END"
+    return column
+
+def reconcile_in_database(cursor, table_name, schema, ledger_filter, stripe_key, ledger_key):
+    """Fill a match table with set-based INSERT ... SELECT joins and return its counters.
+
+    Matches and stripe_only rows come from one LEFT JOIN of the Paid Stripe
+    charges onto the first ledger row (lowest id) per join key; ledger_only
+    rows are an anti-join of the ledger subset against the rows just matched.
+    NULL keys compare equal (<=>), as they do in the Python matchers.
+    """
+    columns = ', '.join(f"`{column}`" for column, _, _, _ in schema)
+    ledger_id_column = next(column for column, side, key, _ in schema if side == 'ledger' and key == 'id')
+    stripe_column = STRIPE_COLUMN_ALIASES.get(stripe_key, stripe_key)
+
+    matched_select = ', '.join(
+        "CASE WHEN l.id IS NULL THEN 'stripe_only' ELSE 'match' END" if side is None
+        else match_sql_expression(side, key, conversion)
+        for _, side, key, conversion in schema
+    )
+    cursor.execute(f"""
+        INSERT INTO `{table_name}` ({columns})
+        SELECT {matched_select}
+        FROM Thera_Stripe_Incoming_Transactions s
+        LEFT JOIN (
+            SELECT `{ledger_key}` AS match_key, MIN(id) AS ledger_tx_id
+            FROM Thera_Ledger_Transactions
+            WHERE ({ledger_filter})
+            GROUP BY `{ledger_key}`
+        ) k ON k.match_key <=> s.`{stripe_column}`
+        LEFT JOIN Thera_Ledger_Transactions l ON l.id = k.ledger_tx_id
+        WHERE s.status = 'Paid'
+        ORDER BY s.id
+    """)
+
+    ledger_only_select = ', '.join(
+        "'ledger_only'" if side is None
+        else 'NULL' if side == 'stripe'
+        else match_sql_expression(side, key, conversion)
+        for _, side, key, conversion in schema
+    )
+    cursor.execute(f"""
+        INSERT INTO `{table_name}` ({columns})
+        SELECT {ledger_only_select}
+        FROM Thera_Ledger_Transactions l
+        WHERE ({ledger_filter})
+        AND NOT EXISTS (
+            SELECT 1 FROM `{table_name}` m
+            WHERE m.`{ledger_id_column}` = l.id AND m.merge_source = 'match'
+        )
+        ORDER BY l.id
+    """)
+
+    return count_merge_sources(cursor, table_name)
+
+# Matchers available to perform_reconciliation(mode=...)
+RECONCILIATION_MODES = ['hash', 'vectorized', 'sql']
+
+def index_ledger_by(ledger_transactions, key):
+    """Map each value of `key` to the first ledger row that carries it"""
+    index = {}
+    for ledger_tx in ledger_transactions:
+        index.setdefault(ledger_tx[key], ledger_tx)
+    return index
+
+def match_transactions(stripe_transactions, ledger_transactions, stripe_key, ledger_key):
+    """Classify Stripe and ledger rows as match / stripe_only / ledger_only.
+
+    Builds the ledger index once and does a single pass over each side, so the
+    cost is linear in the number of rows. Returns (pairs, counts) where pairs
+    holds (stripe_tx, ledger_tx, merge_source) tuples: every Stripe row in
+    input order, followed by the ledger rows that no Stripe row matched.
+    """
+    counts = {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
+    ledger_index = index_ledger_by(ledger_transactions, ledger_key)
+    matched_ledger_ids = set()
+    pairs = []
+
+    for stripe_tx in stripe_transactions:
+        matching_ledger = ledger_index.get(stripe_tx[stripe_key])
+        if matching_ledger is not None:
+            merge_source = 'match'
+            matched_ledger_ids.add(matching_ledger['id'])
+        else:
+            merge_source = 'stripe_only'
+        counts[merge_source] += 1
+        pairs.append((stripe_tx, matching_ledger, merge_source))
+
+    for ledger_tx in ledger_transactions:
+        if ledger_tx['id'] not in matched_ledger_ids:
+            counts['ledger_only'] += 1
+            pairs.append((None, ledger_tx, 'ledger_only'))
+
+    return pairs, counts
+
+def convert_match_value(value, conversion, exponent=None):
+    """Apply a schema conversion to a single value.
+
+    An exponent marks a money column held in minor units; it is written back
+    as exact decimal text, like convert_money_column does.
+    """
+    if exponent is not None and conversion in ('amount', 'float'):
+        if conversion == 'amount' and not value:
+            return None
+        return format_minor(value, exponent)
+    if conversion == 'amount':
+        return float(value) if value else None
+    if conversion == 'float':
+        return float(value) if value is not None else None
+    if conversion == 'flag':
+        return 1 if value else 0
+    return value
+
+def build_match_row(schema, stripe_tx, ledger_tx, merge_source):
+    """Build one match-table row in schema order"""
+    row = []
+    for _, side, key, conversion in schema:
+        if side is None:
+            row.append(merge_source)
+            continue
+        record = stripe_tx if side == 'stripe' else ledger_tx
+        if record is None:
+            row.append(None)
+            continue
+        currency_column = MONEY_COLUMNS[side].get(key)
+        exponent = currency_exponent(record[currency_column]) if currency_column else None
+        row.append(convert_match_value(record[key], conversion, exponent))
+    return tuple(row)
+
+def match_rows(schema, stripe_transactions, ledger_transactions, stripe_key, ledger_key):
+    """Hash matcher: returns (rows, counts) ready for executemany"""
+    pairs, counts = match_transactions(
+        stripe_transactions, ledger_transactions, stripe_key, ledger_key
+    )
+    return [build_match_row(schema, *pair) for pair in pairs], counts
+
+def convert_match_column(column, conversion):
+    """Apply a schema conversion to a whole column, returning an object array with None for NULL"""
+    import pandas as pd
+    import numpy as np
+    if pd.api.types.is_datetime64_any_dtype(column):
+        column = column.dt.strftime('%Y-%m-%d %H:%M:%S')
+    elif conversion in ('amount', 'float'):
+        column = pd.to_numeric(column, errors='coerce')
+        if conversion == 'amount':
+            column = column.where(column != 0)
+    elif conversion == 'flag':
+        column = pd.Series(
+            np.where(column.isna(), 0, column.astype(object).astype(bool)).astype(int),
+            index=column.index
+        )
+    column = column.astype(object)
+    return column.where(column.notna(), None).to_numpy(copy=True)
+
+def convert_money_column(column, conversion, exponents):
+    """convert_match_column for an amount in minor units: exact decimal text per row's exponent"""
+    minor = column.astype('Int64')
+    if conversion == 'amount':
+        minor = minor.mask(minor == 0)
+    text = format_minor_series(minor, exponents).astype(object)
+    return text.where(text.notna(), None).to_numpy(copy=True)
+
+def match_rows_vectorized(schema, stripe_transactions, ledger_transactions, stripe_key, ledger_key):
+    """Vectorized matcher: same (rows, counts) as match_rows, computed with one DataFrame merge.
+
+    Only the first ledger row per key takes part in the merge, mirroring the
+    hash index; the remaining duplicates can never match and are appended as
+    ledger_only. Rows keep the hash matcher's order.
+    """
+    import pandas as pd
+    import numpy as np
+    stripe_columns = {key for _, side, key, _ in schema if side == 'stripe'} | {stripe_key}
+    stripe_columns |= set(money_columns(schema, 'stripe').values())
+    ledger_columns = {key for _, side, key, _ in schema if side == 'ledger'} | {'id', ledger_key}
+    ledger_columns |= set(money_columns(schema, 'ledger').values())
+
+    stripe = records_frame(stripe_transactions, sorted(stripe_columns))
+    stripe = stripe.add_prefix('stripe.')
+    stripe['_stripe_pos'] = np.arange(len(stripe))
+
+    ledger = records_frame(ledger_transactions, sorted(ledger_columns))
+    ledger = ledger.add_prefix('ledger.')
+    ledger['_ledger_pos'] = np.arange(len(ledger))
+    first_per_key = ~ledger[f'ledger.{ledger_key}'].duplicated(keep='first')
+
+    merged = stripe.merge(
+        ledger[first_per_key],
+        how='outer',
+        left_on=f'stripe.{stripe_key}',
+        right_on=f'ledger.{ledger_key}',
+        indicator=True,
+        sort=False
+    )
+    duplicates = ledger[~first_per_key].assign(_merge='right_only')
+    merged = pd.concat([merged, duplicates], ignore_index=True)
+
+    merged['merge_source'] = merged['_merge'].astype(str).map({
+        'both': 'match',
+        'left_only': 'stripe_only',
+        'right_only': 'ledger_only'
+    })
+    merged['_ledger_only'] = merged['merge_source'] == 'ledger_only'
+    merged = merged.sort_values(['_ledger_only', '_stripe_pos', '_ledger_pos'], kind='stable')
+
+    counts = {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
+    counts.update({k: int(v) for k, v in merged['merge_source'].value_counts().items()})
+
+    arrays = []
+    for column, side, key, conversion in schema:
+        if side is None:
+            arrays.append(merged['merge_source'].to_numpy(dtype=object))
+            continue
+        currency_column = MONEY_COLUMNS[side].get(key)
+        if currency_column and conversion in ('amount', 'float'):
+            exponents = exponent_series(merged[f'{side}.{currency_column}'])
+            values = convert_money_column(merged[f'{side}.{key}'], conversion, exponents)
+        else:
+            values = convert_match_column(merged[f'{side}.{key}'], conversion)
+        if conversion == 'flag':
+            # Flags only exist for rows that have this side
+            present = merged['_ledger_only'] if side == 'stripe' else merged['merge_source'] == 'stripe_only'
+            values[present.to_numpy()] = None
+        arrays.append(values)
+
+    return list(zip(*arrays)), counts
+
+MATCHERS = {
+    'hash': match_rows,
+    'vectorized': match_rows_vectorized
+}
+
+# (match table, schema, ledger filter, stripe key, ledger key) for each pass
+RECONCILIATION_PASSES = [
+    ('started_matches', STARTED_MATCH_SCHEMA, LEDGER_STARTED_FILTER, 'id', 'metadata_latestStripeChargeId'),
+    ('succeeded_matches', SUCCEEDED_MATCH_SCHEMA, LEDGER_SUCCEEDED_FILTER, 'PaymentIntent_ID', 'metadata_paymentId')
+]
+
+# Source tables whose loaded_at column drives incremental reconciliation
+WATERMARK_SOURCES = ['Thera_Stripe_Incoming_Transactions', 'Thera_Ledger_Transactions']
+
+def schema_column(schema, side, key):
+    """Name of the match-table column filled from `side`.`key`"""
+    return next(column for column, s, k, _ in schema if s == side and k == key)
+
+def count_merge_sources(cursor, table_name):
+    """Count a match table's rows per merge_source"""
+    counts = {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
+    cursor.execute(f"""
+        SELECT merge_source, COUNT(*) AS total
+        FROM `{table_name}`
+        GROUP BY merge_source
+    """)
+    for row in cursor.fetchall():
+        counts[row['merge_source']] = int(row['total'])
+    return counts
+
+def current_watermarks(cursor):
+    """Latest loaded_at of each source table (None if empty or not tracked)"""
+    marks = {}
+    for table_name in WATERMARK_SOURCES:
+        cursor.execute(f"SHOW COLUMNS FROM `{table_name}` LIKE 'loaded_at'")
+        if not cursor.fetchone():
+            marks[table_name] = None
+            continue
+        cursor.execute(f"SELECT MAX(loaded_at) AS mark FROM `{table_name}`")
+        marks[table_name] = cursor.fetchone()['mark']
+    return marks
+
+def read_watermarks(cursor):
+    """High-water marks saved by the last reconciliation run"""
+    cursor.execute("SELECT source_table, high_water_mark FROM reconciliation_state")
+    return {row['source_table']: row['high_water_mark'] for row in cursor.fetchall()}
+
+def save_watermarks(cursor, marks):
+    cursor.executemany("""
+        REPLACE INTO reconciliation_state (source_table, high_water_mark)
+        VALUES (%s, %s)
+    """, list(marks.items()))
+
+def fetch_by_keys(cursor, query, column, keys, order_by=None, chunk_size=1000, null_ids=None):
+    """Run `query` restricted to rows whose `column` is in `keys` (NULL included if present).
+
+    With null_ids the NULL-key rows are limited to those ids, for callers
+    that know a NULL key pairs with nothing.
+    """
+    keys = list(keys)
+    values = [key for key in keys if key is not None]
+    order = f" ORDER BY {order_by}" if order_by else ""
+    rows = []
+    for i in range(0, len(values), chunk_size):
+        cursor.execute(f"{query} AND {column} IN %s{order}", (tuple(values[i:i + chunk_size]),))
+        rows.extend(cursor.fetchall())
+    if len(values) < len(keys):
+        if null_ids is None:
+            cursor.execute(f"{query} AND {column} IS NULL{order}")
+            rows.extend(cursor.fetchall())
+        else:
+            ids = list(null_ids)
+            for i in range(0, len(ids), chunk_size):
+                cursor.execute(f"{query} AND {column} IS NULL AND id IN %s{order}",
+                               (tuple(ids[i:i + chunk_size]),))
+                rows.extend(cursor.fetchall())
+    return rows
+
+def rows_to_minor(rows, minor_columns):
+    """Turn the DECIMAL amounts of DictCursor rows into minor units in place, as fetch_records does"""
+    for row in rows:
+        for column, currency_column in minor_columns.items():
+            if row.get(column) is not None:
+                row[column] = to_minor(row[column], currency_exponent(row.get(currency_column)))
+    return rows
+
+def insert_match_rows(cursor, table_name, schema, rows):
+    columns = [column for column, _, _, _ in schema]
+    placeholders = ', '.join(['%s'] * len(columns))
+    cursor.executemany(f"""
+        INSERT INTO `{table_name}` ({', '.join(columns)})
+        VALUES ({placeholders})
+    """, rows)
+
+def delete_by_ids(cursor, table_name, column, ids, chunk_size=1000):
+    ids = list(ids)
+    for i in range(0, len(ids), chunk_size):
+        cursor.execute(
+            f"DELETE FROM `{table_name}` WHERE `{column}` IN %s",
+            (tuple(ids[i:i + chunk_size]),)
+        )
+
+def reconcile_pass_incrementally(cursor, reconciliation_pass, marks, matcher):
+    """Re-match only the join keys touched since `marks` and upsert them into the match table.
+
+    Every Paid Stripe charge and every ledger row (in the pass's subset) that
+    shares a key with a new or changed row is re-matched, which reproduces
+    what a full run would write for those keys: ledger_only rows that found a
+    partner become matches, and the previous rows for those ids are replaced.
+    Match rows whose Stripe or ledger row is gone, or has left the pass's
+    subset, are deleted and their keys re-matched as well. Finding them is
+    one anti-join over the match table against the source primary keys.
+    Returns (counts, rows_written).
+    """
+    table_name, schema, ledger_filter, stripe_key, ledger_key = reconciliation_pass
+    stripe_column = STRIPE_COLUMN_ALIASES.get(stripe_key, stripe_key)
+    stripe_mark = marks.get('Thera_Stripe_Incoming_Transactions')
+    ledger_mark = marks.get('Thera_Ledger_Transactions')
+
+    if stripe_mark is None:
+        cursor.execute(STRIPE_PAID_QUERY)
+    else:
+        cursor.execute(f"{STRIPE_PAID_QUERY} AND loaded_at > %s", (stripe_mark,))
+    delta_stripe = cursor.fetchall()
+
+    ledger_delta_query = f"""
+        SELECT id, `{ledger_key}` AS match_key
+        FROM Thera_Ledger_Transactions
+        WHERE ({ledger_filter})
+    """
+    if ledger_mark is None:
+        cursor.execute(ledger_delta_query)
+    else:
+        cursor.execute(f"{ledger_delta_query} AND loaded_at > %s", (ledger_mark,))
+    delta_ledger = cursor.fetchall()
+
+    keys = {tx[stripe_key] for tx in delta_stripe} | {row['match_key'] for row in delta_ledger}
+
+    # A changed row may have moved to a new key; its previous key has to be
+    # re-matched too so the partner it leaves behind is reclassified
+    previous_query = f"""
+        SELECT `{schema_column(schema, 'stripe', stripe_key)}` AS stripe_key,
+               `{schema_column(schema, 'ledger', ledger_key)}` AS ledger_key,
+               merge_source
+        FROM `{table_name}`
+        WHERE 1=1
+    """
+    previous = fetch_by_keys(cursor, previous_query, f"`{schema_column(schema, 'stripe', 'id')}`",
+                             {tx['id'] for tx in delta_stripe})
+    previous += fetch_by_keys(cursor, previous_query, f"`{schema_column(schema, 'ledger', 'id')}`",
+                              {row['id'] for row in delta_ledger})
+    keys |= {row['ledger_key'] if row['merge_source'] == 'ledger_only' else row['stripe_key']
+             for row in previous}
+
+    # Rows whose source row was removed (or is no longer Paid / in the
+    # pass's subset) have no delta to find them by; a full run would not
+    # write them, so they go, and their partners' keys are re-matched
+    stripe_id_column = schema_column(schema, 'stripe', 'id')
+    ledger_id_column = schema_column(schema, 'ledger', 'id')
+    cursor.execute(f"""
+        SELECT id,
+               `{schema_column(schema, 'stripe', stripe_key)}` AS stripe_key,
+               `{schema_column(schema, 'ledger', ledger_key)}` AS ledger_key
+        FROM `{table_name}` m
+        WHERE (m.`{stripe_id_column}` IS NOT NULL AND NOT EXISTS (
+                  SELECT 1 FROM Thera_Stripe_Incoming_Transactions s
+                  WHERE s.id = m.`{stripe_id_column}` AND s.status = 'Paid'))
+           OR (m.`{ledger_id_column}` IS NOT NULL AND NOT EXISTS (
+                  SELECT 1 FROM Thera_Ledger_Transactions l
+                  WHERE l.id = m.`{ledger_id_column}` AND ({ledger_filter})))
+    """)
+    orphans = cursor.fetchall()
+    delete_by_ids(cursor, table_name, 'id', [row['id'] for row in orphans])
+    keys |= {row['stripe_key'] for row in orphans} | {row['ledger_key'] for row in orphans}
+
+    if not keys:
+        return count_merge_sources(cursor, table_name), 0
+
+    # Both matchers pair a NULL key with a NULL key, but only if some Paid
+    # charge lacks the key (never in the started pass, keyed by charge id).
+    # Otherwise every NULL-key ledger row is ledger_only on its own, and only
+    # the changed ones need re-matching, not all of them.
+    null_ids = None
+    if None in keys:
+        cursor.execute(f"{STRIPE_PAID_QUERY} AND `{stripe_column}` IS NULL LIMIT 1")
+        if not cursor.fetchall():
+            null_ids = {row['id'] for row in delta_ledger}
+
+    stripe_transactions = rows_to_minor(
+        fetch_by_keys(cursor, STRIPE_PAID_QUERY, f"`{stripe_column}`", keys),
+        money_columns(schema, 'stripe')
+    )
+    ledger_transactions = rows_to_minor(fetch_by_keys(
+        cursor,
+        f"SELECT * FROM Thera_Ledger_Transactions WHERE ({ledger_filter})",
+        f"`{ledger_key}`", keys, order_by='id', null_ids=null_ids
+    ), money_columns(schema, 'ledger'))
+    rows, _ = matcher(schema, stripe_transactions, ledger_transactions, stripe_key, ledger_key)
+
+    delete_by_ids(cursor, table_name, schema_column(schema, 'stripe', 'id'),
+                  [tx['id'] for tx in stripe_transactions])
+    delete_by_ids(cursor, table_name, schema_column(schema, 'ledger', 'id'),
+                  [tx['id'] for tx in ledger_transactions])
+
+    insert_match_rows(cursor, table_name, schema, rows)
+
+    return count_merge_sources(cursor, table_name), len(rows)
+
+def perform_incremental_reconciliation(mode='hash'):
+    """Reconcile only the rows loaded since the last run.
+
+    Falls back to a full run when there is no saved high-water mark or the
+    match tables are missing. The 'sql' mode has no delta form, so the delta
+    is matched with the hash matcher.
+    """
     try:
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        log("Starting reconciliation process...")
+        create_table_if_not_exists(cursor, 'reconciliation_state')
+        create_table_if_not_exists(cursor, 'reconciliation_summary')
+        saved_marks = read_watermarks(cursor)
+        tables_exist = True
+        for table_name, *_ in RECONCILIATION_PASSES:
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            tables_exist = tables_exist and cursor.fetchone() is not None
         
-        # First drop and recreate tables
-        log("Dropping and recreating tables...")
-        cursor.execute("DROP TABLE IF EXISTS started_matches")
-        cursor.execute("DROP TABLE IF EXISTS succeeded_matches")
-        conn.commit()  # Commit the drops
+        if tables_exist and all(saved_marks.get(t) is not None for t in WATERMARK_SOURCES):
+            log(f"Starting incremental reconciliation from {saved_marks}...")
+            new_marks = current_watermarks(cursor)
+            matcher = MATCHERS.get(mode, match_rows)
+            
+            result = {}
+            for reconciliation_pass in RECONCILIATION_PASSES:
+                table_name = reconciliation_pass[0]
+                counts, written = reconcile_pass_incrementally(cursor, reconciliation_pass, saved_marks, matcher)
+                log(f"Rewrote {written} rows in {table_name}")
+                result[table_name] = counts
+            
+            save_watermarks(cursor, new_marks)
+            refresh_summary(cursor, MATCH_SUMMARY_SOURCES)
+            conn.commit()
+            log("Incremental reconciliation completed successfully")
+            
+            return True, result
         
-        create_table_if_not_exists(cursor, 'started_matches')
-        create_table_if_not_exists(cursor, 'succeeded_matches')
-        conn.commit()  # Commit the table creation
+        log("No previous reconciliation state, running full reconciliation...")
         
-        # Get Stripe transactions
-        log("Fetching Stripe transactions...")
-        cursor.execute("""
-            SELECT 
-                id,
-                amount,
-                amount_refunded,
-                currency,
-                captured,
-                converted_amount,
-                converted_amount_refunded,
-                converted_currency,
-                decline_reason,
-                description,
-                fee,
-                is_link,
-                link_funding,
-                mode,
-                paymentintent_id as PaymentIntent_ID,
-                payment_source_type,
-                created_date_utc,
-                refunded_date_utc,
-                statement_descriptor,
-                status,
-                seller_message,
-                taxes_on_fee,
-                card_id,
-                card_name,
-                card_brand,
-                card_last4,
-                customer_id as Customer_ID,
-                customer_email as Customer_Email
-            FROM Thera_Stripe_Incoming_Transactions
-            WHERE status = 'Paid'
-        """)
-        stripe_transactions = cursor.fetchall()
-        log(f"Found {len(stripe_transactions)} Stripe transactions")
-        
-        # Get Started Ledger transactions
-        log("Fetching Started Ledger transactions...")
-        cursor.execute("""
-            SELECT *
-            FROM Thera_Ledger_Transactions
-            WHERE metadata_type = 'PAY_IN_STARTED'  # Keep this filter
-            OR metadata_latestStripeChargeId IS NOT NULL  # But make it OR instead of AND
-            OR metadata_paymentId IS NOT NULL  # Include any with payment IDs
-        """)
-        ledger_started = cursor.fetchall()
-        log(f"Found {len(ledger_started)} Started Ledger transactions")
+    except Exception as e:
+        log(f"Error during incremental reconciliation: {str(e)}")
+        if 'conn' in locals():
+            conn.rollback()
+        return False, str(e)
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+    
+    return perform_reconciliation(mode=mode)
+
+def run_concurrently(jobs, conn=None):
+    """Run {name: callable} on a thread pool and return {name: result}.
+
+    Each job borrows a pooled connection of its own. A caller that holds
+    one already passes it as `conn` (the jobs must then accept conn=): if
+    the pool cannot lend one connection per job right away, the jobs run
+    one after another on `conn` instead, so nested fan-out never waits on
+    connections its callers are holding. Waits for every job before
+    re-raising the first failure.
+    """
+    if conn is not None and available_connections() < len(jobs):
+        log(f"Connection pool too busy for {len(jobs)} parallel reads, running them in turn")
+        return {name: job(conn=conn) for name, job in jobs.items()}
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = {name: executor.submit(job) for name, job in jobs.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+def fetch_rows(query, cursor_class=pymysql.cursors.DictCursor, conn=None):
+    """Run a read on a connection of its own (or on `conn`), for use from run_concurrently"""
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        cursor = conn.cursor(cursor_class)
+        cursor.execute(query)
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+    finally:
+        if own_conn:
+            conn.close()
+
+def run_reconciliation_pass(reconciliation_pass, mode, stripe_transactions=None, target=None,
+                            ledger_transactions=None):
+    """Fill one match table (or `target`, its shadow) on a connection of its own and commit it.
+
+    stripe_transactions and ledger_transactions are the job's shared
+    fetches (the ledger subset is read here if not given); the 'sql' mode
+    joins inside MySQL and ignores them. Returns the merge_source counters.
+    """
+    table_name, schema, ledger_filter, stripe_key, ledger_key = reconciliation_pass
+    target = target or table_name
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
         
-        # Get Succeeded Ledger transactions
-        log("Fetching Succeeded Ledger transactions...")
-        cursor.execute("""
-            SELECT *
-            FROM Thera_Ledger_Transactions
-            WHERE metadata_type = 'PAY_IN_SUCCEEDED'  # Keep this filter
-            OR status = 'SUCCEEDED'  # Include any succeeded transactions
-        """)
-        ledger_succeeded = cursor.fetchall()
-        log(f"Found {len(ledger_succeeded)} Succeeded Ledger transactions")
-        
-        # Initialize counters
-        started_matches = {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
-        started_data = []
-        
-        # Perform started matches reconciliation
-        log("Performing started matches reconciliation...")
-        for stripe_tx in stripe_transactions:
-            matching_ledger = next(
-                (lt for lt in ledger_started 
-                 if lt['metadata_latestStripeChargeId'] == stripe_tx['id']),
-                None
+        if mode == 'sql':
+            log(f"Performing {table_name} reconciliation (sql)...")
+            counts = reconcile_in_database(
+                cursor, target, schema, ledger_filter,
+                stripe_key=stripe_key, ledger_key=ledger_key
             )
+        else:
+            if ledger_transactions is None:
+                log(f"Fetching ledger transactions for {table_name}...")
+                ledger_transactions = fetch_records(
+                    conn, ledger_query(side_columns(schema, 'ledger', ledger_key), ledger_filter),
+                    float_columns=numeric_columns(schema, 'ledger'),
+                    minor_columns=money_columns(schema, 'ledger')
+                )
+            log(f"Found {len(ledger_transactions)} ledger transactions for {table_name}")
             
-            if matching_ledger:
-                merge_source = 'match'
-                started_matches['match'] += 1
-            else:
-                merge_source = 'stripe_only'
-                started_matches['stripe_only'] += 1
-            
-            started_data.append((
-                matching_ledger['id'] if matching_ledger else None,
-                matching_ledger['description'] if matching_ledger else None,
-                matching_ledger['status'] if matching_ledger else None,
-                matching_ledger['ledger_id'] if matching_ledger else None,
-                matching_ledger['effective_date'] if matching_ledger else None,
-                matching_ledger['posted_at'] if matching_ledger else None,
-                matching_ledger['metadata'] if matching_ledger else None,
-                float(matching_ledger['amount_USD']) if matching_ledger and matching_ledger['amount_USD'] else None,
-                matching_ledger['currency_USD'] if matching_ledger else None,
-                float(matching_ledger['amount_EUR']) if matching_ledger and matching_ledger['amount_EUR'] else None,
-                matching_ledger['currency_EUR'] if matching_ledger else None,
-                float(matching_ledger['amount_GBP']) if matching_ledger and matching_ledger['amount_GBP'] else None,
-                matching_ledger['currency_GBP'] if matching_ledger else None,
-                matching_ledger['metadata_latestStripeChargeId'] if matching_ledger else None,
-                matching_ledger['metadata_payInType'] if matching_ledger else None,
-                matching_ledger['metadata_paymentId'] if matching_ledger else None,
-                matching_ledger['metadata_paymentMethodId'] if matching_ledger else None,
-                matching_ledger['metadata_stripeBalanceTrxId'] if matching_ledger else None,
-                float(matching_ledger['metadata_stripeExchangeRate']) if matching_ledger and matching_ledger['metadata_stripeExchangeRate'] else None,
-                matching_ledger['metadata_type'] if matching_ledger else None,
-                matching_ledger['effective_at'] if matching_ledger else None,
-                stripe_tx['id'],
-                float(stripe_tx['amount']),
-                float(stripe_tx['amount_refunded']) if stripe_tx['amount_refunded'] else None,
-                stripe_tx['currency'],
-                1 if stripe_tx['captured'] else 0,
-                float(stripe_tx['converted_amount']) if 'converted_amount' in stripe_tx else None,
-                float(stripe_tx['converted_amount_refunded']) if 'converted_amount_refunded' in stripe_tx else None,
-                stripe_tx['converted_currency'] if 'converted_currency' in stripe_tx else None,
-                stripe_tx['decline_reason'] if 'decline_reason' in stripe_tx else None,
-                stripe_tx['description'],
-                float(stripe_tx['fee']) if stripe_tx['fee'] else None,
-                1 if stripe_tx['is_link'] else 0 if 'is_link' in stripe_tx else None,
-                stripe_tx['link_funding'] if 'link_funding' in stripe_tx else None,
-                stripe_tx['mode'] if 'mode' in stripe_tx else None,
-                stripe_tx['PaymentIntent_ID'],
-                stripe_tx['payment_source_type'] if 'payment_source_type' in stripe_tx else None,
-                stripe_tx['created_date_utc'],
-                stripe_tx['refunded_date_utc'] if 'refunded_date_utc' in stripe_tx else None,
-                stripe_tx['statement_descriptor'] if 'statement_descriptor' in stripe_tx else None,
-                stripe_tx['status'],
-                stripe_tx['seller_message'] if 'seller_message' in stripe_tx else None,
-                float(stripe_tx['taxes_on_fee']) if 'taxes_on_fee' in stripe_tx and stripe_tx['taxes_on_fee'] else None,
-                stripe_tx['card_id'] if 'card_id' in stripe_tx else None,
-                stripe_tx['card_name'] if 'card_name' in stripe_tx else None,
-                stripe_tx['card_brand'] if 'card_brand' in stripe_tx else None,
-                stripe_tx['card_last4'] if 'card_last4' in stripe_tx else None,
-                stripe_tx['Customer_ID'],
-                stripe_tx['Customer_Email'],
-                merge_source
-            ))
-        
-        # Fix the ledger_only records to provide all required NULL values
-        for ledger_tx in ledger_started:
-            if not any(sd[0] == ledger_tx['id'] for sd in started_data):
-                started_matches['ledger_only'] += 1
-                started_data.append((
-                    ledger_tx['id'],
-                    ledger_tx['description'],
-                    ledger_tx['status'],
-                    ledger_tx['ledger_id'],
-                    ledger_tx['effective_date'],
-                    ledger_tx['posted_at'],
-                    ledger_tx['metadata'],
-                    float(ledger_tx['amount_USD']) if ledger_tx['amount_USD'] else None,
-                    ledger_tx['currency_USD'],
-                    float(ledger_tx['amount_EUR']) if ledger_tx['amount_EUR'] else None,
-                    ledger_tx['currency_EUR'],
-                    float(ledger_tx['amount_GBP']) if ledger_tx['amount_GBP'] else None,
-                    ledger_tx['currency_GBP'],
-                    ledger_tx['metadata_latestStripeChargeId'],
-                    ledger_tx['metadata_payInType'],
-                    ledger_tx['metadata_paymentId'],
-                    ledger_tx['metadata_paymentMethodId'],
-                    ledger_tx['metadata_stripeBalanceTrxId'],
-                    float(ledger_tx['metadata_stripeExchangeRate']) if ledger_tx['metadata_stripeExchangeRate'] else None,
-                    ledger_tx['metadata_type'],
-                    ledger_tx['effective_at'],
-                    None,  # stripe_id
-                    None,  # stripe_amount
-                    None,  # stripe_amount_refunded
-                    None,  # stripe_currency
-                    None,  # stripe_captured
-                    None,  # stripe_converted_amount
-                    None,  # stripe_converted_amount_refunded
-                    None,  # stripe_converted_currency
-                    None,  # stripe_decline_reason
-                    None,  # stripe_description
-                    None,  # stripe_fee
-                    None,  # stripe_is_link
-                    None,  # stripe_link_funding
-                    None,  # stripe_mode
-                    None,  # stripe_paymentintent_id
-                    None,  # stripe_payment_source_type
-                    None,  # stripe_created_date_utc
-                    None,  # stripe_refunded_date_utc
-                    None,  # stripe_statement_descriptor
-                    None,  # stripe_status
-                    None,  # stripe_seller_message
-                    None,  # stripe_taxes_on_fee
-                    None,  # stripe_card_id
-                    None,  # stripe_card_name
-                    None,  # stripe_card_brand
-                    None,  # stripe_card_last4
-                    None,  # stripe_customer_id
-                    None,  # stripe_customer_email
-                    'ledger_only'  # merge_source
-                ))
-        
-        # Insert started matches
-        log("Saving started matches...")
-        columns = """
-            ledger_id, ledger_description, ledger_status, ledger_ledger_id,
-            ledger_effective_date, ledger_posted_at, ledger_metadata,
-            ledger_amount_USD, ledger_currency_USD, ledger_amount_EUR, ledger_currency_EUR,
-            ledger_amount_GBP, ledger_currency_GBP, ledger_metadata_latestStripeChargeId,
-            ledger_metadata_payInType, ledger_metadata_paymentId, ledger_metadata_paymentMethodId,
-            ledger_metadata_stripeBalanceTrxId, ledger_metadata_stripeExchangeRate,
-            ledger_metadata_type, ledger_effective_at, stripe_id, stripe_amount,
-            stripe_amount_refunded, stripe_currency, stripe_captured, stripe_converted_amount,
-            stripe_converted_amount_refunded, stripe_converted_currency, stripe_decline_reason,
-            stripe_description, stripe_fee, stripe_is_link, stripe_link_funding, stripe_mode,
-            stripe_paymentintent_id, stripe_payment_source_type, stripe_created_date_utc,
-            stripe_refunded_date_utc, stripe_statement_descriptor, stripe_status,
-            stripe_seller_message, stripe_taxes_on_fee, stripe_card_id, stripe_card_name,
-            stripe_card_brand, stripe_card_last4, stripe_customer_id, stripe_customer_email,
-            merge_source
-        """
-        placeholders = ', '.join(['%s'] * 50)  # Changed from 33 to 50 to match the number of columns
-        cursor.executemany(f"""
-            INSERT INTO started_matches ({columns})
-            VALUES ({placeholders})
-        """, started_data)
-        
-        # Perform succeeded matches reconciliation
-        log("Performing succeeded matches reconciliation...")
-        succeeded_matches = {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
-        succeeded_data = []
-        
-        for stripe_tx in stripe_transactions:
-            matching_ledger = next(
-                (lt for lt in ledger_succeeded 
-                 if lt['metadata_paymentId'] == stripe_tx['PaymentIntent_ID']),
-                None
+            log(f"Performing {table_name} reconciliation ({mode})...")
+            rows, counts = MATCHERS[mode](
+                schema, stripe_transactions, ledger_transactions,
+                stripe_key=stripe_key, ledger_key=ledger_key
             )
             
-            if matching_ledger:
-                merge_source = 'match'
-                succeeded_matches['match'] += 1
-            else:
-                merge_source = 'stripe_only'
-                succeeded_matches['stripe_only'] += 1
-            
-            succeeded_data.append((
-                matching_ledger['id'] if matching_ledger else None,
-                matching_ledger['description'] if matching_ledger else None,
-                matching_ledger['status'] if matching_ledger else None,
-                matching_ledger['ledger_id'] if matching_ledger else None,
-                matching_ledger['effective_date'] if matching_ledger else None,
-                matching_ledger['posted_at'] if matching_ledger else None,
-                matching_ledger['metadata'] if matching_ledger else None,
-                float(matching_ledger['amount_USD']) if matching_ledger and matching_ledger['amount_USD'] else None,
-                matching_ledger['currency_USD'] if matching_ledger else None,
-                matching_ledger['metadata_paymentId'] if matching_ledger else None,
-                matching_ledger['metadata_type'] if matching_ledger else None,
-                stripe_tx['id'],
-                stripe_tx['created_date_utc'],
-                float(stripe_tx['amount']),
-                stripe_tx['currency'],
-                stripe_tx['PaymentIntent_ID'],
-                stripe_tx['status'],
-                merge_source
-            ))
-        
-        # Add ledger_only records for succeeded matches
-        for ledger_tx in ledger_succeeded:
-            if not any(sd[0] == ledger_tx['id'] for sd in succeeded_data):
-                succeeded_matches['ledger_only'] += 1
-                succeeded_data.append((
-                    ledger_tx['id'],
-                    ledger_tx['description'],
-                    ledger_tx['status'],
-                    ledger_tx['ledger_id'],
-                    ledger_tx['effective_date'],
-                    ledger_tx['posted_at'],
-                    ledger_tx['metadata'],
-                    float(ledger_tx['amount_USD']) if ledger_tx['amount_USD'] else None,
-                    ledger_tx['currency_USD'],
-                    ledger_tx['metadata_paymentId'] if ledger_tx['metadata_paymentId'] else None,
-                    ledger_tx['metadata_type'] if ledger_tx['metadata_type'] else None,
-                    None, None, None, None, None, None, None, None, None, None, None,
-                    'ledger_only'
-                ))
+            log(f"Saving {table_name}...")
+            insert_match_rows(cursor, target, schema, rows)
         
-        # Insert succeeded matches
-        log("Saving succeeded matches...")
-        succeeded_columns = """
-            id_ledger, description_ledger, status_ledger, ledger_id,
-            effective_date, posted_at, metadata,
-            amount_USD, currency_USD, metadata_paymentId,
-            metadata_type, id_stripe, created_date_utc,
-            amount, currency, paymentintent_id,
-            status_stripe, merge_source
-        """
-        placeholders = ', '.join(['%s'] * 18)  # Changed from 16 to 18 to match the number of columns
-        cursor.executemany(f"""
-            INSERT INTO succeeded_matches ({succeeded_columns})
-            VALUES ({placeholders})
-        """, succeeded_data)
+        conn.commit()
+        cursor.close()
+        return counts
+    finally:
+        conn.close()
+
+def partition_predicate(column, partitions):
+    """Rows of one key-hash shard; equal keys (NULL included) share a shard"""
+    return f"MOD(COALESCE(CRC32({column}), 0), {int(partitions)}) = %s"
+
+def match_partition(pass_index, mode, partition, partitions, target=None):
+    """Match one shard of one pass in a worker process and insert its rows.
+
+    Only the shard's Stripe and ledger rows are fetched, and the matched
+    rows are written from here, so a worker holds about 1/partitions of the
+    history and only the counters travel back to the parent.
+    """
+    table_name, schema, ledger_filter, stripe_key, ledger_key = RECONCILIATION_PASSES[pass_index]
+    stripe_column = STRIPE_COLUMN_ALIASES.get(stripe_key, stripe_key)
+    conn = get_db_connection()
+    try:
+        stripe_transactions = fetch_records(
+            conn,
+            f"{stripe_paid_query(side_columns(schema, 'stripe', stripe_key))} "
+            f"AND {partition_predicate(f'`{stripe_column}`', partitions)}",
+            (partition,), float_columns=numeric_columns(schema, 'stripe'),
+            minor_columns=money_columns(schema, 'stripe')
+        )
+        ledger_transactions = fetch_records(
+            conn,
+            f"{ledger_query(side_columns(schema, 'ledger', ledger_key), ledger_filter)} "
+            f"AND {partition_predicate(f'`{ledger_key}`', partitions)} ORDER BY id",
+            (partition,), float_columns=numeric_columns(schema, 'ledger'),
+            minor_columns=money_columns(schema, 'ledger')
+        )
+        cursor = conn.cursor()
+
+        rows, counts = MATCHERS[mode](
+            schema, stripe_transactions, ledger_transactions,
+            stripe_key=stripe_key, ledger_key=ledger_key
+        )
+        insert_match_rows(cursor, target or table_name, schema, rows)
+        conn.commit()
+        cursor.close()
+        log(f"{table_name} shard {partition + 1}/{partitions}: {len(stripe_transactions)} Stripe, "
+            f"{len(ledger_transactions)} ledger rows")
+        return table_name, counts
+    finally:
+        conn.close()
+
+def run_partitioned(mode, partitions, workers=None, targets=None):
+    """Match every pass shard by shard on a process pool; returns summed counters per table
+
+    targets maps a match table to the table its rows are written to.
+    """
+    targets = targets or {}
+    results = {table_name: {'match': 0, 'stripe_only': 0, 'ledger_only': 0}
+               for table_name, *_ in RECONCILIATION_PASSES}
+    # spawn, so children never inherit the parent's pooled sockets
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), mp_context=context) as executor:
+        futures = [
+            executor.submit(match_partition, pass_index, mode, partition, partitions,
+                            targets.get(RECONCILIATION_PASSES[pass_index][0]))
+            for pass_index in range(len(RECONCILIATION_PASSES))
+            for partition in range(partitions)
+        ]
+        for future in as_completed(futures):
+            table_name, counts = future.result()
+            for source, count in counts.items():
+                results[table_name][source] += count
+    return results
+
+def shadow_table(table_name):
+    return f"{table_name}_shadow"
+
+def prepare_shadow_tables(cursor):
+    """Create empty shadow copies of the match tables for a full run to fill"""
+    for table_name, *_ in RECONCILIATION_PASSES:
+        cursor.execute(f"DROP TABLE IF EXISTS `{shadow_table(table_name)}`")
+        create_table_if_not_exists(cursor, table_name, name=shadow_table(table_name))
+
+def publish_shadow_tables(cursor):
+    """Swap every shadow table in with a single RENAME TABLE and drop the old ones.
+
+    RENAME TABLE is atomic across all the pairs it lists, so readers see
+    either the previous results or the new ones, never a missing or partial
+    table.
+    """
+    renames = []
+    for table_name, *_ in RECONCILIATION_PASSES:
+        cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+        if not cursor.fetchone():
+            # First run: give the swap something to move out of the way
+            create_table_if_not_exists(cursor, table_name)
+        cursor.execute(f"DROP TABLE IF EXISTS `{table_name}_retired`")
+        renames.append(f"`{table_name}` TO `{table_name}_retired`")
+        renames.append(f"`{shadow_table(table_name)}` TO `{table_name}`")
+
+    cursor.execute(f"RENAME TABLE {', '.join(renames)}")
+    for table_name, *_ in RECONCILIATION_PASSES:
+        cursor.execute(f"DROP TABLE IF EXISTS `{table_name}_retired`")
+    log("Published new match tables")
+
+def perform_reconciliation(mode='hash', partitions=None, workers=None, balance=False, from_staging=False):
+    """Perform reconciliation between Stripe and Ledger data
+
+    mode selects the matcher: 'hash' (row-by-row dict lookups),
+    'vectorized' (one pandas merge per pass, built column-wise) or
+    'sql' (INSERT ... SELECT joins run inside MySQL).
+
+    With partitions, the 'hash' and 'vectorized' matchers run shard by
+    shard (keys split by CRC32) in up to `workers` processes instead of
+    holding the whole history in this one.
+
+    With balance, perform_balance_reconciliation runs alongside the passes
+    on the same ledger scan.
+
+    With from_staging the 'hash' and 'vectorized' matchers read the Stripe
+    and ledger rows from the uploads' Parquet snapshots (see
+    staging_cache.py) when they are current, instead of from MySQL.
+    Partitioned runs still read their shards from MySQL.
+    """
+    try:
+        if mode not in RECONCILIATION_MODES:
+            raise ValueError(f"Unknown reconciliation mode: {mode}")
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        
+        log("Starting reconciliation process...")
         
+        # Build into shadow tables; the live ones keep serving readers
+        # until the swap at the end
+        log("Preparing shadow tables...")
+        prepare_shadow_tables(cursor)
+        targets = {table_name: shadow_table(table_name) for table_name, *_ in RECONCILIATION_PASSES}
+        create_table_if_not_exists(cursor, 'reconciliation_state')
+        create_table_if_not_exists(cursor, 'reconciliation_summary')
+        conn.commit()  # Commit the table creation
+        
+        # Rows loaded after this point are left for the next incremental run
+        watermarks = current_watermarks(cursor)
+        conn.commit()
+        
+        if partitions and mode != 'sql':
+            log(f"Matching in {partitions} partitions per pass...")
+            results = run_partitioned(mode, partitions, workers, targets)
+            publish_shadow_tables(cursor)
+            save_watermarks(cursor, watermarks)
+            refresh_summary(cursor, MATCH_SUMMARY_SOURCES)
+            conn.commit()
+            if balance:
+                balance_ok, results['balance_reconciliation'] = perform_balance_reconciliation()
+                if not balance_ok:
+                    return False, f"Matches saved, but balance reconciliation failed: {results['balance_reconciliation']}"
+            log("Reconciliation completed successfully")
+            return True, results
+        
+        # One ledger scan for every reconciler in this job
+        ledger_subsets = None
+        if mode != 'sql' or balance:
+            log("Scanning ledger transactions...")
+            ledger_subsets = scan_ledger(conn, from_staging)
+        
+        stripe_transactions = None
+        if mode != 'sql':
+            # Get Stripe transactions (shared by both passes), only the
+            # columns either pass reads
+            log("Fetching Stripe transactions...")
+            stripe_columns, stripe_floats, stripe_minors = [], set(), {}
+            for _, schema, _, stripe_key, _ in RECONCILIATION_PASSES:
+                stripe_columns += side_columns(schema, 'stripe', stripe_key)
+                stripe_floats |= numeric_columns(schema, 'stripe')
+                stripe_minors.update(money_columns(schema, 'stripe'))
+            stripe_columns = list(dict.fromkeys(stripe_columns))
+            if from_staging:
+                stripe_transactions = staging_cache.read_records(
+                    conn, 'Thera_Stripe_Incoming_Transactions', stripe_columns,
+                    STAGING_STRIPE_PAID_FILTER, stripe_floats, stripe_minors
+                )
+            if stripe_transactions is None:
+                stripe_transactions = fetch_records(
+                    conn, stripe_paid_query(stripe_columns),
+                    float_columns=stripe_floats, minor_columns=stripe_minors
+                )
+            log(f"Found {len(stripe_transactions)} Stripe transactions")
+        
+        # The passes read different ledger subsets and write different
+        # tables, so they run side by side, each on its own connection
+        jobs = {
+            reconciliation_pass[0]: partial(
+                run_reconciliation_pass, reconciliation_pass, mode, stripe_transactions,
+                targets[reconciliation_pass[0]],
+                ledger_subsets[reconciliation_pass[0]] if mode != 'sql' else None
+            )
+            for reconciliation_pass in RECONCILIATION_PASSES
+        }
+        if balance:
+            jobs['balance_reconciliation'] = partial(perform_balance_reconciliation, ledger_subsets)
+        results = run_concurrently(jobs)
+        
+        publish_shadow_tables(cursor)
+        save_watermarks(cursor, watermarks)
+        refresh_summary(cursor, MATCH_SUMMARY_SOURCES)
         conn.commit()
         log("Reconciliation completed successfully")
         
-        return True, {
-            'started_matches': started_matches,
-            'succeeded_matches': succeeded_matches
+        result = {
+            'started_matches': results['started_matches'],
+            'succeeded_matches': results['succeeded_matches']
         }
+        if balance:
+            balance_ok, result['balance_reconciliation'] = results['balance_reconciliation']
+            if not balance_ok:
+                return False, f"Matches saved, but balance reconciliation failed: {result['balance_reconciliation']}"
+        return True, result
         
     except Exception as e:
         log(f"Error during reconciliation: {str(e)}")
@@ -851,93 +1651,346 @@ def perform_reconciliation():
         if 'conn' in locals():
             conn.close()
 
+# Aggregates kept in reconciliation_summary, one query per source table.
+# Each returns (bucket, currency, transaction_count, amount) groups.
+SUMMARY_QUERIES = {
+    'Thera_Ledger_Transactions': """
+        SELECT IF(metadata_stripeBalanceTrxId IS NULL, 'pending', 'reconciled'),
+               UPPER(COALESCE(currency_USD, '')), COUNT(*), SUM(amount_USD)
+        FROM Thera_Ledger_Transactions
+        GROUP BY 1, 2
+    """,
+    'started_matches': """
+        SELECT merge_source,
+               UPPER(COALESCE(ledger_currency_USD, stripe_converted_currency, '')),
+               COUNT(*), SUM(COALESCE(ledger_amount_USD, stripe_converted_amount))
+        FROM started_matches
+        GROUP BY 1, 2
+    """,
+    'succeeded_matches': """
+        SELECT merge_source,
+               UPPER(COALESCE(currency_USD, currency, '')),
+               COUNT(*), SUM(COALESCE(amount_USD, amount))
+        FROM succeeded_matches
+        GROUP BY 1, 2
+    """,
+    'balance_reconciliation_summary': """
+        SELECT status, UPPER(COALESCE(currency, '')), COUNT(*), SUM(difference)
+        FROM balance_reconciliation_summary
+        GROUP BY 1, 2
+    """
+}
+
+# Summary rows a matching run invalidates
+MATCH_SUMMARY_SOURCES = ['Thera_Ledger_Transactions', 'started_matches', 'succeeded_matches']
+
+def refresh_summary(cursor, source_tables):
+    """Recompute the summary rows of `source_tables` in the caller's transaction"""
+    for source_table in source_tables:
+        cursor.execute("DELETE FROM reconciliation_summary WHERE source_table = %s", (source_table,))
+        cursor.execute(f"""
+            INSERT INTO reconciliation_summary (source_table, bucket, currency, transaction_count, amount)
+            SELECT %s, grouped.* FROM ({SUMMARY_QUERIES[source_table]}) AS grouped
+        """, (source_table,))
+    log(f"Refreshed summary for {', '.join(source_tables)}")
+
 def get_summary():
-    # Implement the logic to generate a summary based on the reconciled data
-    # This is a placeholder and should be replaced with the actual implementation
-    return "Summary not implemented"
+    """Dashboard totals plus the per-currency/per-merge_source breakdown.
 
-def get_matches(match_type='started', filters=None):
-    """Get matches with optional filtering"""
+    Reads only reconciliation_summary, which the reconciliation runs keep
+    up to date.
+    """
     try:
-        log(f"Starting get_matches with type: {match_type} and filters: {filters}")
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
-        
-        table_name = 'started_matches' if match_type == 'started' else 'succeeded_matches'
-        log(f"Using table: {table_name}")
-        
-        # First check if table exists
-        cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-        if not cursor.fetchone():
-            log(f"Table {table_name} does not exist")
-            return False, f"Table {table_name} does not exist"
-        
-        # Build query with filters
-        query = f"""
-            SELECT 
-                id_ledger as 'Ledger ID',
-                description_ledger as 'Description',
-                status_ledger as 'Ledger Status',
-                effective_date as 'Date',
-                amount_USD as 'Amount USD',
-                currency_USD as 'Currency',
-                metadata_type as 'Type',
-                id_stripe as 'Stripe ID',
-                status_stripe as 'Stripe Status',
-                merge_source as 'Match Status'
-            FROM {table_name}
-            WHERE 1=1
-        """
-        
-        params = []
-        
-        if filters:
-            if filters.get('date_from'):
-                query += " AND DATE(effective_date) >= %s"
-                params.append(filters['date_from'])
-            
-            if filters.get('date_to'):
-                query += " AND DATE(effective_date) <= %s"
-                params.append(filters['date_to'])
-        
-        # Add ordering and limit
-        query += " ORDER BY effective_date DESC LIMIT 5000"
-        
+
+        cursor.execute("SHOW TABLES LIKE 'reconciliation_summary'")
+        rows = []
+        if cursor.fetchone():
+            cursor.execute("""
+                SELECT source_table, bucket, currency, transaction_count, amount, refreshed_at
+                FROM reconciliation_summary
+                ORDER BY source_table, bucket, currency
+            """)
+            rows = cursor.fetchall()
+
+        def total(source_table, bucket=None, field='transaction_count'):
+            return sum(row[field] or 0 for row in rows
+                       if row['source_table'] == source_table and (bucket is None or row['bucket'] == bucket))
+
+        refreshed_at = max((row['refreshed_at'] for row in rows), default=None)
+        breakdown = [{
+            'source_table': row['source_table'],
+            'bucket': row['bucket'],
+            'currency': row['currency'],
+            'count': int(row['transaction_count']),
+            'amount': amount_number(row['amount'] or 0, row['currency'])
+        } for row in rows]
+
+        return True, {
+            'totalTransactions': int(total('Thera_Ledger_Transactions')),
+            # amount_USD totals
+            'reconciled': amount_number(total('Thera_Ledger_Transactions', 'reconciled', 'amount'), 'USD'),
+            'exceptions': int(total('started_matches', 'ledger_only')),
+            'pendingUploads': int(total('Thera_Ledger_Transactions', 'pending')),
+            'refreshedAt': refreshed_at.isoformat() if refreshed_at else None,
+            'breakdown': breakdown
+        }
+
+    except Exception as e:
+        log(f"Error getting summary: {str(e)}")
+        return False, str(e)
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+# Columns returned by get_matches for each match table, as (column, label).
+# The first entry is the date the pages are ordered by.
+MATCH_VIEW_COLUMNS = {
+    'started_matches': [
+        ('ledger_effective_date', 'Date'),
+        ('ledger_id', 'Ledger ID'),
+        ('ledger_description', 'Description'),
+        ('ledger_status', 'Ledger Status'),
+        ('ledger_amount_USD', 'Amount USD'),
+        ('ledger_currency_USD', 'Currency'),
+        ('ledger_metadata_type', 'Type'),
+        ('stripe_id', 'Stripe ID'),
+        ('stripe_status', 'Stripe Status'),
+        ('merge_source', 'Match Status')
+    ],
+    'succeeded_matches': [
+        ('effective_date', 'Date'),
+        ('id_ledger', 'Ledger ID'),
+        ('description_ledger', 'Description'),
+        ('status_ledger', 'Ledger Status'),
+        ('amount_USD', 'Amount USD'),
+        ('currency_USD', 'Currency'),
+        ('metadata_type', 'Type'),
+        ('id_stripe', 'Stripe ID'),
+        ('status_stripe', 'Stripe Status'),
+        ('merge_source', 'Match Status')
+    ]
+}
+
+# Filterable columns of each match table; the date column comes from
+# MATCH_VIEW_COLUMNS. Equality filters take a value or a list of values.
+MATCH_FILTER_COLUMNS = {
+    'started_matches': {
+        'merge_source': 'merge_source',
+        'status': 'ledger_status',
+        'currency': 'ledger_currency_USD',
+        'metadata_type': 'ledger_metadata_type',
+        'amount': 'ledger_amount_USD'
+    },
+    'succeeded_matches': {
+        'merge_source': 'merge_source',
+        'status': 'status_ledger',
+        'currency': 'currency_USD',
+        'metadata_type': 'metadata_type',
+        'amount': 'amount_USD'
+    }
+}
+
+MATCHES_PAGE_SIZE = 5000
+MAX_MATCHES_PAGE_SIZE = 50000
+
+def clamp_page_size(page_size):
+    return max(1, min(int(page_size or MATCHES_PAGE_SIZE), MAX_MATCHES_PAGE_SIZE))
+
+def encode_page_cursor(date_value, row_id):
+    """Opaque keyset cursor for the row a page ended on"""
+    if isinstance(date_value, datetime):
+        date_value = date_value.strftime('%Y-%m-%d %H:%M:%S')
+    payload = json.dumps([date_value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_page_cursor(cursor_token):
+    try:
+        date_value, row_id = json.loads(base64.urlsafe_b64decode(cursor_token.encode('ascii')))
+        return date_value, int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid page cursor: {cursor_token}") from e
+
+def build_matches_query(table_name, filters=None, page_size=MATCHES_PAGE_SIZE, after=None):
+    """Keyset page over (date, id), newest first; NULL dates sort last"""
+    columns = MATCH_VIEW_COLUMNS[table_name]
+    date_column = columns[0][0]
+    select_list = ', '.join(f"{column} AS '{label}'" for column, label in columns)
+    query = f"SELECT {select_list}, id AS _row_id FROM {table_name} WHERE 1=1"
+    params = []
+
+    clauses, filter_params = build_match_filters(table_name, filters)
+    for clause in clauses:
+        query += f" AND {clause}"
+    params.extend(filter_params)
+
+    if after:
+        after_date, after_id = decode_page_cursor(after)
+        if after_date is None:
+            query += f" AND {date_column} IS NULL AND id < %s"
+            params.append(after_id)
+        else:
+            query += f" AND ({date_column} < %s OR ({date_column} = %s AND id < %s) OR {date_column} IS NULL)"
+            params.extend([after_date, after_date, after_id])
+
+    query += f" ORDER BY {date_column} DESC, id DESC LIMIT %s"
+    params.append(page_size)
+    return query, params
+
+def parse_filter_date(value):
+    """Return (start, whole_day) for a 'YYYY-MM-DD' or ISO datetime filter value"""
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError as e:
+        raise ValueError(f"Invalid date filter: {value}") from e
+    return parsed, len(str(value)) == 10
+
+def build_match_filters(table_name, filters):
+    """WHERE clauses for get_matches filters, written against the bare columns.
+
+    Dates become a half-open range (date_to is inclusive of the whole day),
+    so the date indexes serve them as range scans instead of evaluating
+    DATE() on every row.
+    """
+    clauses, params = [], []
+    if not filters:
+        return clauses, params
+
+    date_column = MATCH_VIEW_COLUMNS[table_name][0][0]
+    columns = MATCH_FILTER_COLUMNS[table_name]
+
+    if filters.get('date_from'):
+        date_from, _ = parse_filter_date(filters['date_from'])
+        clauses.append(f"{date_column} >= %s")
+        params.append(date_from)
+
+    if filters.get('date_to'):
+        date_to, whole_day = parse_filter_date(filters['date_to'])
+        if whole_day:
+            clauses.append(f"{date_column} < %s")
+            params.append(date_to + timedelta(days=1))
+        else:
+            clauses.append(f"{date_column} <= %s")
+            params.append(date_to)
+
+    for name in ('merge_source', 'status', 'currency', 'metadata_type'):
+        value = filters.get(name)
+        if value in (None, '', []):
+            continue
+        if isinstance(value, (list, tuple)):
+            clauses.append(f"{columns[name]} IN ({', '.join(['%s'] * len(value))})")
+            params.extend(value)
+        else:
+            clauses.append(f"{columns[name]} = %s")
+            params.append(value)
+
+    if filters.get('amount_min') not in (None, ''):
+        clauses.append(f"{columns['amount']} >= %s")
+        params.append(decimal.Decimal(str(filters['amount_min'])))
+
+    if filters.get('amount_max') not in (None, ''):
+        clauses.append(f"{columns['amount']} <= %s")
+        params.append(decimal.Decimal(str(filters['amount_max'])))
+
+    return clauses, params
+
+def format_match_row(row):
+    """Render a match row the way the CSV export expects: strings, '' for NULL.
+
+    DECIMAL amounts stay JSON numbers; a DECIMAL(p,2) column prints back
+    as its exact digits.
+    """
+    match = {}
+    for key, value in row.items():
+        if key == '_row_id':
+            continue
+        if value is None:
+            match[key] = ''
+        elif isinstance(value, datetime):
+            match[key] = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, decimal.Decimal):
+            match[key] = float(value)
+        else:
+            match[key] = str(value)
+    return match
+
+def iter_matches(match_type='started', filters=None, page_size=MATCHES_PAGE_SIZE, after=None):
+    """Stream one page of match rows from an unbuffered server-side cursor.
+
+    Yields (match, page_cursor) pairs, where page_cursor is the `after`
+    value that resumes the listing after that row.
+    """
+    table_name = 'started_matches' if match_type == 'started' else 'succeeded_matches'
+    page_size = clamp_page_size(page_size)
+    query, params = build_matches_query(table_name, filters, page_size, after)
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+        cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+        exists = cursor.fetchone() is not None
+        cursor.close()
+        if not exists:
+            raise ValueError(f"Table {table_name} does not exist")
+
         log(f"Executing query: {query} with params: {params}")
-        cursor.execute(query, params)
-        results = cursor.fetchall()
-        log(f"Found {len(results)} matches")
-        
-        # Convert to list of dicts for JSON serialization
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        try:
+            cursor.execute(query, params)
+            for row in cursor:
+                yield format_match_row(row), encode_page_cursor(row['Date'], row['_row_id'])
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+
+def get_matches(match_type='started', filters=None, page_size=MATCHES_PAGE_SIZE, after=None):
+    """Get one page of matches with optional filtering.
+
+    Pages are keyed on (date, id); pass the returned next_cursor as `after`
+    to fetch the following page. next_cursor is None on the last page.
+    """
+    try:
+        log(f"Starting get_matches with type: {match_type} and filters: {filters}")
         matches = []
-        for row in results:
-            match_dict = {}
-            for key, value in row.items():
-                if isinstance(value, datetime):
-                    match_dict[key] = value.strftime('%Y-%m-%d %H:%M:%S')
-                elif isinstance(value, decimal.Decimal):
-                    match_dict[key] = float(value)
-                elif value is None:
-                    match_dict[key] = ''
-                else:
-                    match_dict[key] = str(value)
-            matches.append(match_dict)
-        
+        page_cursor = None
+        for match, page_cursor in iter_matches(match_type, filters, page_size, after):
+            matches.append(match)
+        log(f"Found {len(matches)} matches")
+
+        full_page = len(matches) == clamp_page_size(page_size)
         return True, {
             'matches': matches,
-            'count': len(matches)
+            'count': len(matches),
+            'next_cursor': page_cursor if full_page else None
         }
-        
+
     except Exception as e:
         log(f"Error getting matches: {str(e)}")
         import traceback
         log(f"Traceback: {traceback.format_exc()}")
         return False, str(e)
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+
+def write_matches_ndjson(stream, match_type='started', filters=None, page_size=MATCHES_PAGE_SIZE, after=None):
+    """Write one page of matches as NDJSON, one row per line as it is read.
+
+    The last line is {"next_cursor": ..., "count": ...}.
+    """
+    count = 0
+    page_cursor = None
+    for match, page_cursor in iter_matches(match_type, filters, page_size, after):
+        stream.write(json.dumps(match) + '\n')
+        count += 1
+        if count % 500 == 0:
+            stream.flush()
+
+    full_page = count == clamp_page_size(page_size)
+    stream.write(json.dumps({'next_cursor': page_cursor if full_page else None, 'count': count}) + '\n')
+    stream.flush()
+    return count
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -945,6 +1998,14 @@ if __name__ == "__main__":
     parser.add_argument("--get-matches", action="store_true", help="Get matches")
     parser.add_argument("--match-type", choices=["started", "succeeded"], help="Type of matches to get")
     parser.add_argument("--filters", help="JSON string of filters")
+    parser.add_argument("--page-size", type=int, default=MATCHES_PAGE_SIZE, help="Matches per page")
+    parser.add_argument("--after", help="next_cursor from the previous page")
+    parser.add_argument("--mode", choices=RECONCILIATION_MODES, default="hash", help="Matching engine used by --reconcile")
+    parser.add_argument("--incremental", action="store_true", help="Only reconcile rows loaded since the last run")
+    parser.add_argument("--partitions", type=int, help="Match each pass in this many key-hash shards across processes")
+    parser.add_argument("--workers", type=int, help="Worker processes for --partitions (default: CPU count)")
+    parser.add_argument("--with-balance", action="store_true", help="Also run balance reconciliation on the same ledger scan")
+    parser.add_argument("--from-staging", action="store_true", help="Read inputs from the uploads' Parquet snapshots when current")
     
     args = parser.parse_args()
     log(f"Arguments received: {args}")
@@ -952,7 +2013,13 @@ if __name__ == "__main__":
     if args.reconcile:
         log("Starting reconciliation process...")
         try:
-            success, result = perform_reconciliation()
+            if args.incremental:
+                success, result = perform_incremental_reconciliation(mode=args.mode)
+            else:
+                success, result = perform_reconciliation(
+                    mode=args.mode, partitions=args.partitions, workers=args.workers,
+                    balance=args.with_balance, from_staging=args.from_staging
+                )
             if not success:
                 log(f"Reconciliation failed: {result}")
                 sys.exit(1)
@@ -975,12 +2042,8 @@ if __name__ == "__main__":
         try:
             filters = json.loads(args.filters) if args.filters else None
             log(f"Parsed filters: {filters}")
-            success, result = get_matches(args.match_type, filters)
-            if not success:
-                log(f"Failed to get matches: {result}")
-                sys.exit(1)
-            log("Successfully got matches, printing result...")
-            print(json.dumps(result))
+            count = write_matches_ndjson(sys.stdout, args.match_type, filters, args.page_size, args.after)
+            log(f"Streamed {count} matches")
         except Exception as e:
             log(f"Error processing matches request: {str(e)}")
             import traceback
@@ -0,0 +1,145 @@
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import traceback
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Imported once at startup so requests don't pay for pandas/numpy and dotenv.
+# The service modules import pandas lazily, so it is loaded here explicitly.
+import numpy
+import pandas
+
+import data_processor
+import reconciliation_service
+import transaction_service
+
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
+
+# Methods the Node server can call. Each returns (success, result).
+METHODS = {
+    'process_and_upload_file': data_processor.process_and_upload_file,
+    'perform_reconciliation': reconciliation_service.perform_reconciliation,
+    'perform_incremental_reconciliation': reconciliation_service.perform_incremental_reconciliation,
+    'get_source_data': data_processor.get_source_data,
+    'get_matches': reconciliation_service.get_matches,
+    'get_summary': reconciliation_service.get_summary,
+    'get_transactions': transaction_service.get_transactions
+}
+
+# Methods that rebuild or patch the match tables. Full runs fill fixed
+# shadow tables (see prepare_shadow_tables), so a second run must not start
+# while one is still filling and publishing them; requests run on separate
+# threads, so these wait for each other.
+SERIALIZED_METHODS = {'perform_reconciliation', 'perform_incremental_reconciliation'}
+reconcile_lock = threading.Lock()
+
+# Methods whose result is already a JSON document rather than a Python value
+JSON_RESULT_METHODS = {'get_source_data', 'get_transactions'}
+
+# Methods that write NDJSON to the response as rows are read
+STREAM_METHODS = {
+    'get_matches': reconciliation_service.write_matches_ndjson
+}
+
+def call_method(method, params):
+    """Run one RPC call and return the response body"""
+    if method not in METHODS:
+        return {'success': False, 'error': f"Unknown method: {method}"}
+    if method in SERIALIZED_METHODS:
+        with reconcile_lock:
+            success, result = METHODS[method](**params)
+    else:
+        success, result = METHODS[method](**params)
+    if not success:
+        return {'success': False, 'error': str(result)}
+    if method in JSON_RESULT_METHODS:
+        result = json.loads(result)
+    return {'success': True, 'result': result}
+
+class WorkerRequestHandler(BaseHTTPRequestHandler):
+    """POST /rpc with {"method": ..., "params": {...}}; POST /stream for NDJSON
+    results; GET /health for liveness"""
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'success': False, 'error': 'Not found'})
+
+    def read_request(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def stream(self):
+        """Write NDJSON straight to the socket; the body ends when it closes"""
+        request = self.read_request()
+        method = request.get('method')
+        if method not in STREAM_METHODS:
+            self.send_json(404, {'success': False, 'error': f"Unknown stream method: {method}"})
+            return
+        log(f"Stream call: {method}")
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        writer = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+        try:
+            STREAM_METHODS[method](writer, **(request.get('params') or {}))
+        except Exception as e:
+            # Headers are already sent; report the failure as the last line
+            log(f"Error streaming {method}: {str(e)}")
+            writer.write(json.dumps({'error': str(e)}) + '\n')
+        finally:
+            writer.detach()
+
+    def do_POST(self):
+        if self.path == '/stream':
+            self.stream()
+            return
+        if self.path != '/rpc':
+            self.send_json(404, {'success': False, 'error': 'Not found'})
+            return
+        try:
+            request = self.read_request()
+            method = request.get('method')
+            log(f"RPC call: {method}")
+            response = call_method(method, request.get('params') or {})
+            self.send_json(200 if response['success'] else 500, response)
+        except Exception as e:
+            log(f"Error handling RPC call: {str(e)}")
+            log(f"Traceback: {traceback.format_exc()}")
+            self.send_json(500, {'success': False, 'error': str(e)})
+
+    def log_message(self, format, *args):
+        log(f"{self.address_string()} {format % args}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-lived reconciliation worker')
+    parser.add_argument('--host', default=os.getenv('PYTHON_WORKER_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PYTHON_WORKER_PORT', 5002)))
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), WorkerRequestHandler)
+    log(f"Reconciliation worker listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
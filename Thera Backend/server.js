@@ -5,6 +5,7 @@ const multer = require("multer");
 const XLSX = require("xlsx");
 const path = require("path");
 const { spawn } = require("child_process");
+const http = require("http");
 const mysql = require("mysql2");
 const { Parser } = require("json2csv");
 
@@ -28,10 +29,213 @@ const dbConfig = {
 // Create the connection pool
 const pool = mysql.createPool(dbConfig);
 
+// Long-lived Python worker that serves the data/reconciliation calls
+const workerHost = process.env.PYTHON_WORKER_HOST || "127.0.0.1";
+const workerPort = Number(process.env.PYTHON_WORKER_PORT || 5002);
+let workerProcess = null;
+
+// Upload tuning. Bulk loading uses LOAD DATA LOCAL INFILE, which the MySQL
+// server must allow (local_infile=ON), so it is opt-in.
+const uploadChunksize = Number(process.env.UPLOAD_CHUNKSIZE || 50000);
+const uploadBulkLoad = process.env.UPLOAD_BULK_LOAD === "true";
+
+// Restarts back off exponentially up to WORKER_MAX_DELAY; after
+// PYTHON_WORKER_MAX_RESTARTS failed restarts in a row the worker stays down.
+// A worker that stayed up for WORKER_STABLE_MS resets the count.
+const WORKER_MAX_RESTARTS = Number(process.env.PYTHON_WORKER_MAX_RESTARTS || 5);
+const WORKER_BASE_DELAY = 1000;
+const WORKER_MAX_DELAY = 30000;
+const WORKER_STABLE_MS = 60000;
+const WORKER_READY_TIMEOUT = 30000;
+let workerRestarts = 0;
+
+// Settles once the current worker answers /health; calls wait on it
+let workerReady = Promise.reject(new Error("Python worker is not running"));
+workerReady.catch(() => {});
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Poll the worker's /health until it answers, it exits or the timeout passes
+const waitForWorker = (child) =>
+  new Promise((resolve, reject) => {
+    const deadline = Date.now() + WORKER_READY_TIMEOUT;
+    let closed = false;
+    child.on("close", () => {
+      closed = true;
+    });
+    const retry = () => {
+      if (closed) {
+        reject(new Error("Python worker exited before it was ready"));
+      } else if (Date.now() > deadline) {
+        reject(new Error("Python worker did not become ready"));
+      } else {
+        setTimeout(poll, 200);
+      }
+    };
+    const poll = () => {
+      const request = http.get(
+        { host: workerHost, port: workerPort, path: "/health" },
+        (response) => {
+          response.resume();
+          if (response.statusCode === 200) {
+            resolve();
+          } else {
+            retry();
+          }
+        }
+      );
+      request.on("error", retry);
+    };
+    poll();
+  });
+
+const startWorker = () => {
+  const child = spawn("python", [
+    path.join(__dirname, "reconciliation_worker.py"),
+    "--host",
+    workerHost,
+    "--port",
+    String(workerPort),
+  ]);
+  const startedAt = Date.now();
+  workerProcess = child;
+  workerReady = waitForWorker(child);
+  workerReady.then(
+    () => log("Python worker is ready"),
+    (error) => log(`Python worker not ready: ${error.message}`)
+  );
+
+  child.stderr.on("data", (data) => {
+    log(`Worker: ${data.toString().trim()}`);
+  });
+
+  child.on("error", (error) => {
+    log(`Python worker failed to start: ${error.message}`);
+  });
+
+  child.on("close", (code) => {
+    if (Date.now() - startedAt > WORKER_STABLE_MS) {
+      workerRestarts = 0;
+    }
+    if (workerRestarts >= WORKER_MAX_RESTARTS) {
+      log(
+        `Python worker exited with code: ${code}, giving up after ${workerRestarts} restarts`
+      );
+      workerReady = Promise.reject(new Error("Python worker is not running"));
+      workerReady.catch(() => {});
+      return;
+    }
+    const delay = Math.min(WORKER_BASE_DELAY * 2 ** workerRestarts, WORKER_MAX_DELAY);
+    workerRestarts += 1;
+    log(`Python worker exited with code: ${code}, restarting in ${delay} ms...`);
+    // Calls made while waiting go to the restarted worker
+    workerReady = sleep(delay).then(() => {
+      startWorker();
+      return workerReady;
+    });
+    workerReady.catch(() => {});
+  });
+};
+
+// Wait for a ready worker, following restarts that happen while waiting
+const whenWorkerReady = async () => {
+  for (;;) {
+    const ready = workerReady;
+    try {
+      return await ready;
+    } catch (error) {
+      if (ready === workerReady) {
+        throw error;
+      }
+    }
+  }
+};
+
+// Call a worker method; resolves with its result or rejects with its error.
+// Waits for the worker to be ready first.
+const callWorker = async (method, params = {}) => {
+  await whenWorkerReady();
+  return new Promise((resolve, reject) => {
+    const body = JSON.stringify({ method, params });
+    const request = http.request(
+      {
+        host: workerHost,
+        port: workerPort,
+        path: "/rpc",
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "Content-Length": Buffer.byteLength(body),
+        },
+      },
+      (response) => {
+        let data = "";
+        response.on("data", (chunk) => {
+          data += chunk;
+        });
+        response.on("end", () => {
+          try {
+            const payload = JSON.parse(data);
+            if (payload.success) {
+              resolve(payload.result);
+            } else {
+              reject(new Error(payload.error || "Worker call failed"));
+            }
+          } catch (e) {
+            reject(new Error(`Invalid worker response: ${e.message}`));
+          }
+        });
+      }
+    );
+    request.on("error", reject);
+    request.write(body);
+    request.end();
+  });
+};
+
+// Pipe a worker NDJSON stream straight through to the client
+const streamWorker = async (method, params, res) => {
+  const fail = (error) => {
+    log(`Worker stream error: ${error.message}`);
+    if (!res.headersSent) {
+      res.status(500).json({ error: "Failed to get matches", details: error.message });
+    } else {
+      res.end();
+    }
+  };
+  try {
+    await whenWorkerReady();
+  } catch (error) {
+    return fail(error);
+  }
+  const body = JSON.stringify({ method, params });
+  const request = http.request(
+    {
+      host: workerHost,
+      port: workerPort,
+      path: "/stream",
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "Content-Length": Buffer.byteLength(body),
+      },
+    },
+    (response) => {
+      res.status(response.statusCode);
+      res.setHeader("Content-Type", "application/x-ndjson");
+      response.pipe(res);
+    }
+  );
+  request.on("error", fail);
+  request.write(body);
+  request.end();
+};
+
 app.use(
   cors({
     origin: "http://localhost:3000", // Your frontend URL
     credentials: true,
+    exposedHeaders: ["X-Next-Cursor"],
   })
 );
 app.use(express.json());
@@ -67,44 +271,27 @@ app.post("/api/upload", upload.single("file"), (req, res) => {
     console.log("Source type:", req.body.source);
 
     const sourceType = req.body.source.replace(/ /g, "_"); // Replace spaces with underscores
-    const pythonScriptPath = path.join(__dirname, "data_processor.py");
 
-    console.log("Running Python script:", {
-      script: pythonScriptPath,
+    console.log("Calling Python worker:", {
       file: req.file.path,
       source: sourceType,
     });
 
-    const pythonProcess = spawn("python", [
-      pythonScriptPath,
-      "--file",
-      req.file.path,
-      "--source",
-      sourceType,
-    ]);
-
-    let result = "";
-    let error = "";
-
-    pythonProcess.stdout.on("data", (data) => {
-      result += data.toString();
-      console.log("Python stdout:", data.toString());
-    });
-
-    pythonProcess.stderr.on("data", (data) => {
-      error += data.toString();
-      console.log("Python stderr:", data.toString());
-    });
-
-    pythonProcess.on("close", (code) => {
-      console.log("Python process exited with code:", code);
-      if (code !== 0) {
-        return res
+    callWorker("process_and_upload_file", {
+      file_path: req.file.path,
+      source_type: sourceType,
+      chunksize: uploadChunksize,
+      bulk_load: uploadBulkLoad,
+    })
+      .then((result) => {
+        res.json({ message: "File processed successfully", result });
+      })
+      .catch((error) => {
+        console.error("Worker error:", error.message);
+        res
           .status(500)
-          .json({ message: "Error processing file", error });
-      }
-      res.json({ message: "File processed successfully", result });
-    });
+          .json({ message: "Error processing file", error: error.message });
+      });
   } catch (error) {
     console.error("Server error:", error);
     res
@@ -117,66 +304,22 @@ app.post("/api/upload", upload.single("file"), (req, res) => {
 app.post("/api/reconcile", async (req, res) => {
   try {
     console.log("Starting reconciliation process...");
-    const pythonProcess = spawn("python", [
-      "reconciliation_service.py",
-      "--reconcile",
-    ]);
-
-    let output = "";
-    let errorOutput = "";
-
-    pythonProcess.stdout.on("data", (data) => {
-      const chunk = data.toString();
-      console.log("Python output:", chunk);
-      output += chunk;
-    });
-
-    pythonProcess.stderr.on("data", (data) => {
-      const chunk = data.toString();
-      console.error("Python error:", chunk);
-      errorOutput += chunk;
-    });
+    const method =
+      req.body && req.body.incremental
+        ? "perform_incremental_reconciliation"
+        : "perform_reconciliation";
 
-    pythonProcess.on("close", (code) => {
-      console.log("Python process exited with code:", code);
-
-      if (code !== 0) {
-        return res.status(500).json({
-          error: "Reconciliation failed",
-          details: errorOutput,
-        });
-      }
-
-      try {
-        // Look for the last line that contains JSON
-        const lines = output.split("\n");
-        const jsonLine = lines.find(
-          (line) => line.trim().startsWith("{") && line.trim().endsWith("}")
-        );
-
-        if (!jsonLine) {
-          throw new Error("No JSON found in output");
-        }
-
-        const result = JSON.parse(jsonLine);
-        res.json(result);
-      } catch (e) {
-        console.error("Error parsing Python output:", e);
-        res.status(500).json({
-          error: "Failed to parse reconciliation result",
-          details: e.message,
-          output: output,
-        });
-      }
-    });
-
-    pythonProcess.on("error", (error) => {
-      console.error("Failed to start Python process:", error);
+    try {
+      const result = await callWorker(method);
+      console.log("Reconciliation result:", result);
+      res.json(result);
+    } catch (error) {
+      console.error("Reconciliation failed:", error.message);
       res.status(500).json({
-        error: "Failed to start reconciliation process",
+        error: "Reconciliation failed",
         details: error.message,
       });
-    });
+    }
   } catch (error) {
     console.error("Server error:", error);
     res.status(500).json({
@@ -190,46 +333,10 @@ app.post("/api/reconcile", async (req, res) => {
 app.get("/api/sources/:sourceId", async (req, res) => {
   try {
     const sourceId = req.params.sourceId;
-    const pythonScriptPath = path.join(__dirname, "data_processor.py");
-
-    const pythonProcess = spawn("python", [
-      pythonScriptPath,
-      "--get-source",
-      "--source-id",
-      sourceId,
-    ]);
-
-    let result = "";
-    let error = "";
-
-    pythonProcess.stdout.on("data", (data) => {
-      result += data.toString();
-    });
-
-    pythonProcess.stderr.on("data", (data) => {
-      error += data.toString();
-      console.log("Python stderr:", data.toString());
-    });
-
-    pythonProcess.on("close", (code) => {
-      if (code !== 0) {
-        return res.status(500).json({
-          message: "Error fetching source data",
-          error,
-        });
-      }
-
-      try {
-        const jsonResult = JSON.parse(result);
-        res.json(jsonResult);
-      } catch (parseError) {
-        console.error("Error parsing Python output:", result);
-        res.status(500).json({
-          message: "Error parsing source data",
-          error: parseError.message,
-        });
-      }
+    const result = await callWorker("get_source_data", {
+      source_id: sourceId,
     });
+    res.json(result);
   } catch (error) {
     console.error("Server error:", error);
     res.status(500).json({
@@ -366,49 +473,11 @@ app.post("/api/export-transactions", async (req, res) => {
   // ... implementation similar to your existing export endpoint
 });
 
-// Add this new endpoint
+// Dashboard totals, read from the summary table the reconciliation runs refresh
 app.get("/api/summary", async (req, res) => {
   try {
-    const conn = await mysql.createConnection(dbConfig);
-
-    // Get total transactions
-    const [totalRows] = await conn.execute(
-      "SELECT COUNT(*) as count FROM Thera_Ledger_Transactions"
-    );
-    const totalTransactions = totalRows[0].count;
-
-    // Get reconciled amount
-    const [reconciledRows] = await conn.execute(`
-      SELECT SUM(amount) as total 
-      FROM Thera_Ledger_Transactions 
-      WHERE metadata_stripeBalanceTrxId IS NOT NULL
-    `);
-    const reconciled = reconciledRows[0].total;
-
-    // Get exceptions count
-    const [exceptionRows] = await conn.execute(`
-      SELECT COUNT(*) as count 
-      FROM started_matches 
-      WHERE _merge = 'right_only'
-    `);
-    const exceptions = exceptionRows[0].count;
-
-    // Get pending uploads
-    const [pendingRows] = await conn.execute(`
-      SELECT COUNT(*) as count 
-      FROM Thera_Ledger_Transactions 
-      WHERE metadata_stripeBalanceTrxId IS NULL
-    `);
-    const pending = pendingRows[0].count;
-
-    res.json({
-      totalTransactions: totalTransactions || 0,
-      reconciled: reconciled || 0,
-      exceptions: exceptions || 0,
-      pendingUploads: pending || 0,
-    });
-
-    await conn.end();
+    const summary = await callWorker("get_summary");
+    res.json(summary);
   } catch (error) {
     console.error("Error:", error);
     res.status(500).send("Error fetching summary data");
@@ -424,112 +493,67 @@ app.get("/api/matches", async (req, res) => {
     const filters = {
       date_from: req.query.date_from,
       date_to: req.query.date_to,
+      merge_source: req.query.merge_source,
+      status: req.query.status,
+      currency: req.query.currency,
+      metadata_type: req.query.metadata_type,
+      amount_min: req.query.amount_min,
+      amount_max: req.query.amount_max,
+    };
+    const params = {
+      match_type: matchType,
+      filters,
+      page_size: req.query.page_size ? Number(req.query.page_size) : undefined,
+      after: req.query.after,
     };
 
-    // Get absolute path to Python script
-    const scriptPath = path.join(__dirname, "reconciliation_service.py");
-    log(`Python script path: ${scriptPath}`);
+    // NDJSON: rows are forwarded as the worker reads them
+    if (req.query.format === "ndjson") {
+      return streamWorker("get_matches", params, res);
+    }
 
-    // Verify script exists
-    if (!require("fs").existsSync(scriptPath)) {
-      log(`Error: Python script not found at ${scriptPath}`);
+    let result;
+    try {
+      result = await callWorker("get_matches", params);
+    } catch (error) {
+      log(`Worker error: ${error.message}`);
       return res.status(500).json({
-        error: "Server configuration error",
-        details: "Python script not found",
+        error: "Failed to get matches",
+        details: error.message,
       });
     }
 
-    const pythonArgs = [
-      scriptPath,
-      "--get-matches",
-      "--match-type",
-      matchType,
-      "--filters",
-      JSON.stringify(filters),
-    ];
-
-    log(`Spawning Python process with args: ${JSON.stringify(pythonArgs)}`);
-
-    const pythonProcess = spawn("python", pythonArgs);
-
-    let output = "";
-    let errorOutput = "";
-
-    pythonProcess.stdout.on("data", (data) => {
-      const chunk = data.toString();
-      log(`Python stdout: ${chunk}`);
-      output += chunk;
-    });
-
-    pythonProcess.stderr.on("data", (data) => {
-      const chunk = data.toString();
-      log(`Python stderr: ${chunk}`);
-      errorOutput += chunk;
-    });
-
-    pythonProcess.on("error", (error) => {
-      log(`Failed to start Python process: ${error.message}`);
+    if (!result.matches || !Array.isArray(result.matches)) {
       return res.status(500).json({
-        error: "Failed to start Python process",
-        details: error.message,
+        error: "Invalid response from Python worker",
+        details: "Invalid matches data structure",
       });
-    });
-
-    pythonProcess.on("close", (code) => {
-      log(`Python process exited with code: ${code}`);
-      log(`Full output: ${output}`);
-      if (errorOutput) log(`Full error output: ${errorOutput}`);
-
-      if (code !== 0) {
-        return res.status(500).json({
-          error: "Failed to get matches",
-          details: errorOutput || "Unknown error",
-          code: code,
-        });
-      }
-
-      try {
-        log("Attempting to parse output...");
-        const result = JSON.parse(output);
-        log(`Parsed result: ${JSON.stringify(result)}`);
-
-        if (!result.matches || !Array.isArray(result.matches)) {
-          throw new Error("Invalid matches data structure");
-        }
+    }
 
-        if (result.matches.length === 0) {
-          return res.status(404).json({ error: "No matches found" });
-        }
+    if (result.matches.length === 0) {
+      return res.status(404).json({ error: "No matches found" });
+    }
 
-        // Set headers for CSV download
-        res.setHeader("Content-Type", "text/csv");
-        res.setHeader(
-          "Content-Disposition",
-          `attachment; filename=${matchType}_matches_${
-            new Date().toISOString().split("T")[0]
-          }.csv`
-        );
-
-        // Convert to CSV
-        const parser = new Parser({
-          fields: Object.keys(result.matches[0]),
-          delimiter: ",",
-          quote: '"',
-        });
+    // Set headers for CSV download
+    res.setHeader("Content-Type", "text/csv");
+    if (result.next_cursor) {
+      res.setHeader("X-Next-Cursor", result.next_cursor);
+    }
+    res.setHeader(
+      "Content-Disposition",
+      `attachment; filename=${matchType}_matches_${
+        new Date().toISOString().split("T")[0]
+      }.csv`
+    );
 
-        const csv = parser.parse(result.matches);
-        res.send(csv);
-      } catch (e) {
-        log(`Error processing matches: ${e.message}`);
-        log(`Error stack: ${e.stack}`);
-        res.status(500).json({
-          error: "Invalid response from Python script",
-          details: e.message,
-          output: output,
-          stack: e.stack,
-        });
-      }
+    // Convert to CSV
+    const parser = new Parser({
+      fields: Object.keys(result.matches[0]),
+      delimiter: ",",
+      quote: '"',
     });
+
+    res.send(parser.parse(result.matches));
   } catch (error) {
     log(`Error in /api/matches: ${error.message}`);
     res.status(500).json({
@@ -540,41 +564,49 @@ app.get("/api/matches", async (req, res) => {
 });
 
 // Add this route to handle transaction list requests
-app.get("/api/transactions", (req, res) => {
+app.get("/api/transactions", async (req, res) => {
   const table = req.query.table || "started_matches";
-  const python = spawn("/Users/teitozg/anaconda3/bin/python3", [
-    "transaction_service.py",
-    table,
+  try {
+    const transactions = await callWorker("get_transactions", {
+      table_name: table,
+    });
+    res.json(transactions);
+  } catch (error) {
+    console.error("Worker error:", error.message);
+    res.status(500).json({ error: "Failed to fetch transactions" });
+  }
+});
+
+const PORT = process.env.PORT || 5001;
+
+app.get("/", (req, res) => {
+  res.send("Thera Backend API is running");
+});
+
+// Add any secondary indexes missing from existing tables
+const ensureIndexes = () => {
+  const pythonProcess = spawn("python", [
+    path.join(__dirname, "data_processor.py"),
+    "--ensure-indexes",
   ]);
-  let dataString = "";
 
-  python.stdout.on("data", (data) => {
-    dataString += data.toString();
+  pythonProcess.stdout.on("data", (data) => {
+    log(`Index check: ${data.toString().trim()}`);
   });
 
-  python.stderr.on("data", (data) => {
-    console.error("Python stderr:", data.toString());
+  pythonProcess.stderr.on("data", (data) => {
+    log(`Index check stderr: ${data.toString().trim()}`);
   });
 
-  python.on("close", (code) => {
-    if (code !== 0) {
-      return res.status(500).json({ error: "Failed to fetch transactions" });
-    }
-    try {
-      const transactions = JSON.parse(dataString);
-      res.json(transactions);
-    } catch (e) {
-      res.status(500).json({ error: "Invalid JSON response" });
-    }
+  pythonProcess.on("close", (code) => {
+    log(`Index check exited with code: ${code}`);
   });
-});
-
-const PORT = process.env.PORT || 5001;
+};
 
-app.get("/", (req, res) => {
-  res.send("Thera Backend API is running");
-});
+// Start the worker first; requests that arrive before it is ready wait for it
+startWorker();
 
 app.listen(PORT, () => {
   console.log(`Server is running on port ${PORT}`);
+  ensureIndexes();
 });
@@ -0,0 +1,298 @@
+import re
+import sqlite3
+import uuid
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+import pymysql
+
+# Seconds a connection waits for another writer before failing; the
+# reconciliation passes write their tables from parallel connections
+SQLITE_BUSY_TIMEOUT = 300
+
+def convert_decimal(raw):
+    return Decimal(raw.decode())
+
+def convert_datetime(raw):
+    text = raw.decode()
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        # Unparsed export text kept as-is, as MySQL would reject or zero it
+        return text
+
+# Declared column types read back as the Python types pymysql returns
+sqlite3.register_converter('DECIMAL', convert_decimal)
+sqlite3.register_converter('DATETIME', convert_datetime)
+sqlite3.register_converter('TIMESTAMP', convert_datetime)
+
+def adapt_value(value):
+    """A query parameter as a value sqlite3 can bind"""
+    if value is None or isinstance(value, (str, int, float, bytes)):
+        return value
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if type(value).__module__ == 'numpy':
+        return value.item()
+    return value
+
+PARAMETER = re.compile(r'%%|%s')
+
+def bind(query, args):
+    """Rewrite pymysql's %s placeholders to sqlite's ? and flatten the arguments.
+
+    A list or tuple argument expands to a parenthesised list, as pymysql
+    renders it for `IN %s`.
+    """
+    if args is None:
+        return query, ()
+    args = iter(args if isinstance(args, (list, tuple)) else (args,))
+    values = []
+
+    def placeholder(match):
+        if match.group(0) == '%%':
+            return '%'
+        value = next(args)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            items = [adapt_value(item) for item in value]
+            values.extend(items)
+            return f"({', '.join('?' * len(items))})"
+        values.append(adapt_value(value))
+        return '?'
+
+    return PARAMETER.sub(placeholder, query), values
+
+# MySQL table options and column attributes SQLite has no use for, and the
+# expressions it spells differently
+DDL_REWRITES = [
+    (re.compile(r'\s*CHARACTER SET \w+(?:\s+COLLATE \w+)?', re.I), ''),
+    (re.compile(r'\bINT AUTO_INCREMENT PRIMARY KEY\b', re.I), 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    # Inline secondary indexes; ensure_indexes adds them as CREATE INDEX
+    (re.compile(r',\s*(?:INDEX|KEY)\s*(?:`?\w+`?\s*)?\([^)]*\)', re.I), ''),
+    (re.compile(r'\bUNIQUE KEY\s+`?\w+`?\s*\(', re.I), 'UNIQUE ('),
+    (re.compile(r'\s*ON UPDATE CURRENT_TIMESTAMP(?:\(\d\))?', re.I), ''),
+    (re.compile(r'\bCURRENT_TIMESTAMP\(\d\)', re.I), "(strftime('%Y-%m-%d %H:%M:%f', 'now'))")
+]
+
+EXPRESSION_REWRITES = [
+    (re.compile(r'<=>'), ' IS '),
+    (re.compile(r'\bAS SIGNED\b', re.I), 'AS INTEGER'),
+    (re.compile(r'\bIF\(', re.I), 'iif(')
+]
+
+SHOW_TABLES = re.compile(r'^\s*SHOW TABLES LIKE\s+(.+?)\s*$', re.I | re.S)
+SHOW_COLUMNS = re.compile(r'^\s*SHOW COLUMNS FROM\s+`?(\w+)`?(?:\s+LIKE\s+(.+?))?\s*$', re.I | re.S)
+SHOW_INDEX = re.compile(r'^\s*SHOW INDEX FROM\s+`?(\w+)`?\s*$', re.I | re.S)
+ADD_INDEXES = re.compile(r'^\s*ALTER TABLE\s+`?(\w+)`?\s+(ADD INDEX\b.*)$', re.I | re.S)
+ADD_INDEX = re.compile(r'ADD INDEX\s+`?(\w+)`?\s*\(([^)]*)\)', re.I)
+TRUNCATE = re.compile(r'^\s*TRUNCATE TABLE\s+(`?\w+`?)\s*$', re.I | re.S)
+RENAME_TABLES = re.compile(r'^\s*RENAME TABLE\s+(.+)$', re.I | re.S)
+RENAME_PAIR = re.compile(r'`?(\w+)`?\s+TO\s+`?(\w+)`?', re.I)
+LOAD_DATA = re.compile(r'^\s*LOAD DATA\b', re.I)
+
+def translate(sql):
+    """The SQLite statements for one statement in the MySQL dialect the services use.
+
+    SHOW TABLES/COLUMNS/INDEX become catalog queries with MySQL's column
+    names, ALTER TABLE ... ADD INDEX becomes CREATE INDEX (index names get
+    a unique suffix, since SQLite scopes them to the database rather than
+    the table) and RENAME TABLE becomes one ALTER TABLE per pair inside a
+    savepoint, so the swap stays atomic.
+    """
+    match = SHOW_TABLES.match(sql)
+    if match:
+        return [f"SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE {match.group(1)}"]
+
+    match = SHOW_COLUMNS.match(sql)
+    if match:
+        table_name, pattern = match.groups()
+        where = f" WHERE name LIKE {pattern}" if pattern else ""
+        return [f"""
+            SELECT name AS Field, type AS Type,
+                   CASE WHEN "notnull" THEN 'NO' ELSE 'YES' END AS "Null",
+                   CASE WHEN pk THEN 'PRI' ELSE '' END AS "Key",
+                   dflt_value AS "Default", '' AS Extra
+            FROM pragma_table_info('{table_name}'){where}
+        """]
+
+    match = SHOW_INDEX.match(sql)
+    if match:
+        return [f"""
+            SELECT '{match.group(1)}' AS "Table", NOT "unique" AS Non_unique,
+                   CASE WHEN instr(name, '.') THEN substr(name, 1, instr(name, '.') - 1) ELSE name END AS Key_name
+            FROM pragma_index_list('{match.group(1)}')
+        """]
+
+    match = ADD_INDEXES.match(sql)
+    if match:
+        table_name = match.group(1)
+        return [
+            f'CREATE INDEX "{name}.{uuid.uuid4().hex[:12]}" ON "{table_name}" ({columns})'
+            for name, columns in ADD_INDEX.findall(match.group(2))
+        ]
+
+    match = TRUNCATE.match(sql)
+    if match:
+        return [f"DELETE FROM {match.group(1)}"]
+
+    match = RENAME_TABLES.match(sql)
+    if match:
+        return (["SAVEPOINT rename_tables"] +
+                [f'ALTER TABLE "{old}" RENAME TO "{new}"' for old, new in RENAME_PAIR.findall(match.group(1))] +
+                ["RELEASE rename_tables"])
+
+    if LOAD_DATA.match(sql):
+        raise sqlite3.NotSupportedError("LOAD DATA is not supported by the SQLite backend")
+
+    if re.match(r'^\s*(CREATE|ALTER)\b', sql, re.I):
+        for pattern, replacement in DDL_REWRITES:
+            sql = pattern.sub(replacement, sql)
+    for pattern, replacement in EXPRESSION_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return [sql]
+
+class SQLiteCursor:
+    """DB-API cursor with pymysql's interface over an sqlite3 cursor.
+
+    Rows are dicts for pymysql's dict cursor classes and tuples otherwise;
+    sqlite3 cursors already stream, so the SS variants need nothing extra.
+    """
+
+    def __init__(self, connection, as_dict=False):
+        self.connection = connection
+        self._cursor = connection._conn.cursor()
+        self._as_dict = as_dict
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return dict(zip((column[0] for column in self._cursor.description), row))
+
+    def execute(self, query, args=None):
+        sql, values = bind(query, args)
+        statements = translate(sql)
+        for statement in statements[:-1]:
+            self._cursor.execute(statement)
+        self._cursor.execute(statements[-1], values)
+        return self._cursor.rowcount
+
+    def executemany(self, query, args):
+        args = list(args)
+        if not args:
+            return 0
+        sql, _ = bind(query, args[0])
+        statement, = translate(sql)
+        self._cursor.executemany(statement, ([adapt_value(value) for value in row] for row in args))
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        rows = self._cursor.fetchmany(size or self._cursor.arraysize)
+        return [self._row(row) for row in rows]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def sql_crc32(value):
+    if value is None:
+        return None
+    return zlib.crc32(value if isinstance(value, bytes) else str(value).encode('utf-8'))
+
+def sql_mod(value, divisor):
+    if value is None or divisor in (None, 0):
+        return None
+    return value % divisor
+
+class SQLiteConnection:
+    """pymysql-style connection to an SQLite database file"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(
+            path, timeout=SQLITE_BUSY_TIMEOUT,
+            detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False
+        )
+        self._conn.create_function('CRC32', 1, sql_crc32, deterministic=True)
+        self._conn.create_function('MOD', 2, sql_mod, deterministic=True)
+        if path != ':memory:':
+            # Readers keep going while a pass writes its table
+            self._conn.execute("PRAGMA journal_mode = WAL")
+
+    def cursor(self, cursor_class=None):
+        as_dict = cursor_class is not None and issubclass(cursor_class, pymysql.cursors.DictCursorMixin)
+        return SQLiteCursor(self, as_dict)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect=False):
+        return True
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SQLiteBackend:
+    """Embedded SQLite database file speaking the services' MySQL dialect.
+
+    Each connect() opens a new connection (no pool is needed in-process);
+    MySQL connect overrides such as local_infile are ignored. DECIMAL
+    columns are stored with SQLite's numeric affinity and read back as
+    Decimal, DATETIME/TIMESTAMP columns as datetime.
+    """
+    name = 'sqlite'
+    supports_load_data = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self, **overrides):
+        return SQLiteConnection(self.path)
+
+    def available_connections(self, **overrides):
+        # Connections are not pooled, so there is no limit to wait on
+        return float('inf')
+
+    def close_all(self):
+        pass
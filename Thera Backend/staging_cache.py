@@ -0,0 +1,403 @@
+import hashlib
+import importlib.util
+import json
+import os
+import re
+import sys
+import uuid
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+from money import currency_exponent
+from transaction_records import LOW_CARDINALITY_COLUMNS, record_type
+
+# Typed Parquet copies of uploaded exports, so the same rows need not be
+# parsed from CSV or read back out of MySQL again:
+#   uploads/<table>/<sha256 of the file>.parquet  one per recent upload (see prune_uploads)
+#   tables/<table>.parquet                       the table as the uploads left it
+#   tables/<table>.json                          what that snapshot was built from
+STAGING_DIR = os.getenv('STAGING_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'staging_cache'))
+STAGING_CACHE = os.getenv('STAGING_CACHE', '1') != '0'
+STAGING_COMPRESSION = os.getenv('STAGING_COMPRESSION', 'zstd')
+# Staged uploads kept per table besides those the table snapshot lists
+STAGING_KEEP_UPLOADS = int(os.getenv('STAGING_KEEP_UPLOADS', '3'))
+
+def log(message):
+    print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
+
+def staging_enabled():
+    """True if snapshots are on (STAGING_CACHE) and pyarrow is installed"""
+    return STAGING_CACHE and importlib.util.find_spec('pyarrow') is not None
+
+def file_digest(file_path, block_size=1 << 20):
+    """sha256 of a file's content, read in blocks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def upload_directory(table_name):
+    return os.path.join(STAGING_DIR, 'uploads', table_name)
+
+def upload_path(table_name, digest):
+    return os.path.join(upload_directory(table_name), f"{digest}.parquet")
+
+def table_path(table_name):
+    return os.path.join(STAGING_DIR, 'tables', f"{table_name}.parquet")
+
+def manifest_path(table_name):
+    return os.path.join(STAGING_DIR, 'tables', f"{table_name}.json")
+
+def temporary_path(path):
+    """A sibling of `path` to write to before renaming it into place"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return f"{path}.{uuid.uuid4().hex}.tmp"
+
+DECIMAL_TYPE = re.compile(r'^decimal\((\d+),\s*(\d+)\)')
+
+def arrow_type(sql_type):
+    """Parquet column type for a MySQL column type, so snapshots read back as
+    the Python values pymysql returns (Decimal, datetime, int, str)"""
+    import pyarrow as pa
+    sql_type = sql_type.lower()
+    match = DECIMAL_TYPE.match(sql_type)
+    if match:
+        return pa.decimal128(int(match.group(1)), int(match.group(2)))
+    if sql_type.startswith(('datetime', 'timestamp', 'date')):
+        return pa.timestamp('us')
+    if sql_type.startswith(('int', 'bigint', 'smallint', 'tinyint', 'mediumint')):
+        return pa.int64()
+    if sql_type.startswith(('float', 'double')):
+        return pa.float64()
+    return pa.string()
+
+def snapshot_schema(cursor, table_name, columns):
+    """Arrow schema for an upload's columns, typed from the table they load into
+    (columns are matched case-insensitively, as MySQL does)"""
+    import pyarrow as pa
+    cursor.execute(f"SHOW COLUMNS FROM `{table_name}`")
+    sql_types = {row[0].lower(): row[1] for row in cursor.fetchall()}
+    return pa.schema([
+        (column, arrow_type(sql_types[column.lower()]) if column.lower() in sql_types else pa.string())
+        for column in columns
+    ])
+
+def decimal_array(series, decimal_type):
+    """Decimal column from coerce_columns output: exact text for money, numbers otherwise"""
+    import pyarrow as pa
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(series):
+        # Rounded half up to the column's scale, as MySQL stores them
+        quantum = Decimal(1).scaleb(-decimal_type.scale)
+        values = [None if pd.isna(value) else Decimal(repr(float(value))).quantize(quantum, ROUND_HALF_UP)
+                  for value in series.tolist()]
+        return pa.array(values, type=decimal_type)
+    return pa.array(series.astype('string'), type=pa.string(), from_pandas=True).cast(decimal_type)
+
+def arrow_table(coerced, schema):
+    """A chunk coerced by data_processor.coerce_columns as an Arrow table with `schema`"""
+    import pyarrow as pa
+    import pandas as pd
+    arrays = []
+    for field in schema:
+        series = coerced[field.name]
+        if pa.types.is_decimal(field.type):
+            arrays.append(decimal_array(series, field.type))
+        elif pa.types.is_timestamp(field.type):
+            # Text none of the import formats understood is dropped, as
+            # MySQL would not store it either
+            parsed = pd.to_datetime(series, format='%Y-%m-%d %H:%M:%S', errors='coerce')
+            arrays.append(pa.array(parsed, type=field.type, from_pandas=True))
+        elif pa.types.is_integer(field.type):
+            numeric = pd.to_numeric(series, errors='coerce').round().astype('Int64')
+            arrays.append(pa.array(numeric, type=field.type, from_pandas=True))
+        elif pa.types.is_floating(field.type):
+            arrays.append(pa.array(pd.to_numeric(series, errors='coerce'), type=field.type, from_pandas=True))
+        else:
+            arrays.append(pa.array(series.astype('string'), type=pa.string(), from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+class UploadSnapshot:
+    """Writes the coerced chunks of one upload to its Parquet file.
+
+    The file only appears under its final name once close() succeeds, so a
+    failed or interrupted upload never leaves a partial snapshot behind.
+    """
+
+    def __init__(self, table_name, digest, schema):
+        import pyarrow.parquet as pq
+        self.table_name = table_name
+        self.digest = digest
+        self.schema = schema
+        self.path = upload_path(table_name, digest)
+        self._tmp = temporary_path(self.path)
+        self._writer = pq.ParquetWriter(self._tmp, schema, compression=STAGING_COMPRESSION)
+
+    def write(self, coerced):
+        self._writer.write_table(arrow_table(coerced, self.schema))
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._writer.close()
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+def has_upload(table_name, digest):
+    return os.path.exists(upload_path(table_name, digest))
+
+def read_upload_chunks(table_name, digest, chunksize=None):
+    """Yield a staged upload as typed DataFrames of up to chunksize rows
+    (a single frame without one), in place of parsing its CSV again"""
+    import pyarrow.parquet as pq
+    parquet = pq.ParquetFile(upload_path(table_name, digest))
+    if not chunksize:
+        yield parquet.read().to_pandas()
+        return
+    for batch in parquet.iter_batches(batch_size=chunksize):
+        yield batch.to_pandas()
+
+def read_manifest(table_name):
+    try:
+        with open(manifest_path(table_name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def prune_uploads(table_name, keep=()):
+    """Delete a table's staged uploads except the digests in `keep` and the
+    STAGING_KEEP_UPLOADS most recent ones.
+
+    Stripe exports are full-history files, so without this every monthly
+    re-export would leave another complete copy behind.
+    """
+    directory = upload_directory(table_name)
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith('.parquet')]
+    except OSError:
+        return 0
+    paths = sorted((os.path.join(directory, name) for name in names), key=os.path.getmtime, reverse=True)
+    keep = {upload_path(table_name, digest) for digest in keep}
+    removed = 0
+    for path in paths[STAGING_KEEP_UPLOADS:]:
+        if path not in keep:
+            os.remove(path)
+            removed += 1
+    if removed:
+        log(f"Removed {removed} old staged uploads of {table_name}")
+    return removed
+
+def invalidate_table(table_name):
+    """Forget the table snapshot, e.g. after an upload it could not follow"""
+    for path in (manifest_path(table_name), table_path(table_name)):
+        if os.path.exists(path):
+            os.remove(path)
+    prune_uploads(table_name)
+
+def table_state(conn, table_name):
+    """(row count, latest loaded_at as text or None) of a source table, to tell
+    whether its snapshot still matches it"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM `{table_name}`")
+        rows = cursor.fetchone()[0]
+        cursor.execute(f"SHOW COLUMNS FROM `{table_name}` LIKE 'loaded_at'")
+        if not cursor.fetchone():
+            return rows, None
+        cursor.execute(f"SELECT MAX(loaded_at) FROM `{table_name}`")
+        mark = cursor.fetchone()[0]
+        return rows, None if mark is None else str(mark)
+    finally:
+        cursor.close()
+
+def compact_table(conn, table_name, digest, key_column, previous_state):
+    """Fold a finished upload into the table snapshot.
+
+    The upload REPLACEd rows by key_column, so the snapshot is the previous
+    one plus the upload with only the last row of each key kept, sorted by
+    key like the table's primary key. previous_state is table_state()
+    from before the upload: from an empty table the upload becomes the
+    whole snapshot, and if the previous snapshot does not match it the
+    snapshot is dropped rather than extended.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    manifest = read_manifest(table_name)
+    upload = pq.read_table(upload_path(table_name, digest))
+    key_column = {column.lower(): column for column in upload.column_names}.get(key_column.lower())
+    if previous_state[0] == 0 and key_column is not None:
+        parts, uploads = [upload], [digest]
+    elif (key_column is not None and manifest and os.path.exists(table_path(table_name))
+          and (manifest['rows'], manifest['loaded_at']) == tuple(previous_state)):
+        previous = pq.read_table(table_path(table_name))
+        if previous.schema != upload.schema and set(previous.column_names) == set(upload.column_names):
+            previous = previous.select(upload.column_names).cast(upload.schema)
+        if previous.schema != upload.schema:
+            invalidate_table(table_name)
+            log(f"Staging snapshot of {table_name} dropped: upload columns changed")
+            return False
+        parts, uploads = [previous, upload], manifest['uploads'] + [digest]
+    else:
+        invalidate_table(table_name)
+        log(f"Staging snapshot of {table_name} does not cover the table; it is rebuilt on the next upload into an empty table")
+        return False
+
+    combined = pa.concat_tables(parts).combine_chunks()
+    last = (combined.select([key_column]).append_column('_position', row_numbers(combined.num_rows))
+            .group_by(key_column).aggregate([('_position', 'max')]))
+    order = pc.sort_indices(last, sort_keys=[(key_column, 'ascending')])
+    combined = combined.take(last['_position_max'].take(order))
+
+    rows, mark = table_state(conn, table_name)
+    path = table_path(table_name)
+    tmp = temporary_path(path)
+    pq.write_table(combined, tmp, compression=STAGING_COMPRESSION)
+    os.replace(tmp, path)
+    tmp = temporary_path(manifest_path(table_name))
+    with open(tmp, 'w') as f:
+        json.dump({'uploads': uploads, 'key_column': key_column, 'rows': rows, 'loaded_at': mark}, f)
+    os.replace(tmp, manifest_path(table_name))
+    log(f"Staging snapshot of {table_name}: {combined.num_rows} rows from {len(uploads)} uploads")
+    prune_uploads(table_name, uploads)
+    return True
+
+def filter_expression(filters, columns):
+    """pyarrow expression for a filter in disjunctive normal form.
+
+    `filters` is a list of alternatives, each a list of (column, op, value)
+    conditions that must all hold; op is '==' (case-insensitive for text,
+    like the tables' collation) or 'not null'. Columns the snapshot lacks
+    are NULL, as in the table.
+    """
+    import pyarrow.compute as pc
+    resolved = {column.lower(): column for column in columns}
+    alternatives = []
+    for conjunction in filters:
+        conditions = []
+        for column, op, value in conjunction:
+            column = resolved.get(column.lower())
+            if column is None:
+                conditions.append(pc.scalar(False))
+            elif op == 'not null':
+                conditions.append(pc.field(column).is_valid())
+            elif op == '==' and isinstance(value, str):
+                conditions.append(pc.utf8_lower(pc.field(column)) == value.lower())
+            elif op == '==':
+                conditions.append(pc.field(column) == value)
+            else:
+                raise ValueError(f"Unsupported staging filter operator: {op}")
+        expression = conditions[0]
+        for condition in conditions[1:]:
+            expression = expression & condition
+        alternatives.append(expression)
+    expression = alternatives[0]
+    for alternative in alternatives[1:]:
+        expression = expression | alternative
+    return expression
+
+def row_numbers(count):
+    import numpy as np
+    import pyarrow as pa
+    return pa.array(np.arange(count, dtype='int64'))
+
+def filter_mask(table, filters):
+    """Boolean array: which rows of `table` satisfy `filters` (NULL counts as false)"""
+    import pyarrow.compute as pc
+    positions = row_numbers(table.num_rows)
+    matched = table.append_column('_row', positions).filter(filter_expression(filters, table.column_names))
+    return pc.is_in(positions, value_set=matched['_row'].combine_chunks())
+
+def read_table(conn, table_name, columns, filters=None):
+    """Read `columns` of a source table from its snapshot, or None if there is
+    no snapshot or the table changed since it was written.
+
+    Only the requested columns are decoded and `filters` (see
+    filter_expression) is pushed down into the Parquet scan, so row groups
+    that cannot match are skipped. Columns are matched case-insensitively
+    and returned under the requested names; columns the snapshot lacks are
+    NULL.
+    """
+    if not staging_enabled():
+        return None
+    manifest = read_manifest(table_name)
+    if not manifest or not os.path.exists(table_path(table_name)):
+        return None
+    rows, mark = table_state(conn, table_name)
+    if (rows, mark) != (manifest['rows'], manifest['loaded_at']):
+        log(f"Staging snapshot of {table_name} is stale, reading the database instead")
+        return None
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    dataset = ds.dataset(table_path(table_name), format='parquet')
+    available = {name.lower(): name for name in dataset.schema.names}
+    projected = list(dict.fromkeys(available[c.lower()] for c in columns if c.lower() in available))
+    expression = filter_expression(filters, dataset.schema.names) if filters else None
+    table = dataset.to_table(columns=projected, filter=expression)
+
+    arrays = [table[available[c.lower()]] if c.lower() in available else pa.nulls(table.num_rows, pa.string())
+              for c in columns]
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+def minor_units_array(amounts, currencies):
+    """Decimal amounts as int64 minor units of each row's currency, computed
+    in Arrow (rounded half away from zero, as money.to_minor does)"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if isinstance(amounts, pa.ChunkedArray):
+        amounts = amounts.combine_chunks()
+    if currencies is None:
+        currencies = pa.nulls(len(amounts), pa.string())
+    if isinstance(currencies, pa.ChunkedArray):
+        currencies = currencies.combine_chunks()
+    codes = pc.dictionary_encode(currencies.cast(pa.string()))
+    # One factor per distinct currency; NULL currencies take the last, the default
+    exponents = [currency_exponent(code) for code in codes.dictionary.to_pylist()] + [currency_exponent(None)]
+    factors = pa.array([Decimal(10 ** exponent) for exponent in exponents], type=pa.decimal128(4, 0))
+    index = codes.indices.fill_null(len(exponents) - 1)
+    scaled = pc.round(pc.multiply(amounts, factors.take(index)), ndigits=0, round_mode='half_towards_infinity')
+    return scaled.cast(pa.int64())
+
+def python_column(column, intern=False):
+    """An Arrow column as a list of Python values; with intern, equal strings
+    share one interned object (decoded once per distinct value)"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if pa.types.is_timestamp(column.type):
+        # numpy builds the datetimes far faster than to_pylist (NaT becomes None)
+        return column.to_numpy(zero_copy_only=False).astype('datetime64[us]').astype(object).tolist()
+    if not intern or not pa.types.is_string(column.type):
+        return column.to_pylist()
+    encoded = pc.dictionary_encode(column)
+    values = [sys.intern(value) for value in encoded.dictionary.to_pylist()] + [None]
+    return [values[i] for i in encoded.indices.fill_null(len(values) - 1).to_pylist()]
+
+def table_records(table, float_columns=(), minor_columns=None):
+    """TransactionRecords from an Arrow table, holding the values fetch_records
+    would produce for the same rows. Conversions run column-wise, in Arrow
+    where possible, rather than per row."""
+    import pyarrow as pa
+    columns = {name: table[name] for name in table.column_names}
+    for column, currency_column in (minor_columns or {}).items():
+        if column in columns and pa.types.is_decimal(columns[column].type):
+            columns[column] = minor_units_array(columns[column], columns.get(currency_column))
+    for column in float_columns:
+        if column in columns and pa.types.is_decimal(columns[column].type):
+            columns[column] = columns[column].cast(pa.float64())
+
+    make_record = record_type(columns)
+    values = [python_column(column, name in LOW_CARDINALITY_COLUMNS) for name, column in columns.items()]
+    return list(map(make_record, zip(*values)))
+
+def read_records(conn, table_name, columns, filters=None, float_columns=(), minor_columns=None):
+    """read_table() as TransactionRecords, or None if the snapshot cannot be used"""
+    table = read_table(conn, table_name, columns, filters)
+    if table is None:
+        return None
+    return table_records(table, float_columns, minor_columns)
@@ -0,0 +1,67 @@
+import os
+import re
+import subprocess
+import sys
+
+# Modules the CLIs and the worker import, with the import-time budget of
+# each (milliseconds, cumulative, as reported by python -X importtime)
+IMPORT_BUDGETS_MS = {
+    'database': 150,
+    'money': 25,
+    'transaction_records': 150,
+    'staging_cache': 150,
+    'transaction_service': 200,
+    'reconciliation_service': 250,
+    'data_processor': 250
+}
+
+# Libraries only the DataFrame and Parquet code paths may load
+LAZY_MODULES = ['pandas', 'numpy', 'pyarrow']
+
+# Scale all budgets, e.g. IMPORT_BUDGET_SCALE=2 on a slow CI machine
+BUDGET_SCALE = float(os.getenv('IMPORT_BUDGET_SCALE', 1))
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+\d+ \|\s+(\d+) \|\s?( *)(\S+)$')
+
+def measure_import(module):
+    """Import `module` in a fresh interpreter.
+
+    Returns (cumulative import time in ms, lazy modules it loaded).
+    """
+    script = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+    )
+    cumulative_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and match.group(3) == module and not match.group(2):
+            cumulative_us = int(match.group(1))
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return cumulative_us / 1000, loaded
+
+def check_import_times():
+    failures = []
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        budget *= BUDGET_SCALE
+        elapsed, loaded = measure_import(module)
+        ok = elapsed <= budget and not loaded
+        print(f"[{'OK' if ok else 'FAIL'}] {module}: {elapsed:.1f} ms (budget {budget:.0f} ms)"
+              + (f", loads {', '.join(loaded)}" if loaded else ""))
+        if not ok:
+            failures.append(module)
+
+    if failures:
+        print(f"\n{len(failures)} modules are over their import budget or load pandas/numpy eagerly:")
+        for module in failures:
+            print(f"- {module}")
+        return False
+    print("\nAll modules import within budget")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if check_import_times() else 1)
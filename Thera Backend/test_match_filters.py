@@ -0,0 +1,64 @@
+import sys
+import pymysql
+from database import get_db_connection
+from reconciliation_service import build_matches_query, MATCH_VIEW_COLUMNS
+
+# One entry per filter shape the dashboard sends to get_matches
+FILTER_SHAPES = {
+    'date range': {'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+    'date from': {'date_from': '2024-01-01'},
+    'merge source': {'merge_source': 'stripe_only'},
+    'merge source + date': {'merge_source': 'match', 'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+    'status + date': {'status': 'SUCCEEDED', 'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+    'metadata type + date': {'metadata_type': 'PAY_IN_STARTED', 'date_from': '2024-01-01'},
+    'currency + date': {'currency': 'USD', 'date_from': '2024-01-01', 'date_to': '2024-01-31'},
+    'amount range': {'amount_min': 100, 'amount_max': 500}
+}
+
+# Access types that read only part of an index
+INDEX_ACCESS_TYPES = {'range', 'ref', 'eq_ref', 'const', 'index_merge'}
+
+def explain(cursor, table_name, filters):
+    query, params = build_matches_query(table_name, filters)
+    cursor.execute(f"EXPLAIN {query}", params)
+    return cursor.fetchall()
+
+def check_filter_plans():
+    failures = []
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(pymysql.cursors.DictCursor)
+
+        for table_name in MATCH_VIEW_COLUMNS:
+            cursor.execute("SHOW TABLES LIKE %s", (table_name,))
+            if not cursor.fetchone():
+                print(f"\nTable {table_name} does not exist, skipping")
+                continue
+
+            print(f"\nFilter plans for {table_name}:")
+            for shape, filters in FILTER_SHAPES.items():
+                for plan in explain(cursor, table_name, filters):
+                    ok = plan['type'] in INDEX_ACCESS_TYPES and plan['key'] is not None
+                    print(f"  [{'OK' if ok else 'SCAN'}] {shape}: type={plan['type']} key={plan['key']} rows={plan['rows']} extra={plan['Extra']}")
+                    if not ok:
+                        failures.append((table_name, shape))
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return False
+    finally:
+        if 'cursor' in locals():
+            cursor.close()
+        if 'conn' in locals():
+            conn.close()
+
+    if failures:
+        print(f"\n{len(failures)} filter shapes are not index range scans:")
+        for table_name, shape in failures:
+            print(f"- {table_name}: {shape}")
+        return False
+    print("\nAll filter shapes use an index")
+    return True
+
+if __name__ == "__main__":
+    sys.exit(0 if check_filter_plans() else 1)
@@ -0,0 +1,236 @@
+import json
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+from database import get_db_connection
+from benchmark_reconciliation import synthetic_dataset, write_dataset
+from data_processor import process_and_upload_file
+import reconciliation_service
+import staging_cache
+import transaction_service
+
+# Matcher configurations whose match tables must equal the hash matcher's
+MODES = {
+    'vectorized': {'mode': 'vectorized'},
+    'sql': {'mode': 'sql'},
+    'hash, 4 partitions': {'mode': 'hash', 'partitions': 4, 'workers': 2},
+    'hash from staging': {'mode': 'hash', 'from_staging': True},
+    'vectorized from staging': {'mode': 'vectorized', 'from_staging': True}
+}
+
+# Source tables the reconcilers can read from Parquet snapshots
+STAGED_SOURCES = ['Thera_Stripe_Incoming_Transactions', 'Thera_Ledger_Transactions']
+
+# Ledger rows changed between re-uploads
+EDITED_ROWS = 5
+
+# Text column edited in each Stripe export for the re-upload checks
+STRIPE_EDITS = {
+    'Thera_Stripe_Incoming_Transactions': 'Card Brand',
+    'Thera_Stripe_Balance_Changes': 'description'
+}
+
+# Columns that differ between runs regardless of the matcher
+VOLATILE_COLUMNS = {'id', 'created_at', 'loaded_at', 'row_hash'}
+
+def snapshot(table_name):
+    """The table's rows, without volatile columns, in a stable order"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM `{table_name}`")
+        columns = [description[0] for description in cursor.description]
+        keep = [i for i, column in enumerate(columns) if column not in VOLATILE_COLUMNS]
+        return sorted((tuple(row[i] for i in keep) for row in cursor.fetchall()), key=repr)
+    finally:
+        conn.close()
+
+def max_id(table_name):
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0), COUNT(*) FROM `{table_name}`")
+        return cursor.fetchone()
+    finally:
+        conn.close()
+
+def check(name, ok, detail=''):
+    print(f"[{'OK' if ok else 'FAIL'}] {name}{f': {detail}' if detail else ''}")
+    return ok
+
+def check_sqlite_pipeline(directory, rows=2000):
+    # Read by get_db_connection here and in the partition worker processes
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ['DB_SQLITE_PATH'] = os.path.join(directory, 'thera.sqlite3')
+    staging_cache.STAGING_DIR = os.path.join(directory, 'staging_cache')
+
+    results = []
+    files = write_dataset(synthetic_dataset(rows), directory)
+    for table_name, (path, count) in files.items():
+        success, message = process_and_upload_file(path, table_name, chunksize=500, bulk_load=True)
+        results.append(check(f"upload {table_name}", success, message))
+
+    # The same file again is skipped outright
+    path, count = files['Thera_Ledger_Transactions']
+    success, message = process_and_upload_file(path, 'Thera_Ledger_Transactions')
+    results.append(check("identical re-upload skipped", success and 'already uploaded' in message, message))
+
+    # An edited copy writes only the edited rows; going back to the original file
+    # reads its staged snapshot and rewrites those rows again
+    edited = pd.read_csv(path)
+    edited.loc[:EDITED_ROWS - 1, 'description'] = 'edited'
+    edited_path = os.path.join(directory, 'ledger_edited.csv')
+    edited.to_csv(edited_path, index=False)
+    for name, upload in (('edited', edited_path), ('original', path)):
+        success, message = process_and_upload_file(upload, 'Thera_Ledger_Transactions', chunksize=500)
+        results.append(check(f"{name} re-upload writes {EDITED_ROWS} rows",
+                             success and f"({EDITED_ROWS} new or changed" in message, message))
+    # The Stripe tables are kept across uploads, so a full-history re-export
+    # with a few edits writes only those rows
+    for table_name, column in STRIPE_EDITS.items():
+        stripe_path, _ = files[table_name]
+        edited = pd.read_csv(stripe_path)
+        edited.loc[:EDITED_ROWS - 1, column] = 'edited'
+        edited_stripe_path = os.path.join(directory, f'{table_name}_edited.csv')
+        edited.to_csv(edited_stripe_path, index=False)
+        for name, upload in (('edited', edited_stripe_path), ('original', stripe_path)):
+            success, message = process_and_upload_file(upload, table_name, chunksize=500)
+            results.append(check(f"{name} {table_name} re-upload writes {EDITED_ROWS} rows",
+                                 success and f"({EDITED_ROWS} new or changed" in message, message))
+
+    # A malformed amount fails the upload instead of loading as NULL
+    accounts_path, _ = files['Thera_Ledger_Accounts']
+    malformed = pd.read_csv(accounts_path, dtype=str)
+    malformed.loc[0, 'posted_balance'] = '12,50'
+    malformed_path = os.path.join(directory, 'accounts_malformed.csv')
+    malformed.to_csv(malformed_path, index=False)
+    success, message = process_and_upload_file(malformed_path, 'Thera_Ledger_Accounts')
+    results.append(check("malformed amount rejected", not success and 'posted_balance' in message, message))
+
+    conn = get_db_connection()
+    try:
+        for table_name in STAGED_SOURCES:
+            current = staging_cache.read_table(conn, table_name, ['id']) is not None
+            results.append(check(f"staging snapshot of {table_name} current", current))
+    finally:
+        conn.close()
+
+    success, message = reconciliation_service.perform_reconciliation(mode='hash')
+    results.append(check("reconcile (hash)", success, '' if success else message))
+    expected = {table_name: snapshot(table_name) for table_name in ('started_matches', 'succeeded_matches')}
+    results.append(check("match tables filled", all(expected.values()),
+                         ', '.join(f"{t}: {len(r)} rows" for t, r in expected.items())))
+
+    for name, options in MODES.items():
+        success, message = reconciliation_service.perform_reconciliation(**options)
+        same = success and all(snapshot(t) == rows for t, rows in expected.items())
+        results.append(check(f"reconcile ({name}) matches hash", same, '' if success else message))
+
+    # Editing a few succeeded ledger rows (NULL keys in the started pass) only
+    # rewrites their match rows, and ends where a full run does
+    edited = pd.read_csv(path)
+    succeeded = edited.index[edited['metadata:type'] == 'PAY_IN_SUCCEEDED'][:EDITED_ROWS]
+    edited.loc[succeeded, 'description'] = 'edited again'
+    edited.to_csv(edited_path, index=False)
+    success, message = process_and_upload_file(edited_path, 'Thera_Ledger_Transactions')
+    results.append(check("upload succeeded-row edits", success, message))
+    before = {table_name: max_id(table_name)[0] for table_name in expected}
+    success, message = reconciliation_service.perform_incremental_reconciliation()
+    results.append(check("incremental reconciliation", success, '' if success else message))
+    for table_name, last_id in before.items():
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT COUNT(*) FROM `{table_name}` WHERE id > %s", (last_id,))
+            rewritten = cursor.fetchone()[0]
+        finally:
+            conn.close()
+        results.append(check(f"incremental run rewrites few rows of {table_name}",
+                             0 < rewritten <= 2 * EDITED_ROWS, f"{rewritten} rows"))
+    incremental = {table_name: snapshot(table_name) for table_name in expected}
+    success, message = reconciliation_service.perform_reconciliation(mode='hash')
+    results.append(check("incremental run matches a full run", success and all(
+        snapshot(table_name) == rows for table_name, rows in incremental.items())))
+
+    # A shrinking Stripe re-export that fails some charges, and rows removed
+    # from the sources (as a schema rebuild does): the incremental run drops
+    # their match rows and re-matches their partners, like a full run
+    stripe_path, stripe_rows = files['Thera_Stripe_Incoming_Transactions']
+    subset = pd.read_csv(stripe_path).iloc[:stripe_rows * 9 // 10]
+    subset.loc[subset.index[:EDITED_ROWS], 'Status'] = 'Failed'
+    subset_path = os.path.join(directory, 'stripe_subset.csv')
+    subset.to_csv(subset_path, index=False)
+    success, message = process_and_upload_file(subset_path, 'Thera_Stripe_Incoming_Transactions')
+    results.append(check("upload shrinking Stripe export", success, message))
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for table_name, column in (('Thera_Stripe_Incoming_Transactions', 'id'),
+                                   ('Thera_Ledger_Transactions', 'metadata_paymentId')):
+            cursor.execute(f"SELECT id FROM `{table_name}` WHERE `{column}` IS NOT NULL ORDER BY id DESC LIMIT %s",
+                           (EDITED_ROWS,))
+            removed = tuple(row[0] for row in cursor.fetchall())
+            cursor.execute(f"DELETE FROM `{table_name}` WHERE id IN %s", (removed,))
+        conn.commit()
+    finally:
+        conn.close()
+    success, message = reconciliation_service.perform_incremental_reconciliation()
+    results.append(check("incremental run after removals", success, '' if success else message))
+    incremental = {table_name: snapshot(table_name) for table_name in expected}
+    success, message = reconciliation_service.perform_reconciliation(mode='hash')
+    results.append(check("incremental run after removals matches a full run", success and all(
+        snapshot(table_name) == rows for table_name, rows in incremental.items())))
+
+    success, message = reconciliation_service.perform_balance_reconciliation()
+    results.append(check("balance reconciliation", success, '' if success else message))
+
+    success, message = reconciliation_service.perform_reconciliation(balance=True)
+    results.append(check("reconcile with balance", success and 'balance_reconciliation' in message,
+                         '' if success else message))
+
+    # A failed balance check fails the reconcile call
+    conn = get_db_connection()
+    try:
+        conn.cursor().execute("RENAME TABLE Thera_Ledger_Accounts TO Thera_Ledger_Accounts_away")
+        conn.commit()
+        for name, options in (('', {}), (' (partitioned)', {'partitions': 2})):
+            success, message = reconciliation_service.perform_reconciliation(balance=True, **options)
+            results.append(check(f"balance failure reported{name}", not success, message))
+        conn.cursor().execute("RENAME TABLE Thera_Ledger_Accounts_away TO Thera_Ledger_Accounts")
+        conn.commit()
+    finally:
+        conn.close()
+
+    success, summary = reconciliation_service.get_summary()
+    results.append(check("get_summary", success, '' if success else summary))
+    if success:
+        # Totals stay JSON numbers and the timestamp ISO text
+        numeric = all(isinstance(summary[field], (int, float))
+                      for field in ('totalTransactions', 'reconciled', 'exceptions', 'pendingUploads'))
+        numeric = numeric and all(isinstance(row['amount'], (int, float)) for row in summary['breakdown'])
+        iso = isinstance(summary['refreshedAt'], str) and 'T' in summary['refreshedAt']
+        results.append(check("get_summary types", numeric and iso,
+                             f"reconciled={summary['reconciled']!r}, refreshedAt={summary['refreshedAt']!r}"))
+
+    success, page = reconciliation_service.get_matches('started', {'merge_source': 'match'}, 100)
+    results.append(check("get_matches", success and page['count'] > 0, '' if success else page))
+    if success and page['count']:
+        amount = page['matches'][0]['Amount USD']
+        results.append(check("get_matches amounts are numbers", isinstance(amount, (int, float)), repr(amount)))
+
+    success, transactions = transaction_service.get_transactions('started_matches')
+    results.append(check("get_transactions", success, '' if success else transactions))
+    if success:
+        rows = json.loads(transactions)
+        numeric = all(isinstance(tx[column], (int, float)) or tx[column] is None
+                      for tx in rows for column in transaction_service.AMOUNT_COLUMNS)
+        results.append(check("get_transactions amounts are numbers", numeric and rows, f"{len(rows)} rows"))
+    return all(results)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        ok = check_sqlite_pipeline(directory)
+    sys.exit(0 if ok else 1)
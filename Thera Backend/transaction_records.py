@@ -0,0 +1,97 @@
+import sys
+from decimal import Decimal
+
+import pymysql
+
+from money import currency_exponent, to_minor
+
+# Text columns with a handful of distinct values; interned so every row
+# shares one string object per value
+LOW_CARDINALITY_COLUMNS = {
+    'currency', 'converted_currency', 'status', 'mode', 'payment_source_type',
+    'card_brand', 'link_funding', 'decline_reason', 'seller_message',
+    'currency_USD', 'currency_EUR', 'currency_GBP', 'ledger_id',
+    'metadata_type', 'metadata_payInType'
+}
+
+class TransactionRecord(tuple):
+    """A fetched row stored as a plain tuple, readable by column name.
+
+    Subclasses made by record_type() fix the column list, so a row costs one
+    tuple instead of a dict with a key per column. record['amount'] works
+    like the DictCursor rows the matchers were written against.
+    """
+    __slots__ = ()
+    fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+
+    def keys(self):
+        return self.fields
+
+_record_types = {}
+
+def record_type(columns):
+    """The TransactionRecord subclass for this column list (cached)"""
+    columns = tuple(columns)
+    if columns not in _record_types:
+        _record_types[columns] = type('TransactionRecord', (TransactionRecord,), {
+            '__slots__': (),
+            'fields': columns,
+            '_index': {column: i for i, column in enumerate(columns)}
+        })
+    return _record_types[columns]
+
+def fetch_records(conn, query, params=None, float_columns=(), minor_columns=None):
+    """Stream a query's rows into TransactionRecords.
+
+    Rows are read from an unbuffered cursor and converted one at a time, so
+    the raw result set is never held next to the records. Low-cardinality
+    strings are interned, DECIMAL values in float_columns become floats and
+    amounts in minor_columns ({amount column: currency column}) become int
+    minor units of the row's currency.
+    """
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(query, params)
+        columns = [description[0] for description in cursor.description]
+        make_record = record_type(columns)
+        positions = {column: i for i, column in enumerate(columns)}
+        interned = [i for i, column in enumerate(columns) if column in LOW_CARDINALITY_COLUMNS]
+        floats = [i for i, column in enumerate(columns) if column in float_columns]
+        minors = [(positions[column], positions.get(currency_column))
+                  for column, currency_column in (minor_columns or {}).items() if column in positions]
+
+        records = []
+        for row in cursor:
+            if interned or floats or minors:
+                row = list(row)
+                for i in interned:
+                    if isinstance(row[i], str):
+                        row[i] = sys.intern(row[i])
+                for i in floats:
+                    if isinstance(row[i], Decimal):
+                        row[i] = float(row[i])
+                for i, currency in minors:
+                    if row[i] is not None:
+                        row[i] = to_minor(row[i], currency_exponent(None if currency is None else row[currency]))
+            records.append(make_record(row))
+        return records
+    finally:
+        cursor.close()
+
+def records_frame(transactions, columns):
+    """DataFrame with `columns` from TransactionRecords or DictCursor rows"""
+    import pandas as pd
+    fields = getattr(transactions[0], 'fields', None) if len(transactions) else None
+    if fields is None:
+        return pd.DataFrame.from_records(transactions, columns=columns)
+    return pd.DataFrame.from_records(transactions, columns=list(fields))[list(columns)]
@@ -1,27 +1,17 @@
 import pymysql
 from datetime import datetime
-from dotenv import load_dotenv
-import os
 import sys
 import json
 from decimal import Decimal
-
-load_dotenv()
-
-# MySQL Connection Parameters
-db_params = {
-    "host": os.getenv('DB_HOST', '127.0.0.1'),
-    "user": os.getenv('DB_USER', 'root'),
-    "password": os.getenv('DB_PASSWORD', 'Atenas9democraci.'),
-    "database": os.getenv('DB_NAME', 'thera_final_database'),
-    "port": int(os.getenv('DB_PORT', 3306)),
-    "connect_timeout": 180
-}
+from database import get_db_connection
+from money import amount_number
 
 def log(message):
     print(f"[{datetime.now().isoformat()}] {message}", file=sys.stderr)
 
-# Add this custom JSON encoder
+# Amounts in converted currency, sent as JSON numbers rounded to that currency's decimals
+AMOUNT_COLUMNS = ['stripe_converted_amount', 'stripe_fee']
+
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
@@ -34,7 +24,7 @@ def get_transactions(table_name="started_matches"):
         if table_name not in ["started_matches", "succeeded_matches"]:
             raise ValueError("Invalid table name")
             
-        conn = pymysql.connect(**db_params)
+        conn = get_db_connection()
         cursor = conn.cursor(pymysql.cursors.DictCursor)
         
         cursor.execute(f"""
@@ -59,10 +49,13 @@ def get_transactions(table_name="started_matches"):
         
         transactions = cursor.fetchall()
         
-        # Convert datetime objects to strings
+        # Convert datetime objects to strings and amounts to numbers
         for tx in transactions:
             if tx['stripe_created_date_utc']:
                 tx['stripe_created_date_utc'] = tx['stripe_created_date_utc'].isoformat()
+            for column in AMOUNT_COLUMNS:
+                if tx[column] is not None:
+                    tx[column] = amount_number(tx[column], tx['stripe_converted_currency'])
         
         return True, json.dumps(transactions, cls=DecimalEncoder)
         